@@ -10,15 +10,10 @@
 
 // -------------------------
 // SensorData
+// (generated from raspberry/communication/sensor_data.json, run
+//  'python -m communication.gen_protocol' after changing the schema)
 // -------------------------
-typedef struct {
-  uint16_t motor_encoders[4];
-  bool home_switches[4];
-  uint16_t potentiometers[2];
-  uint16_t ref_diode;
-  float temp_sensor;
-  float imu[6];
-} SensorData;
+#include "sensor_data.h"
 
 // -------------------------
 // Global Variables
@@ -136,41 +131,7 @@ void TaskIMU(void *pvParameters) {
 
 void TaskPrint(void *pvParameters) {
   for (;;) {
-    String msg = "";
-
-    // motor_encoders[4]
-    for (int i = 0; i < 4; i++) {
-      msg += String(sd.motor_encoders[i]);
-      msg += ",";
-    }
-
-    // home_switches[4]
-    for (int i = 0; i < 4; i++) {
-      msg += String((int)sd.home_switches[i]);
-      msg += ",";
-    }
-
-    // potentiometers[2]
-    for (int i = 0; i < 2; i++) {
-      msg += String(sd.potentiometers[i]);
-      msg += ",";
-    }
-
-    // ref_diode
-    msg += String(sd.ref_diode);
-    msg += ",";
-
-    // temp_sensor
-    msg += String(sd.temp_sensor, 3);
-    msg += ",";
-
-    // imu[6]
-    for (int i = 0; i < 6; i++) {
-      msg += String(sd.imu[i], 3);
-      if (i < 5) msg += ",";
-    }
-
-    Serial.println(msg);
+    sensor_data_print_csv(sd, Serial);
     vTaskDelay(PER_PRINT / portTICK_PERIOD_MS);
   }
 }
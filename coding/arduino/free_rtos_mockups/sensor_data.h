@@ -0,0 +1,65 @@
+// Generated by coding/raspberry/communication/gen_protocol.py
+// from sensor_data.json -- do not edit by hand.
+#ifndef SENSOR_DATA_H
+#define SENSOR_DATA_H
+
+#include <stdint.h>
+#include <stdbool.h>
+
+#define SENSOR_DATA_VERSION 1
+#define SENSOR_DATA_SIZE 46
+
+typedef struct __attribute__((packed)) {
+  uint16_t motor_encoders[4];
+  bool home_switches[4];
+  uint16_t potentiometers[2];
+  uint16_t ref_diode;
+  float temp_sensor;
+  float imu[6];
+} SensorData;
+
+#ifdef __cplusplus
+static_assert(sizeof(SensorData) == SENSOR_DATA_SIZE, "SensorData layout mismatch");
+
+// One CSV line in the format protocol.string_to_sensor_data() expects
+template <typename Out> void sensor_data_print_csv(const volatile SensorData &sd, Out &out) {
+  out.print((unsigned int)sd.motor_encoders[0]);
+  out.print(',');
+  out.print((unsigned int)sd.motor_encoders[1]);
+  out.print(',');
+  out.print((unsigned int)sd.motor_encoders[2]);
+  out.print(',');
+  out.print((unsigned int)sd.motor_encoders[3]);
+  out.print(',');
+  out.print((unsigned int)sd.home_switches[0]);
+  out.print(',');
+  out.print((unsigned int)sd.home_switches[1]);
+  out.print(',');
+  out.print((unsigned int)sd.home_switches[2]);
+  out.print(',');
+  out.print((unsigned int)sd.home_switches[3]);
+  out.print(',');
+  out.print((unsigned int)sd.potentiometers[0]);
+  out.print(',');
+  out.print((unsigned int)sd.potentiometers[1]);
+  out.print(',');
+  out.print((unsigned int)sd.ref_diode);
+  out.print(',');
+  out.print(sd.temp_sensor, 3);
+  out.print(',');
+  out.print(sd.imu[0], 3);
+  out.print(',');
+  out.print(sd.imu[1], 3);
+  out.print(',');
+  out.print(sd.imu[2], 3);
+  out.print(',');
+  out.print(sd.imu[3], 3);
+  out.print(',');
+  out.print(sd.imu[4], 3);
+  out.print(',');
+  out.print(sd.imu[5], 3);
+  out.println();
+}
+#endif
+
+#endif  // SENSOR_DATA_H
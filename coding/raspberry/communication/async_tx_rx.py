@@ -0,0 +1,317 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication import protocol
+from communication.mux_tx_rx import SerialManager, FMT_RETRY_PERIOD, CLOCK_SYNC_PERIOD, BAUD_CHECK_TIMEOUT, logger
+
+
+# asyncio flavour of SerialManager: no threads, everything runs in the loop
+#
+#   async with AsyncSerialManager(simulate=False, port=...) as sm:
+#       await sm.send("1.0,2.0,3.0,4.0")
+#       async for msg in sm:
+#           ...
+#
+# Real ports are watched with loop.add_reader()/add_writer() on the pyserial
+# file descriptor. Simulated transports have no descriptor to wait on, so
+# they are polled every SIM_POLL_PERIOD instead. Framing, wire format
+# negotiation and encoding are inherited from SerialManager.
+class AsyncSerialManager(SerialManager):
+
+    SIM_POLL_PERIOD = 0.002  # [s]
+    RECV_QUEUE_SIZE = 1024   # oldest frames are dropped beyond this
+
+    _STOP = object()  # ends 'async for' iteration
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._fd = None
+        self._rx_buf = bytearray()
+        self._tx_buf = bytearray()
+        self._frames = None
+        self._tasks = []
+        self._rel_wake = None  # set when a retransmission deadline may have moved
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._frames = asyncio.Queue()
+        self._rel_wake = asyncio.Event()
+        if self.handshake == 'host' and not self.simulate:
+            await self._loop.run_in_executor(None, self._handshake)
+        self.running.set()
+        try:
+            self._fd = self.ser.fileno()
+        except (AttributeError, OSError):
+            self._fd = None
+        if self._fd is not None:
+            self._loop.add_reader(self._fd, self._on_readable)
+        else:
+            self._tasks.append(asyncio.create_task(self._poll_loop()))
+        if self.wire_format == 'binary':
+            self._tasks.append(asyncio.create_task(self._negotiate_loop()))
+        if self._rel_tx:
+            self._tasks.append(asyncio.create_task(self._retransmit_loop()))
+        if self.clock_sync:
+            self._tasks.append(asyncio.create_task(self._clock_loop()))
+        if self.handshake == 'device':
+            self._tasks.append(asyncio.create_task(self._baud_loop()))
+            self._enqueue(self._ready_line(), channel=protocol.CH_COMMAND)  # like the Arduino at boot
+        logger.info("AsyncSerialManager started")
+        return self
+
+    # Safe to call more than once, and from a task that is being cancelled
+    async def stop(self, flush_timeout=1.0):
+        if not self.running.is_set():
+            return
+        self.running.clear()
+        self.stop_recording()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        try:
+            await asyncio.wait_for(self.drain(), flush_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            logger.warning(f"Dropping {len(self._tx_buf)} unsent bytes")
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._loop.remove_writer(self._fd)
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        self._frames.put_nowait(self._STOP)
+        logger.info("AsyncSerialManager stopped")
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        msg = await self._frames.get()
+        if msg is self._STOP:
+            self._frames.put_nowait(self._STOP)  # for any other iterator
+            raise StopAsyncIteration
+        return msg
+
+    # Next received message, or None after 'timeout' seconds
+    async def recv(self, timeout=None):
+        try:
+            msg = await asyncio.wait_for(self.__anext__(), timeout)
+        except (asyncio.TimeoutError, StopAsyncIteration):
+            return None
+        return msg
+
+    # Same signature as SerialManager.send(); there is no queue to coalesce
+    # in, fill or schedule here, every message goes straight to the port
+    # buffer (the channel is still put in binary frames). Text on a
+    # reliable channel goes through its sender like in SerialManager: it
+    # waits in the sender's backlog while the window is full (False when
+    # the backlog is full too).
+    async def send(self, msg, key=None, timeout=None, channel=protocol.CH_TELEMETRY):
+        with self.lock:
+            sender = self._rel_tx.get(channel)
+            if sender is not None and self.tx_binary and isinstance(msg, str):
+                self._rel_wake.set()
+                return self._send_reliable(sender, channel, msg, key)
+            self._enqueue(self._encode(msg, channel))
+        return True
+
+    async def send_sensor_data(self, sd, channel=protocol.CH_TELEMETRY):
+        return await self.send(sd, channel=channel)
+
+    # Wait until everything sent so far has been handed to the port
+    async def drain(self):
+        while self._tx_buf:
+            await asyncio.sleep(self.SIM_POLL_PERIOD)
+
+    # Called by send() and by the format negotiation: write now, and let the
+    # loop finish the write whenever the port cannot take it all at once
+    def _enqueue(self, data, key=None, channel=None):
+        self._tx_buf += data
+        self.link_stats.frames_out += 1
+        self._write_pending()
+
+    def _write_pending(self):
+        try:
+            if self._fd is None:
+                self.ser.write(bytes(self._tx_buf))
+                n = len(self._tx_buf)
+            else:
+                n = os.write(self._fd, self._tx_buf)
+        except BlockingIOError:
+            n = 0
+        except Exception as e:
+            logger.error(f"TX error: {e}")
+            self.link_stats.tx_errors += 1
+            self._tx_buf.clear()
+            return
+        del self._tx_buf[:n]
+        self.link_stats.bytes_out += n
+        if self._fd is not None:
+            if self._tx_buf:
+                self._loop.add_writer(self._fd, self._write_pending)
+            else:
+                self._loop.remove_writer(self._fd)
+
+    # An error or end of file (hangup, e.g. the other end of a pty closed)
+    # stops reading: the descriptor would stay readable and spin the loop
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data, error = b'', e
+        else:
+            error = "port hung up"
+        if not data:
+            logger.error(f"RX error: {error}")
+            self.link_stats.rx_errors += 1
+            self._loop.remove_reader(self._fd)
+            return
+        self._on_data(data)
+
+    def _on_data(self, data):
+        self.link_stats.bytes_in += len(data)
+        self._rx_buf += data
+        if self.recorder is not None:
+            self._record(time.monotonic(), data)
+        msgs = self._split_frames(self._rx_buf)
+        if msgs:
+            self.on_receive_batch(msgs)
+
+    async def _poll_loop(self):
+        while self.running.is_set():
+            n = self.ser.in_waiting
+            if n:
+                self._on_data(self.ser.read(n))
+            else:
+                await asyncio.sleep(self.SIM_POLL_PERIOD)
+
+    # Kept running once binary: a restarted peer sends us back to CSV
+    async def _negotiate_loop(self):
+        while self.running.is_set():
+            self._negotiate()
+            await asyncio.sleep(FMT_RETRY_PERIOD / 4)
+
+    # Sleeps until the next retransmission deadline, or until a send or an
+    # ack moves it (the TX thread waits on tx_ready for the same reason)
+    async def _retransmit_loop(self):
+        while self.running.is_set():
+            with self.lock:
+                self._retransmit()
+                timeout = self._tx_idle_timeout() or self.SIM_POLL_PERIOD
+            self._rel_wake.clear()
+            try:
+                await asyncio.wait_for(self._rel_wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_reliable(self, channel, kind, payload):
+        result = super()._on_reliable(channel, kind, payload)
+        if kind == protocol.FRAME_REL_ACK:
+            self._rel_wake.set()
+        return result
+
+    # Device side of the handshake: #HELLO is answered by the RX path, a
+    # #BAUD request is carried out here once what was written before it is
+    # out (the echo and the switch block the loop for one short line)
+    async def _baud_loop(self):
+        while self.running.is_set():
+            if self._baud_switch or self._baud_fallback:
+                await self.drain()
+                self._device_baud()
+            await asyncio.sleep(BAUD_CHECK_TIMEOUT / 20)
+
+    # Our clock sync requests, every CLOCK_SYNC_PERIOD once the link is
+    # binary (replies to the peer's requests go out from _on_clock_sync())
+    async def _clock_loop(self):
+        while self.running.is_set():
+            self._send_clock_frames()
+            wait = self._clock_next - time.monotonic() if self.tx_binary else FMT_RETRY_PERIOD / 4
+            await asyncio.sleep(min(CLOCK_SYNC_PERIOD, max(wait, self.SIM_POLL_PERIOD)))
+
+    # Requests are answered right away: with no TX thread to wake, the reply
+    # is written from here
+    def _on_clock_sync(self, payload):
+        super()._on_clock_sync(payload)
+        if self._clock_replies:
+            self._send_clock_frames()
+
+    def _send_clock_frames(self):
+        if not self.tx_binary:
+            return
+        with self.lock:
+            for frame in self._clock_frames():
+                self._enqueue(frame)
+
+    # Messages already received, oldest first, without waiting
+    def recv_batch(self, max_items=None):
+        msgs = []
+        while not self._frames.empty() and (max_items is None or len(msgs) < max_items):
+            msg = self._frames.get_nowait()
+            if msg is self._STOP:
+                self._frames.put_nowait(msg)
+                break
+            msgs.append(msg)
+        return msgs
+
+    def on_receive_batch(self, msgs):
+        self.last_msg = msgs[-1]
+        for msg in msgs:
+            if self._frames.qsize() >= self.RECV_QUEUE_SIZE:
+                self._frames.get_nowait()
+                self.link_stats.recv_dropped += 1
+            self._frames.put_nowait(msg)
+        self.link_stats.recv_queued(self._frames.qsize())
+
+    # send_queue is the number of bytes still waiting for the port here
+    def stats(self):
+        return self.link_stats.snapshot(send_queue=len(self._tx_buf),
+                                        recv_queue=self._frames.qsize() if self._frames else 0,
+                                        **self.clock.snapshot())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="asyncio talker (A/B) over SerialManager")
+    parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
+    parser.add_argument("--port", "-p", default="/dev/ttyACM0", help="Serial port to use when not simulating (e.g. /dev/ttyACM0)")
+    parser.add_argument("--baud", "-b", type=int, default=38400, help="Baud rate for the serial connection")
+    parser.add_argument("--name", "-n", choices=['A', 'B'], required=True, help="Name of this node (A or B) for simulation mode")
+    return parser.parse_args()
+
+
+async def main(args):
+    async with AsyncSerialManager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name) as sm:
+
+        async def talk():
+            counter = 0
+            while True:
+                await sm.send(f"Hello from {args.name} {counter}")
+                counter += 1
+                await asyncio.sleep(1)
+
+        talker = asyncio.create_task(talk())
+        try:
+            async for msg in sm:
+                print(f"[{args.name} RECEIVED] {msg}")
+        finally:
+            talker.cancel()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        print("Ctrl+C pressed — stopping")
@@ -0,0 +1,451 @@
+import os
+import sys
+import json
+import time
+import timeit
+import threading
+import logging
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication import protocol
+from communication.mux_tx_rx import SerialManager, FileBackedFakeSerial, SIM_TRANSPORTS, logger
+from communication.loopback_serial import LoopbackSerial
+from communication.pty_serial import VirtualNullModem
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+
+# Benchmarks for the communication layer
+#
+#   python -m communication.bench -o bench.json
+#   python -m communication.bench -o new.json --baseline bench.json
+#
+# 'codecs' are single-thread ops/s of the protocol functions. 'link' runs two
+# SerialManagers (A sends SensorData, B receives) in this process over each
+# transport, wire format and send rate, and reports msgs/s and the latency
+# from send_sensor_data() to B's on_receive() callback. Rate 0 means as fast
+# as possible (with at most MAX_IN_FLIGHT messages on the way). The JSON
+# also records the git commit, so results from two commits can be compared
+# with --baseline. '--replay FILE' also pushes a session recording (see
+# recorder.py) through a SerialManager as fast as it decodes it, and
+# '--contention' loads one SerialManager from several threads at once.
+
+TRANSPORTS = ('loop', 'shm', 'file', 'pty')
+WIRES = ('csv', 'binary')
+RATES = (100, 1000, 10000, 0)  # [msgs/s]
+DRAIN_TIMEOUT = 2.0  # [s] wait for the last messages after sending stops
+NEGOTIATE_TIMEOUT = 5.0  # [s]
+PTY_BAUD = 100000000
+MAX_IN_FLIGHT = 1000  # rate 0: messages sent but not yet received
+CONTENTION_RATE = 2000  # [msgs/s] per sender thread and from B
+
+
+# ---------------------------------------------------------------------------
+# Codecs
+# ---------------------------------------------------------------------------
+
+def sample_sensor_data():
+    sd = protocol.SensorData()
+    sd.motor_encoders[:] = [511, 255, 127, 63]
+    sd.home_switches[:] = [False, True, False, True]
+    sd.potentiometers[:] = [512, 768]
+    sd.ref_diode = 900
+    sd.temp_sensor = 36.5
+    sd.imu[:] = [0.01, 0.02, 0.03, 0.1, 0.2, 0.3]
+    sd.system_log = "INFO: System OK"
+    return sd
+
+
+# Best of 3 runs of at least 0.2 s each
+def ops_per_s(fn):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return number / min(timer.repeat(3, number))
+
+
+def bench_codecs():
+    sd = sample_sensor_data()
+    line = protocol.sensor_data_to_string(sd)
+    frame = protocol.encode_frame(protocol.FRAME_SENSOR_DATA, protocol.sensor_data_to_bytes(sd))
+    delta_tx = protocol.SensorDeltaEncoder()
+
+    cases = {
+        "csv_encode": lambda: protocol.sensor_data_to_string(sd),
+        "csv_decode": lambda: protocol.string_to_sensor_data(line),
+        "binary_encode": lambda: protocol.encode_frame(protocol.FRAME_SENSOR_DATA, protocol.sensor_data_to_bytes(sd)),
+        "binary_decode": lambda: protocol.bytes_to_sensor_data(protocol.decode_frame(frame)[1]),
+        "delta_encode": lambda: delta_tx.encode(sd),
+    }
+    if protocol.np is not None:
+        lines = [line] * 1000
+        batch = ops_per_s(lambda: protocol.strings_to_sensor_array(lines))
+    results = {name: ops_per_s(fn) for name, fn in cases.items()}
+    if protocol.np is not None:
+        results["csv_decode_batch"] = batch * len(lines)  # lines/s
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Link
+# ---------------------------------------------------------------------------
+
+def available_transports():
+    names = [t for t in TRANSPORTS if t in SIM_TRANSPORTS]
+    if serial is not None and hasattr(os, 'openpty'):
+        names.append('pty')
+    return names
+
+
+# Sender/receiver pair over one transport, reused for all rates
+class LinkPair:
+
+    def __init__(self, transport, wire):
+        self.transport = transport
+        self.modem = None
+        if transport == 'pty':
+            # unthrottled pty: a high baud so SerialManager's TX pacing does not limit it
+            self.modem = VirtualNullModem().start()
+            # no device on the other end to answer the startup handshake
+            kwargs_a = dict(simulate=False, port=self.modem.port_a, baud=PTY_BAUD, handshake=None)
+            kwargs_b = dict(simulate=False, port=self.modem.port_b, baud=PTY_BAUD, handshake=None)
+        else:
+            if transport == 'loop':
+                LoopbackSerial.reset()
+            kwargs_a = dict(name='A', transport=transport)
+            kwargs_b = dict(name='B', transport=transport)
+        self.a = SerialManager(wire_format='auto' if wire == 'binary' else 'csv', **kwargs_a)
+        self.b = SerialManager(wire_format=wire, **kwargs_b)
+        logger.setLevel(logging.WARNING)
+
+        self.send_times = {}
+        self.recv_times = {}
+        self.b.on_receive = self._on_receive
+        self.a.start()
+        self.b.start()
+        if wire == 'binary':
+            deadline = time.monotonic() + NEGOTIATE_TIMEOUT
+            while not (self.a.tx_binary and self.b.rx_binary) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            if not self.a.tx_binary:
+                raise RuntimeError(f"{transport}: binary wire format not negotiated")
+
+    # Sequence number travels in motor_encoders[0:2]
+    def _on_receive(self, msg):
+        t = time.perf_counter()
+        try:
+            sd = protocol.decode_sensor_data(msg)
+        except ValueError:
+            return
+        self.recv_times[sd.motor_encoders[0] | sd.motor_encoders[1] << 16] = t
+
+    def run(self, rate, duration):
+        self.send_times.clear()
+        self.recv_times.clear()
+        sd = sample_sensor_data()
+        seq = 0
+        start = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now - start >= duration:
+                break
+            if not rate and seq - len(self.recv_times) >= MAX_IN_FLIGHT:
+                time.sleep(0.0001)
+                continue
+            due = int((now - start) * rate) + 1 if rate else seq + 1
+            if seq >= due:
+                time.sleep(min(0.001, (due - (now - start) * rate) / rate))
+                continue
+            while seq < due:
+                sd.motor_encoders[0] = seq & 0xFFFF
+                sd.motor_encoders[1] = seq >> 16
+                self.send_times[seq] = time.perf_counter()
+                self.a.send_sensor_data(sd)
+                seq += 1
+        sent = seq
+
+        # wait until everything arrived or nothing more arrives
+        last, deadline = -1, time.monotonic() + DRAIN_TIMEOUT
+        while len(self.recv_times) < sent and time.monotonic() < deadline:
+            if len(self.recv_times) != last:
+                last, deadline = len(self.recv_times), time.monotonic() + DRAIN_TIMEOUT
+            time.sleep(0.01)
+
+        received = dict(self.recv_times)
+        latencies = sorted(received[s] - self.send_times[s] for s in received if s in self.send_times)
+        elapsed = (max(received.values()) - start) if received else duration
+        return {
+            "transport": self.transport,
+            "wire": "binary" if self.a.tx_binary else "csv",
+            "rate": rate,
+            "sent": sent,
+            "received": len(received),
+            "lost": sent - len(received),
+            "msgs_per_s": len(received) / elapsed,
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p99": percentile(latencies, 99),
+                "max": percentile(latencies, 100),
+            },
+        }
+
+    def close(self):
+        self.a.stop()
+        self.b.stop()
+        if self.modem is not None:
+            self.modem.stop()
+        for ser in (self.a.ser, self.b.ser):
+            if hasattr(ser, 'unlink'):
+                ser.unlink()
+            if isinstance(ser, FileBackedFakeSerial):
+                for path in (ser.write_file, ser.read_file):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+# p-th percentile of sorted latencies [s], in ms
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))] * 1e3
+
+
+def bench_link(transports, wires, rates, duration):
+    results = []
+    for transport in transports:
+        for wire in wires:
+            pair = LinkPair(transport, wire)
+            try:
+                for rate in rates:
+                    res = pair.run(rate, duration)
+                    results.append(res)
+                    print(format_link(res), file=sys.stderr)
+            finally:
+                pair.close()
+    return results
+
+
+def format_link(res):
+    lat = res["latency_ms"]
+    p50 = f"{lat['p50']:.3f}" if lat["p50"] is not None else "-"
+    p99 = f"{lat['p99']:.3f}" if lat["p99"] is not None else "-"
+    return (f"{res['transport']:>5} {res['wire']:>6} rate={res['rate'] or 'max':>6}: "
+            f"{res['msgs_per_s']:10.0f} msgs/s  p50={p50} ms  p99={p99} ms  lost={res['lost']}")
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def bench_replay(path):
+    sm = SerialManager.replay(path, speed=0)
+    logger.setLevel(logging.WARNING)
+    count = [0]
+    sm.on_receive_batch = lambda msgs: count.__setitem__(0, count[0] + len(msgs))
+    start = time.perf_counter()
+    sm.start()
+    sm.ser.done.wait()  # set by the RX thread once it has decoded the last read
+    elapsed = time.perf_counter() - start
+    stats = sm.stats()
+    sm.stop()
+    res = {
+        "file": os.path.basename(path),
+        "msgs": count[0],
+        "bytes": stats["bytes_in"],
+        "parse_errors": stats["parse_errors"],
+        "msgs_per_s": count[0] / elapsed,
+        "mb_per_s": stats["bytes_in"] / elapsed / 1e6,
+    }
+    print(f"replay {res['file']}: {res['msgs_per_s']:10.0f} msgs/s  {res['mb_per_s']:.1f} MB/s", file=sys.stderr)
+    return res
+
+
+# ---------------------------------------------------------------------------
+# Contention
+# ---------------------------------------------------------------------------
+
+# 'senders' threads call A.send_sensor_data() while B streams SensorData
+# back to A and a consumer thread drains A.recv_batch(), so A's TX thread,
+# RX thread, senders and consumer all use its queues at the same time.
+# Reports how long send() calls take and what gets through each way.
+def bench_contention(senders, duration, rate=CONTENTION_RATE):
+    LoopbackSerial.reset()
+    a = SerialManager(name='A', transport='loop', wire_format='auto')
+    b = SerialManager(name='B', transport='loop', wire_format='binary')
+    logger.setLevel(logging.WARNING)
+    b_received = [0]
+    b.on_receive_batch = lambda msgs: b_received.__setitem__(0, b_received[0] + len(msgs))
+    a.start()
+    b.start()
+    deadline = time.monotonic() + NEGOTIATE_TIMEOUT
+    while not (a.tx_binary and b.tx_binary) and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    stop = threading.Event()
+    latencies = [[] for _ in range(senders)]
+    a_received = [0]
+
+    def paced(send):
+        start, n = time.perf_counter(), 0
+        while not stop.is_set():
+            if n < (time.perf_counter() - start) * rate:
+                send()
+                n += 1
+            else:
+                time.sleep(0.0005)
+
+    def sender(lat):
+        sd = sample_sensor_data()
+
+        def send():
+            t = time.perf_counter()
+            a.send_sensor_data(sd)
+            lat.append(time.perf_counter() - t)
+        paced(send)
+
+    def consumer():
+        while not stop.is_set():
+            a_received[0] += len(a.recv_batch())
+            time.sleep(0.001)
+
+    sd = sample_sensor_data()
+    threads = [threading.Thread(target=sender, args=(lat,)) for lat in latencies]
+    threads.append(threading.Thread(target=paced, args=(lambda: b.send_sensor_data(sd),)))
+    threads.append(threading.Thread(target=consumer))
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    last, deadline = -1, time.monotonic() + DRAIN_TIMEOUT
+    while b_received[0] != last and time.monotonic() < deadline:
+        last = b_received[0]
+        time.sleep(0.1)
+    a_received[0] += len(a.recv_batch())
+    a.stop()
+    b.stop()
+
+    calls = sorted(t for lat in latencies for t in lat)
+    res = {
+        "senders": senders,
+        "rate": rate,
+        "sends_per_s": len(calls) / elapsed,
+        "send_us": {
+            "p50": percentile(calls, 50) * 1e3,
+            "p99": percentile(calls, 99) * 1e3,
+            "max": percentile(calls, 100) * 1e3,
+        },
+        "a_to_b_per_s": b_received[0] / elapsed,
+        "a_to_b_lost": len(calls) - b_received[0],
+        "b_to_a_per_s": a_received[0] / elapsed,
+    }
+    print(format_contention(res), file=sys.stderr)
+    return res
+
+
+def format_contention(res):
+    lat = res["send_us"]
+    return (f"contention {res['senders']} senders: {res['sends_per_s']:8.0f} sends/s  "
+            f"send() p50={lat['p50']:.1f} us p99={lat['p99']:.1f} us max={lat['max']:.0f} us  "
+            f"A->B {res['a_to_b_per_s']:.0f} msgs/s (lost {res['a_to_b_lost']})  B->A {res['b_to_a_per_s']:.0f} msgs/s")
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                             capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def metadata():
+    return {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": protocol.np is not None,
+    }
+
+
+# Print the relative change of every number also found in 'baseline'
+def compare(results, baseline):
+    print(f"vs {baseline['meta'].get('commit')}:", file=sys.stderr)
+    for name, ops in results.get("codecs", {}).items():
+        old = baseline.get("codecs", {}).get(name)
+        if old:
+            print(f"  {name:>16}: {ops / old - 1:+7.1%} ops/s", file=sys.stderr)
+    old_link = {(r["transport"], r["wire"], r["rate"]): r for r in baseline.get("link", [])}
+    for res in results.get("link", []):
+        old = old_link.get((res["transport"], res["wire"], res["rate"]))
+        if old and old["msgs_per_s"] and old["latency_ms"]["p99"] and res["latency_ms"]["p99"]:
+            print(f"  {res['transport']:>5} {res['wire']:>6} rate={res['rate'] or 'max':>6}: "
+                  f"{res['msgs_per_s'] / old['msgs_per_s'] - 1:+7.1%} msgs/s, "
+                  f"{res['latency_ms']['p99'] / old['latency_ms']['p99'] - 1:+7.1%} p99", file=sys.stderr)
+    old = baseline.get("contention")
+    res = results.get("contention")
+    if old and res and (old["senders"], old["rate"]) == (res["senders"], res["rate"]):
+        print(f"  contention: {res['send_us']['p99'] / old['send_us']['p99'] - 1:+7.1%} send() p99, "
+              f"{res['b_to_a_per_s'] / old['b_to_a_per_s'] - 1:+7.1%} B->A msgs/s", file=sys.stderr)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput/latency benchmarks for the communication layer")
+    parser.add_argument("--output", "-o", help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--transports", "-t", nargs="+", choices=TRANSPORTS, help="Transports to run (default: all available)")
+    parser.add_argument("--wires", "-w", nargs="+", choices=WIRES, default=list(WIRES), help="Wire formats to run")
+    parser.add_argument("--rates", "-r", nargs="+", type=int, default=list(RATES), help="Send rates [msgs/s], 0 = as fast as possible")
+    parser.add_argument("--duration", "-d", type=float, default=2.0, help="Seconds per link run")
+    parser.add_argument("--skip-codecs", action="store_true", help="Only run the link benchmarks")
+    parser.add_argument("--skip-link", action="store_true", help="Only run the codec benchmarks")
+    parser.add_argument("--replay", help="Also decode this session recording as fast as possible")
+    parser.add_argument("--contention", type=int, nargs="?", const=4, default=None, metavar="SENDERS",
+                        help="Also run the contention benchmark with this many sender threads (default 4)")
+    parser.add_argument("--contention-rate", type=int, default=CONTENTION_RATE, help="Send rate of each contention thread [msgs/s]")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {"meta": metadata()}
+    if not args.skip_codecs:
+        results["codecs"] = bench_codecs()
+        for name, ops in results["codecs"].items():
+            print(f"{name:>16}: {ops:12.0f} ops/s", file=sys.stderr)
+    if not args.skip_link:
+        transports = args.transports or available_transports()
+        results["link"] = bench_link(transports, args.wires, args.rates, args.duration)
+    if args.replay:
+        results["replay"] = bench_replay(args.replay)
+    if args.contention:
+        results["contention"] = bench_contention(args.contention, args.duration, args.contention_rate)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
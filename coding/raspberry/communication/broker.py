@@ -0,0 +1,528 @@
+import os
+import sys
+import json
+import time
+import socket
+import struct
+import argparse
+import selectors
+import threading
+from collections import deque
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication import protocol
+from communication.mux_tx_rx import SerialManager, link_bauds, logger
+
+
+# Local broker: one process owns the serial link, any number of others
+# (dashboards, recorders, the control UI) share it over a UNIX socket
+#
+#   python -m communication.broker -p /dev/ttyACM0      owns the port
+#   sm = BrokerClient()                                 instead of SerialManager(...)
+#
+# The broker runs a normal SerialManager (handshake, wire format, reliable
+# command channel, clock sync all stay on the link) and publishes what it
+# decodes as records:
+#
+#   record = kind (u8) | channel (u8) | time (f64) | length (u32) | payload
+#
+#   REC_DATA     binary SensorData payload, as received
+#   REC_TEXT     utf-8 text (CSV lines, commands, logs)
+#   REC_LOG      system_log changed to this text (on_log())
+#   REC_LOG_DEF  FRAME_LOG_DEF payload, to decode interned system_log IDs
+#   REC_STATS    JSON of the link's SerialManager.stats(), every STATS_PERIOD
+#
+# 'time' is the message timestamp (see SerialManager.msg_time), in
+# time.monotonic() seconds, which is the same clock in every process of the
+# host. Each read is encoded once and the same bytes are queued for every
+# subscriber; the broker thread writes them out when the socket has room.
+# A subscriber that falls more than 'backlog' bytes behind loses its oldest
+# queued reads instead of slowing the link or the others down.
+#
+# Subscribers send the same records back (time unused, payload = key length
+# (u8) | key | message) and the broker queues them on the link with
+# SerialManager.send(), so keys coalesce across subscribers: the newest
+# "setpoint" wins, whoever sent it. REC_CTRL (JSON) starts/stops recording.
+#
+# The same records carry the link of ProcessSerialManager (process_link.py)
+# through shared memory.
+
+BROKER_PATH = "/tmp/osmd_link.sock"
+BROKER_BACKLOG = 4 << 20  # [bytes] queued per subscriber
+RECORD = struct.Struct("<BBdI")
+REC_DATA = 1
+REC_TEXT = 2
+REC_LOG = 3
+REC_LOG_DEF = 4
+REC_STATS = 5
+REC_CTRL = 6
+RECONNECT_PERIOD = 1.0  # [s]
+STATS_PERIOD = 1.0  # [s]
+
+
+def _record(kind, channel, t, payload):
+    return RECORD.pack(kind, channel, t, len(payload)) + payload
+
+
+def _message_record(msg, channel, t):
+    if isinstance(msg, str):
+        return _record(REC_TEXT, channel, t, msg.encode('utf-8'))
+    return _record(REC_DATA, channel, t, msg)
+
+
+# Complete records at the start of 'buf' as (kind, channel, time, payload),
+# removed from it
+def _split_records(buf):
+    records = []
+    pos = 0
+    while pos + RECORD.size <= len(buf):
+        kind, channel, t, n = RECORD.unpack_from(buf, pos)
+        if pos + RECORD.size + n > len(buf):
+            break
+        records.append((kind, channel, t, bytes(buf[pos + RECORD.size:pos + RECORD.size + n])))
+        pos += RECORD.size + n
+    del buf[:pos]
+    return records
+
+
+class _Subscriber:
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.outbox = deque()  # chunks of records, outbox[0] is being written
+        self.offset = 0        # bytes of outbox[0] already written
+        self.queued = 0        # bytes in outbox
+        self.dropped = 0       # bytes dropped, subscriber too slow
+        self.rx = bytearray()
+        self.writing = False   # registered for EVENT_WRITE
+
+
+# Hooks 'sm' so that what it receives is encoded into records once and
+# handed to publish(chunk) (from its RX thread), and applies the records
+# sent back to it
+class RecordPublisher:
+
+    def __init__(self, sm, publish):
+        self.sm = sm
+        self.publish = publish
+        self._logs = {}  # log table the readers have
+        sm.on_receive_batch = self._on_batch
+        sm.on_log = lambda text: self._emit(_record(REC_LOG, protocol.CH_TELEMETRY, time.monotonic(),
+                                                    text.encode('utf-8')))
+        for channel in range(protocol.CH_TELEMETRY + 1, protocol.MAX_CHANNEL + 1):
+            sm.set_receiver(channel, lambda msg, channel=channel: self._emit(
+                _message_record(msg, channel, self.sm.msg_time)))
+
+    def _on_batch(self, msgs):
+        self.sm.last_msg = msgs[-1]
+        self._emit(b''.join([_message_record(msg, protocol.CH_TELEMETRY, t)
+                             for msg, t in zip(msgs, self.sm.rx_times)]))
+
+    def _emit(self, chunk):
+        if self.sm.logs != self._logs:
+            chunk = _log_defs(self.sm.logs, self._logs) + chunk
+            self._logs = dict(self.sm.logs)
+        self.publish(chunk)
+
+    # What a reader joining now has missed: log table, current log
+    def hello(self):
+        hello = _log_defs(self._logs, {})
+        if self.sm.last_log:
+            hello += _record(REC_LOG, protocol.CH_TELEMETRY, time.monotonic(), self.sm.last_log.encode('utf-8'))
+        return hello
+
+    def stats_record(self, **extra):
+        return _record(REC_STATS, protocol.CH_TELEMETRY, time.monotonic(),
+                       json.dumps({**self.sm.stats(), **extra}).encode('utf-8'))
+
+    # A record sent back by a reader: messages go on the link. A malformed
+    # one (or a recording that cannot be opened) is logged and dropped, it
+    # must not take the link down for the other readers.
+    def on_record(self, kind, channel, payload):
+        try:
+            self._on_record(kind, channel, payload)
+        except (ValueError, OSError) as e:
+            logger.warning(f"Dropped record of kind {kind} from a reader: {e}")
+
+    def _on_record(self, kind, channel, payload):
+        key_len = payload[0] if payload else 0
+        key = payload[1:1 + key_len].decode('utf-8') if key_len else None
+        body = payload[1 + key_len:]
+        if kind == REC_TEXT:
+            self.sm.send(body.decode('utf-8', errors='replace'), key=key, channel=channel)
+        elif kind == REC_DATA:
+            self.sm.send(protocol.bytes_to_sensor_data(body), key=key, channel=channel)
+        elif kind == REC_CTRL:
+            ctrl = json.loads(body)
+            if not isinstance(ctrl, dict):
+                raise ValueError(f"Control record is not an object: {ctrl!r}")
+            if ctrl.get("record"):
+                self.sm.start_recording(ctrl["record"])
+            else:
+                self.sm.stop_recording()
+
+
+def _log_defs(logs, known):
+    return b''.join([_record(REC_LOG_DEF, protocol.CH_TELEMETRY, 0.0, bytes([i]) + text.encode('utf-8'))
+                     for i, text in logs.items() if known.get(i) != text])
+
+
+# Owns 'sm' (a SerialManager, not started yet) and serves its messages on 'path'
+class LinkBroker:
+
+    def __init__(self, sm, path=BROKER_PATH, backlog=BROKER_BACKLOG):
+        self.sm = sm
+        self.path = path
+        self.backlog = backlog
+        self.subscribers = []
+        self.lock = threading.Lock()  # subscriber list and outboxes
+        self.running = threading.Event()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_w, False)
+        self._woken = False
+        self.publisher = RecordPublisher(sm, self._fanout)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    def start(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                probe.close()
+                raise RuntimeError(f"A broker is already serving {self.path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(self.path)  # left over from a broker that died
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        self._listener.listen()
+        self._listener.setblocking(False)
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self.running.set()
+        self.thread.start()
+        self.sm.start()
+        logger.info(f"Broker serving {self.path}")
+
+    def stop(self):
+        self.running.clear()
+        self.sm.stop()
+        self._wake()
+        self.thread.join(1.0)
+        for sub in list(self.subscribers):
+            self._drop(sub)
+        self._listener.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        logger.info("Broker stopped")
+
+    # Queue a chunk of records for every subscriber (RX thread: the same
+    # bytes for all of them)
+    def _fanout(self, chunk):
+        with self.lock:
+            for sub in self.subscribers:
+                sub.outbox.append(chunk)
+                sub.queued += len(chunk)
+                # never outbox[0]: it may be half written
+                while sub.queued > self.backlog and len(sub.outbox) > 1:
+                    dropped = sub.outbox[1]
+                    del sub.outbox[1]
+                    sub.queued -= len(dropped)
+                    sub.dropped += len(dropped)
+            if self.subscribers:
+                self._wake()
+
+    # Wake the broker thread (call with lock held)
+    def _wake(self):
+        if not self._woken:
+            self._woken = True
+            try:
+                os.write(self._wake_w, b'\x00')
+            except (BlockingIOError, OSError):
+                pass
+
+    # -- broker thread: accept, read commands, write queued chunks ------------
+
+    def _serve(self):
+        next_stats = time.monotonic() + STATS_PERIOD
+        while self.running.is_set():
+            if time.monotonic() >= next_stats:
+                next_stats += STATS_PERIOD
+                self._fanout(self.publisher.stats_record(subscribers=len(self.subscribers)))
+            for key, events in self._selector.select(timeout=max(0.0, next_stats - time.monotonic())):
+                if key.fileobj is self._listener:
+                    self._accept()
+                elif key.fileobj == self._wake_r:
+                    os.read(self._wake_r, 4096)
+                    with self.lock:
+                        self._woken = False
+                        subs = [sub for sub in self.subscribers if sub.outbox]
+                    for sub in subs:
+                        self._flush(sub)
+                else:
+                    sub = key.data
+                    if events & selectors.EVENT_READ:
+                        self._read(sub)
+                    if events & selectors.EVENT_WRITE and sub in self.subscribers:
+                        self._flush(sub)
+
+    def _accept(self):
+        try:
+            sock, _ = self._listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        sub = _Subscriber(sock)
+        with self.lock:  # no log definition can slip between hello() and the first chunk
+            hello = self.publisher.hello()
+            if hello:
+                sub.outbox.append(hello)
+                sub.queued = len(hello)
+            self.subscribers.append(sub)
+        self._selector.register(sock, selectors.EVENT_READ, sub)
+        logger.info(f"Subscriber connected ({len(self.subscribers)} now)")
+        self._flush(sub)
+
+    def _drop(self, sub):
+        with self.lock:
+            if sub not in self.subscribers:
+                return
+            self.subscribers.remove(sub)
+        self._selector.unregister(sub.sock)
+        sub.sock.close()
+        lost = f", {sub.dropped} bytes dropped (too slow)" if sub.dropped else ""
+        logger.info(f"Subscriber disconnected ({len(self.subscribers)} left{lost})")
+
+    # Commands from a subscriber go on the link
+    def _read(self, sub):
+        try:
+            data = sub.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(sub)
+            return
+        sub.rx += data
+        for kind, channel, _, payload in _split_records(sub.rx):
+            self.publisher.on_record(kind, channel, payload)
+
+    # Write queued chunks until the socket is full (socket I/O outside the lock)
+    def _flush(self, sub):
+        while True:
+            with self.lock:
+                if not sub.outbox:
+                    break
+                chunk, offset = sub.outbox[0], sub.offset
+            try:
+                n = sub.sock.send(memoryview(chunk)[offset:])
+            except BlockingIOError:
+                n = 0
+            except OSError:
+                self._drop(sub)
+                return
+            with self.lock:
+                sub.queued -= n
+                if offset + n == len(chunk):
+                    sub.outbox.popleft()
+                    sub.offset = 0
+                else:
+                    sub.offset = offset + n
+                    break
+        want_write = bool(sub.outbox)
+        if want_write != sub.writing:
+            sub.writing = want_write
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if want_write else 0)
+            self._selector.modify(sub.sock, events, sub)
+
+    def stats(self) -> dict:
+        with self.lock:
+            subs = [{"queued": s.queued, "dropped": s.dropped} for s in self.subscribers]
+        return {"subscribers": subs, **self.sm.stats()}
+
+
+# SerialManager API on top of a broker: on_receive(), on_receive_batch(),
+# set_receiver(), on_log(), logs, recv(), recv_batch(), send(), stats()...
+# behave as if the link were opened here. Reconnects when the broker
+# restarts. 'ser' is the socket (anything with its recv()/sendall()/
+# shutdown()/close(), see _connect()).
+class BrokerClient(SerialManager):
+
+    def __init__(self, path=BROKER_PATH, debug=False):
+        self.path = path
+        self.peer = getattr(self, 'peer', f"broker {path}")
+        self._send_lock = threading.Lock()
+        self._link_stats = None  # last REC_STATS
+        super().__init__(ser=self._connect(), debug=debug, handshake=None)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"No broker at {self.path} ({e}), start one with "
+                                  f"'python -m communication.broker'") from e
+        sock.settimeout(1.0)  # like the port timeout: the RX thread checks 'running'
+        return sock
+
+    def start(self):
+        self.running.set()
+        self.rx_thread.start()
+        logger.info(f"Connected to {self.peer}")
+
+    def stop(self):
+        self.running.clear()
+        try:
+            self.ser.shutdown(socket.SHUT_RDWR)  # wake the RX thread
+        except OSError:
+            pass
+        self.rx_thread.join(2.0)
+        self.ser.close()
+        logger.info(f"Disconnected from {self.peer}")
+
+    # Messages go to the broker, which queues them on the link (keys coalesce there)
+    def send(self, msg, key=None, timeout=None, channel=protocol.CH_TELEMETRY):
+        key = key.encode('utf-8') if key is not None else b''
+        if isinstance(msg, protocol.SensorData):
+            kind, body = REC_DATA, protocol.sensor_data_to_bytes(msg)
+        else:
+            kind, body = REC_TEXT, msg.encode('utf-8')
+        data = _record(kind, channel, 0.0, bytes([len(key)]) + key + body)
+        with self._send_lock:
+            try:
+                self.ser.sendall(data)
+            except OSError:
+                self.link_stats.send_dropped += 1
+                return False
+        self.link_stats.frames_out += 1
+        self.link_stats.bytes_out += len(data)
+        return True
+
+    # Recording happens where the port is (see SerialManager.start_recording())
+    def start_recording(self, path):
+        self._control({"record": os.path.abspath(path)})
+
+    def stop_recording(self):
+        self._control({"record": None})
+
+    def _control(self, ctrl):
+        with self._send_lock:
+            try:
+                self.ser.sendall(_record(REC_CTRL, 0, 0.0, b'\x00' + json.dumps(ctrl).encode('utf-8')))
+            except OSError as e:
+                logger.error(f"Could not reach {self.peer}: {e}")
+
+    # The link's counters (from the owner of the port), with this end's
+    # receive queue
+    def stats(self) -> dict:
+        local = super().stats()
+        if self._link_stats is None:
+            return local
+        snap = dict(self._link_stats)
+        for name in ("recv_queue", "recv_queue_hwm", "recv_dropped"):
+            snap[name] = local[name]
+        return snap
+
+    def rx_loop(self):
+        buf = bytearray()
+        while self.running.is_set():
+            try:
+                data = self.ser.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                data = b''
+            if not data:
+                if self.running.is_set():
+                    buf.clear()
+                    self._reconnect()
+                continue
+            self.link_stats.bytes_in += len(data)
+            buf += data
+            msgs = self._split_records(buf)
+            if msgs:
+                self._callback(self.on_receive_batch, msgs)
+        logger.debug("RX thread stopped")
+
+    def _reconnect(self):
+        logger.warning(f"Lost {self.peer}, reconnecting")
+        while self.running.is_set():
+            time.sleep(RECONNECT_PERIOD)
+            try:
+                with self._send_lock:
+                    self.ser.close()
+                    self.ser = self._connect()
+                logger.info(f"Reconnected to {self.peer}")
+                return
+            except ConnectionError:
+                pass
+
+    # Like SerialManager._split_frames(), for broker records
+    def _split_records(self, buf):
+        msgs = []
+        times = []
+        records = _split_records(buf)
+        for kind, channel, t, payload in records:
+            if kind == REC_LOG_DEF:
+                protocol.define_log(self.logs, payload)
+            elif kind == REC_LOG:
+                self.last_log = payload.decode('utf-8', errors='replace')
+                self._callback(self.on_log, self.last_log)
+            elif kind == REC_STATS:
+                self._link_stats = json.loads(payload)
+            else:
+                msg = payload.decode('utf-8', errors='replace') if kind == REC_TEXT else payload
+                receiver = self.receivers.get(channel)
+                if receiver is None:
+                    msgs.append(msg)
+                    times.append(t)
+                else:
+                    self.msg_time = t
+                    self._callback(receiver, msg)
+        self.rx_times = times
+        self.link_stats.on_frames(len(records))
+        return msgs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Share one serial link with several local programs")
+    parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
+    parser.add_argument("--port", "-p", default="/dev/ttyACM0", help="Serial port to use when not simulating")
+    parser.add_argument("--baud", "-b", type=int, default=19200, help="Opening baud rate (the startup handshake may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate the startup handshake may switch to (default: any the device offers)")
+    parser.add_argument("--name", "-n", choices=['A', 'B'], default='B', help="Name of this node for simulation mode")
+    parser.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport (shm = shared memory, same host only)")
+    parser.add_argument("--wire", "-w", choices=['csv', 'binary', 'auto'], default='binary', help="Wire format (binary falls back to CSV for older firmware)")
+    parser.add_argument("--socket", default=BROKER_PATH, help="UNIX socket the subscribers connect to")
+    parser.add_argument("--record", help="Also record the session to this file (see recorder.py)")
+    parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sm = SerialManager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name, debug=args.debug,
+                       wire_format=args.wire, transport=args.transport, bauds=link_bauds(args.max_baud),
+                       reliable_channels=(protocol.CH_COMMAND,), clock_sync=True)
+    broker = LinkBroker(sm, args.socket)
+    broker.start()
+    if args.record:
+        sm.start_recording(args.record)
+    try:
+        while True:
+            time.sleep(10)
+            st = broker.stats()
+            print(f"{len(st['subscribers'])} subscribers, {st['frames_in']} frames in, {st['frames_out']} out, "
+                  f"{st['parse_errors']} parse errors")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import struct
+from collections import deque
+
+
+# NTP-style clock synchronization between the host and a device
+#
+# The host sends FRAME_CLOCK_SYNC with its send time t1, the device answers
+# with t1, its receive time t2 and its send time t3, and the host notes the
+# arrival time t4. For each exchange
+#
+#   offset = ((t2 - t1) + (t3 - t4)) / 2   device clock - host clock
+#   delay  = (t4 - t1) - (t3 - t2)         round trip spent on the link
+#
+# An offset is off by at most delay / 2, so only the exchanges with the
+# lowest delays of the last 'window' are kept, and a line fitted through them
+# gives the offset and the drift (rate error of the device clock). With that,
+# device timestamps (FRAME_DEVICE_TIME) are mapped to host time.
+#
+# Times travel as u32 microseconds (what Arduino's micros() returns, wraps
+# every ~71 min) and are unwrapped here. Host times are time.monotonic().
+
+TIME = struct.Struct("<I")     # FRAME_DEVICE_TIME payload, FRAME_CLOCK_SYNC request
+REPLY = struct.Struct("<III")  # FRAME_CLOCK_SYNC reply: t1, t2, t3
+US_MOD = 1 << 32
+
+
+# Clock time [s] as it goes on the wire
+def to_us(t):
+    return int(t * 1e6) % US_MOD
+
+
+# Device clock [s] from u32 microseconds, counting the wraps. A value a bit
+# older than the last one (e.g. a stamp queued before a sync reply) stays older.
+class _Unwrapper:
+
+    def __init__(self):
+        self._last = None  # [us] unwrapped
+
+    def __call__(self, us):
+        if self._last is None:
+            self._last = us
+            return us / 1e6
+        diff = (us - self._last) % US_MOD
+        if diff >= US_MOD // 2:
+            diff -= US_MOD  # older than the last one
+        value = self._last + diff
+        if diff > 0:
+            self._last = value
+        return value / 1e6
+
+
+# u32 microseconds of a FRAME_DEVICE_TIME payload or FRAME_CLOCK_SYNC request
+def read_time(payload):
+    if len(payload) != TIME.size:
+        raise ValueError("Bad time frame length")
+    return TIME.unpack(payload)[0]
+
+
+# Device side: answer a request received at t2, sent back at t3 (device clock [s])
+def clock_reply(request, t2, t3):
+    return REPLY.pack(read_time(request), to_us(t2), to_us(t3))
+
+
+class ClockSync:
+
+    DRIFT_MIN_SPAN = 10.0  # [s] of exchanges before the drift is estimated
+
+    def __init__(self, window=32):
+        self.samples = deque(maxlen=window)  # (host time, offset, delay) per exchange
+        self.offset = None  # [s] device - host at t_ref
+        self.drift = 0.0    # [s/s] device clock rate error
+        self.delay = None   # [s] lowest round trip seen in the window
+        self.t_ref = 0.0
+        self.device_time = _Unwrapper()  # u32 us -> device clock [s]
+
+    @property
+    def synced(self):
+        return self.offset is not None
+
+    # FRAME_CLOCK_SYNC request payload, to be written at host time t1
+    def request(self, t1):
+        return TIME.pack(to_us(t1))
+
+    # Process a FRAME_CLOCK_SYNC reply payload that arrived at host time t4
+    def on_reply(self, payload, t4):
+        if len(payload) != REPLY.size:
+            raise ValueError("Bad clock sync reply length")
+        t1_us, t2_us, t3_us = REPLY.unpack(payload)
+        t1 = t4 - ((to_us(t4) - t1_us) % US_MOD) / 1e6
+        t2 = self.device_time(t2_us)
+        t3 = self.device_time(t3_us)
+        delay = (t4 - t1) - (t3 - t2)
+        if delay < 0:
+            return  # not a reply to one of our requests
+        self.samples.append(((t1 + t4) / 2, ((t2 - t1) + (t3 - t4)) / 2, delay))
+        self._fit()
+
+    # Least squares line through the best half of the exchanges
+    def _fit(self):
+        best = sorted(self.samples, key=lambda s: s[2])[:max(1, len(self.samples) // 2)]
+        self.delay = best[0][2]
+        n = len(best)
+        self.t_ref = sum(s[0] for s in best) / n
+        offset = sum(s[1] for s in best) / n
+        var = sum((s[0] - self.t_ref) ** 2 for s in best)
+        if self.samples[-1][0] - self.samples[0][0] >= self.DRIFT_MIN_SPAN and var > 0:
+            self.drift = sum((s[0] - self.t_ref) * (s[1] - offset) for s in best) / var
+        self.offset = offset
+
+    # Host time [s] of device time 'device_t' [s], None until synced
+    def to_host(self, device_t):
+        if self.offset is None:
+            return None
+        # device = host + offset + drift * (host - t_ref), solved for host
+        return (device_t - self.offset + self.drift * self.t_ref) / (1 + self.drift)
+
+    def snapshot(self) -> dict:
+        if self.offset is None:
+            return {}
+        return {
+            "clock_offset_ms": self.offset * 1e3,
+            "clock_drift_ppm": self.drift * 1e6,
+            "clock_delay_ms": self.delay * 1e3,
+        }
@@ -0,0 +1,227 @@
+import time
+import argparse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Multi-resolution min/max envelope of a growing series, to plot hours of
+# samples from a few thousand points at any zoom level
+#
+#   level 0   the raw samples (and their times, if any)
+#   level k   one bucket per FACTOR**k samples: min and max value, and the
+#             sample index each comes from
+#
+# Levels are extended as samples arrive, from complete buckets of the level
+# below only, so a bucket never changes once written (amortized O(1) per
+# sample, all levels together take about as much memory as the raw data).
+# A view of a range is read from the finest level that stays within
+# 'max_points' points: the min and the max of every bucket in the order they
+# happened, so peaks a plain every-Nth-sample decimation would skip stay
+# visible. The partial buckets at both ends come from finer levels.
+#
+# Min/max rather than LTTB: an LTTB bucket depends on its neighbours, so it
+# would have to be recomputed for every view instead of kept incrementally.
+
+FACTOR = 8
+MAX_POINTS = 2000
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for decimation")
+
+
+# Append-only array that doubles its capacity when full
+class _Buffer:
+
+    def __init__(self, shape, dtype):
+        self._data = np.zeros((1024,) + shape, dtype)
+        self.n = 0
+
+    def extend(self, values):
+        n = self.n + len(values)
+        if n > len(self._data):
+            grown = np.zeros((max(n, 2 * len(self._data)),) + self._data.shape[1:], self._data.dtype)
+            grown[:self.n] = self._data[:self.n]
+            self._data = grown
+        self._data[self.n:n] = values
+        self.n = n
+
+    @property
+    def data(self):
+        return self._data[:self.n]
+
+
+# One level of buckets: min/max value and sample index, per channel
+class _Level:
+
+    def __init__(self, channels, dtype):
+        self.vmin = _Buffer((channels,), dtype)
+        self.vmax = _Buffer((channels,), dtype)
+        self.imin = _Buffer((channels,), np.int64)
+        self.imax = _Buffer((channels,), np.int64)
+
+    def __len__(self):
+        return self.imax.n  # extended last
+
+    def extend(self, vmin, vmax, imin, imax):
+        self.vmin.extend(vmin)
+        self.vmax.extend(vmax)
+        self.imin.extend(imin)
+        self.imax.extend(imax)
+
+
+# Min/max pyramid of 'channels' series sampled together (e.g. the 6 IMU axes).
+# With timed=True every append() also takes the sample times, and views can
+# be asked by time and return times as x. One thread appends while another
+# one draws: lengths are only bumped once the data they cover is written.
+class MinMaxPyramid:
+
+    def __init__(self, channels=1, timed=False, factor=FACTOR, dtype='<f4'):
+        _require_numpy()
+        self.channels = channels
+        self.factor = factor
+        self.dtype = np.dtype(dtype)
+        self.clear()
+        self._timed = timed
+
+    def clear(self):
+        self._raw = _Buffer((self.channels,), self.dtype)
+        self._times = _Buffer((), np.float64)
+        self._levels = []  # _levels[k - 1] is level k
+
+    def __len__(self):
+        return self._raw.n
+
+    @property
+    def values(self):
+        return self._raw.data
+
+    @property
+    def times(self):
+        return self._times.data if self._timed else None
+
+    # Add samples, shape (n, channels) or (n,) with one channel; 'times'
+    # (nondecreasing, e.g. from recv_batch(times=True)) when timed
+    def append(self, values, times=None):
+        values = np.asarray(values, dtype=self.dtype).reshape(-1, self.channels)
+        if self._timed:
+            if times is None or len(times) != len(values):
+                raise ValueError("Timed pyramid: one time per sample needed")
+            self._times.extend(np.asarray(times, dtype=np.float64))
+        self._raw.extend(values)
+        self._build()
+
+    def _build(self):
+        f = self.factor
+        below = len(self)
+        for k in range(1, 64):
+            if below < f:
+                break
+            new = len(self._levels) < k
+            level = _Level(self.channels, self.dtype) if new else self._levels[k - 1]
+            done, complete = len(level), below // f
+            if complete > done:
+                self._reduce(self._levels[k - 2] if k > 1 else None, level, done * f, complete * f)
+            if new:
+                self._levels.append(level)  # once it has buckets
+            below = complete
+
+    # Buckets of 'level' from the entries [lo, hi) of the level below it
+    # ('below' None: the raw samples)
+    def _reduce(self, below, level, lo, hi):
+        f, c = self.factor, self.channels
+        if below is None:
+            groups = self._raw.data[lo:hi].reshape(-1, f, c)
+            amin, amax = groups.argmin(axis=1), groups.argmax(axis=1)
+            base = np.arange(lo, hi, f)[:, None]
+            level.extend(groups.min(axis=1), groups.max(axis=1), base + amin, base + amax)
+            return
+        mins = below.vmin.data[lo:hi].reshape(-1, f, c)
+        maxs = below.vmax.data[lo:hi].reshape(-1, f, c)
+        amin, amax = mins.argmin(axis=1)[:, None], maxs.argmax(axis=1)[:, None]
+        pick = lambda a, at: np.take_along_axis(a, at, axis=1)[:, 0]
+        level.extend(pick(mins, amin), pick(maxs, amax),
+                     pick(below.imin.data[lo:hi].reshape(-1, f, c), amin),
+                     pick(below.imax.data[lo:hi].reshape(-1, f, c), amax))
+
+    # (x, y) to plot the samples [start, stop), at most about 'max_points'
+    # per channel, both of shape (points, channels): x is the sample index,
+    # or its time when timed
+    def view(self, start=0, stop=None, max_points=MAX_POINTS):
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = max(0, start)
+        idx, y = self._points(start, stop, max(max_points, 4 * self.factor))
+        if not self._timed:
+            return idx, y
+        return self._times.data[idx], y
+
+    # Same by time: the samples with t0 <= time <= t1
+    def view_time(self, t0, t1, max_points=MAX_POINTS):
+        if not self._timed:
+            raise ValueError("Pyramid was created without times")
+        times = self._times.data
+        return self.view(int(np.searchsorted(times, t0, 'left')),
+                         int(np.searchsorted(times, t1, 'right')), max_points)
+
+    def _points(self, start, stop, max_points):
+        c = self.channels
+        if stop - start <= max_points:
+            idx = np.broadcast_to(np.arange(start, stop)[:, None], (max(stop - start, 0), c))
+            return idx, self._raw.data[start:stop]
+        # finest level with two points per bucket within max_points; the one
+        # below it was over budget, so the range spans two whole buckets or more
+        k = 0
+        while k < len(self._levels) and 2 * (stop - start) / self.factor ** k > max_points:
+            k += 1
+        size = self.factor ** k
+        level = self._levels[k - 1]
+        b0, b1 = -(-start // size), min(stop // size, len(level))
+        head = self._points(start, b0 * size, 4 * self.factor)
+        tail = self._points(b1 * size, stop, 4 * self.factor)
+        imin, imax = level.imin.data[b0:b1], level.imax.data[b0:b1]
+        vmin, vmax = level.vmin.data[b0:b1], level.vmax.data[b0:b1]
+        min_first = imin <= imax
+        idx = np.stack([np.where(min_first, imin, imax), np.where(min_first, imax, imin)], axis=1).reshape(-1, c)
+        y = np.stack([np.where(min_first, vmin, vmax), np.where(min_first, vmax, vmin)], axis=1).reshape(-1, c)
+        return np.concatenate([head[0], idx, tail[0]]), np.concatenate([head[1], y, tail[1]])
+
+
+# ---------------------------------------------------------------------------
+# Command line: append and view rates for a long synthetic IMU history
+# ---------------------------------------------------------------------------
+
+def bench(args):
+    rng = np.random.default_rng(0)
+    pyramid = MinMaxPyramid(channels=6, timed=True)
+    n = int(args.rate * args.hours * 3600)
+    t = np.arange(n) / args.rate
+    samples = (np.sin(t[:, None] * np.arange(1, 7)) + 0.05 * rng.standard_normal((n, 6))).astype('<f4')
+    t_start = time.perf_counter()
+    for i in range(0, n, args.batch):
+        pyramid.append(samples[i:i + args.batch], t[i:i + args.batch])
+    appended = time.perf_counter() - t_start
+    print(f"{n} samples x 6 in batches of {args.batch}: {n / appended:.0f} samples/s appended, "
+          f"{len(pyramid._levels)} levels")
+    for span in (10, 600, 3600 * args.hours):
+        t_start = time.perf_counter()
+        for _ in range(100):
+            x, y = pyramid.view_time(t[-1] - span, t[-1], args.points)
+        took = (time.perf_counter() - t_start) / 100
+        print(f"  last {span:>7.0f} s: {len(x):>5} points in {took * 1e3:.2f} ms")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Min/max decimation benchmark")
+    parser.add_argument("--hours", type=float, default=2.0, help="History length")
+    parser.add_argument("--rate", "-r", type=float, default=1000.0, help="Samples per second")
+    parser.add_argument("--batch", type=int, default=25, help="Samples per append()")
+    parser.add_argument("--points", type=int, default=MAX_POINTS, help="max_points of every view")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    bench(parse_args())
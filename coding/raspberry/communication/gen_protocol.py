@@ -0,0 +1,42 @@
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication import schema
+
+
+# Regenerates the Arduino header from sensor_data.json. The Python side
+# (ctypes struct, NumPy dtype, codecs) is built from the same file at import
+# time, so after editing the schema only this script needs to be run.
+ARDUINO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'arduino'))
+DEFAULT_OUTPUTS = [os.path.join(ARDUINO_DIR, 'free_rtos_mockups', 'sensor_data.h')]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the SensorData C header from sensor_data.json")
+    parser.add_argument("outputs", nargs="*", default=DEFAULT_OUTPUTS, help="Header file(s) to write")
+    parser.add_argument("--check", "-c", action="store_true", help="Only check that the header(s) are up to date")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    header = schema.c_header(schema.load_schema())
+    stale = []
+    for path in args.outputs:
+        current = open(path, encoding='utf-8').read() if os.path.exists(path) else None
+        if current == header:
+            continue
+        stale.append(path)
+        if not args.check:
+            with open(path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write(header)
+            print(f"Wrote {path}")
+    if args.check and stale:
+        print("Out of date: " + ", ".join(stale))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
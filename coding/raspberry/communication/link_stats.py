@@ -0,0 +1,79 @@
+import time
+from bisect import bisect_right
+
+
+# Fixed-bucket histogram: counts[i] holds the values <= edges[i] (and above
+# the previous edge), the last bucket everything above edges[-1]
+class Histogram:
+
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def add(self, value):
+        self.counts[bisect_right(self.edges, value)] += 1
+
+    def snapshot(self) -> dict:
+        return {"le": self.edges + [None], "counts": list(self.counts)}
+
+
+# Inter-arrival buckets [ms]; frames completed by the same read land in the first one
+INTER_ARRIVAL_EDGES_MS = (0.1, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# End-to-end latency buckets [ms]: device timestamp (mapped to host time) to arrival
+LATENCY_EDGES_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+# Counters and gauges kept by SerialManager, see SerialManager.stats()
+#
+# Each counter has a single writer (the TX thread, the RX thread, or a
+# caller holding SerialManager.lock), so plain ints are enough: no extra lock
+# on the hot path, and a snapshot is at worst one frame out of date.
+class LinkStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.frames_in = 0        # frames received (data and control)
+        self.bytes_in = 0
+        self.frames_out = 0       # frames handed to the port
+        self.bytes_out = 0
+        self.parse_errors = 0     # frames dropped: bad CRC/COBS, delta out of sequence...
+        self.rx_overflow_bytes = 0  # bytes dropped waiting for a delimiter
+        self.recv_dropped = 0     # received messages pushed out of a full recv_queue
+        self.send_dropped = 0     # messages dropped before being sent (full send_queue)
+        self.send_coalesced = 0   # queued messages replaced by a newer one with the same key
+        self.retransmits = 0      # reliable channels, see reliable.py
+        self.rx_errors = 0
+        self.callback_errors = 0  # exceptions raised by receive/log callbacks (message skipped)
+        self.tx_errors = 0
+        self.send_queue_hwm = 0   # high-water marks (messages)
+        self.recv_queue_hwm = 0
+        self.inter_arrival_ms = Histogram(INTER_ARRIVAL_EDGES_MS)
+        self.latency_ms = Histogram(LATENCY_EDGES_MS)  # frames with a device timestamp only
+        self._last_arrival = None
+
+    # Called once per read with the number of complete frames it produced
+    def on_frames(self, n, now=None):
+        if not n:
+            return
+        now = time.monotonic() if now is None else now
+        if self._last_arrival is not None:
+            self.inter_arrival_ms.add((now - self._last_arrival) * 1e3)
+        self.inter_arrival_ms.counts[0] += n - 1
+        self._last_arrival = now
+        self.frames_in += n
+
+    def send_queued(self, depth):
+        if depth > self.send_queue_hwm:
+            self.send_queue_hwm = depth
+
+    def recv_queued(self, depth):
+        if depth > self.recv_queue_hwm:
+            self.recv_queue_hwm = depth
+
+    def snapshot(self, **gauges) -> dict:
+        snap = {k: v for k, v in vars(self).items() if isinstance(v, int) and not k.startswith('_')}
+        snap["uptime"] = time.monotonic() - self.started
+        snap["inter_arrival_ms"] = self.inter_arrival_ms.snapshot()
+        snap["latency_ms"] = self.latency_ms.snapshot()
+        snap.update(gauges)
+        return snap
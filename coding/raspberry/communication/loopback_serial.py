@@ -0,0 +1,76 @@
+import threading
+
+
+# One direction of the in-process link: a byte buffer and a condition the
+# reader waits on
+class _Pipe:
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.cond = threading.Condition()
+
+
+_PIPES = {}
+_PIPES_LOCK = threading.Lock()
+
+
+def _pipe(name):
+    with _PIPES_LOCK:
+        return _PIPES.setdefault(name, _Pipe())
+
+
+# Simulated serial port joining two SerialManagers of the same process
+# (A and B), with no file or kernel in between. Used by the benchmarks and
+# handy in tests: it shows the cost of SerialManager itself. The pipes
+# outlive the port, so a closed port reads nothing: the RX thread of a
+# stopped manager must not take the bytes meant for the next one.
+class LoopbackSerial:
+
+    def __init__(self, name):
+        self.name = name.upper()
+        if self.name == 'A':
+            tx, rx = 'a_to_b', 'b_to_a'
+        elif self.name == 'B':
+            tx, rx = 'b_to_a', 'a_to_b'
+        else:
+            raise ValueError("Name must be 'A' or 'B'")
+        self.tx = _pipe(tx)
+        self.rx = _pipe(rx)
+        self.timeout = 1.0  # [s] like serial.Serial(timeout=...)
+        self.closed = False
+
+    def write(self, data: bytes):
+        with self.tx.cond:
+            self.tx.buf += data
+            self.tx.cond.notify_all()
+        return len(data)
+
+    @property
+    def in_waiting(self) -> int:
+        return 0 if self.closed else len(self.rx.buf)
+
+    # Read up to 'size' bytes, waiting up to 'timeout' for the first one
+    # (b'' once the port is closed)
+    def read(self, size=1) -> bytes:
+        with self.rx.cond:
+            if not self.rx.buf and not self.closed:
+                self.rx.cond.wait_for(lambda: self.rx.buf or self.closed, self.timeout)
+            if self.closed:
+                return b''
+            data = bytes(self.rx.buf[:size])
+            del self.rx.buf[:size]
+        return data
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.rx.cond:
+            self.closed = True
+            self.rx.cond.notify_all()  # wake a read() in progress
+
+    # Forget anything still buffered in both directions
+    @staticmethod
+    def reset():
+        with _PIPES_LOCK:
+            _PIPES.clear()
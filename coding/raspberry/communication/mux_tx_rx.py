@@ -4,6 +4,15 @@ import time
 import logging
 from collections import deque
 
+from communication import protocol
+from communication.shm_serial import SharedMemorySerial
+from communication.loopback_serial import LoopbackSerial
+from communication.link_stats import LinkStats
+from communication.tx_scheduler import TxScheduler
+from communication.reliable import ReliableSender, ReliableReceiver
+from communication.clock_sync import ClockSync, clock_reply, read_time, to_us, TIME
+from communication.recorder import SessionRecorder, ReplaySerial, FLAG_BINARY
+
 try:
     import serial
 except ImportError:
@@ -17,9 +26,19 @@ ch = logging.StreamHandler() # print to console
 logger.addHandler(ch) # attach handler
 
 
-# Simulated serial port using text files for inter-process comms
+# Simulated serial port using files for inter-process comms
+# Each direction is an append-only log: the writer only appends, the reader
+# keeps its own offset, so a read never rewrites the file and costs O(1).
+# The writer starts a fresh log on open and rotates it every LOG_ROTATE_SIZE
+# bytes, keeping the previous one as '<name>.1'; the reader starts at the
+# end (like a UART, what was sent before is not received), follows the file
+# to its end, then moves on to the next one (like 'tail -F'). A reader more
+# than one rotation behind goes through '<name>.1' first.
 class FileBackedFakeSerial:
 
+    LOG_ROTATE_SIZE = 4 * 1024 * 1024  # [bytes]
+    POLL_PERIOD = 0.002  # [s] wait between checks while nothing is available
+
     def __init__(self, name):
         self.name = name.upper()
         base = os.path.dirname(__file__)
@@ -32,52 +51,271 @@ class FileBackedFakeSerial:
         else:
             raise ValueError("Name must be 'A' or 'B'")
 
-        # ensure files exist
-        for f in [self.write_file, self.read_file]:
-            open(f, 'a').close()
+        self.timeout = 1.0  # [s] like serial.Serial(timeout=...)
+        self._wfd = None
+        self._written = 0
+        self._new_log()
+
+        open(self.read_file, 'ab').close()
+        self._rfd = os.open(self.read_file, os.O_RDONLY)
+        self._offset = os.fstat(self._rfd).st_size
+
+    # Start a new (empty) log for the outgoing direction, the current one
+    # becomes '<name>.1' (linked first: the name never goes missing)
+    def _new_log(self):
+        tmp = self.write_file + '.new'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+        if os.path.exists(self.write_file):
+            rotated = self.write_file + '.1'
+            if os.path.exists(rotated + '.new'):
+                os.unlink(rotated + '.new')
+            os.link(self.write_file, rotated + '.new')
+            os.replace(rotated + '.new', rotated)
+        os.replace(tmp, self.write_file)
+        if self._wfd is not None:
+            os.close(self._wfd)
+        self._wfd = fd
+        self._written = 0
 
     def write(self, data: bytes):
-        with open(self.write_file, 'a', encoding='utf-8') as f:
-            f.write(data.decode('ascii'))
+        if self._written + len(data) > self.LOG_ROTATE_SIZE:
+            self._new_log()
+        os.write(self._wfd, data)
+        self._written += len(data)
+
+    # Switch to the peer's next log once the current one is fully read
+    def _follow(self) -> bool:
+        try:
+            st = os.stat(self.read_file)
+        except FileNotFoundError:
+            return False
+        current = os.fstat(self._rfd)
+        if st.st_ino == current.st_ino:
+            if st.st_size < self._offset:  # truncated in place
+                self._offset = 0
+                return True
+            return False
+        if current.st_size > self._offset:
+            return False  # finish the old log first
+        # ours is neither the newest log nor the rotated one: the rotated one
+        # came after it (two rotations since our last read)
+        path = self.read_file
+        try:
+            rotated = os.stat(self.read_file + '.1')
+            if rotated.st_ino != current.st_ino and rotated.st_ino != st.st_ino:
+                path = self.read_file + '.1'
+        except FileNotFoundError:
+            pass
+        os.close(self._rfd)
+        self._rfd = os.open(path, os.O_RDONLY)
+        self._offset = 0
+        return True
+
+    @property
+    def in_waiting(self) -> int:
+        pending = os.fstat(self._rfd).st_size - self._offset
+        if pending <= 0 and self._follow():
+            pending = os.fstat(self._rfd).st_size - self._offset
+        return max(pending, 0)
+
+    # Read up to 'size' bytes, waiting up to 'timeout' for the first one
+    def read(self, size=1) -> bytes:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            data = os.pread(self._rfd, size, self._offset)
+            if data:
+                self._offset += len(data)
+                return data
+            if self._follow():
+                continue
+            if time.monotonic() >= deadline:
+                return b''
+            time.sleep(self.POLL_PERIOD)
 
     def readline(self) -> bytes:
-        line = ''
-        with open(self.read_file, 'r+', encoding='utf-8') as f:
-            lines = f.readlines()
-            if lines:
-                line = lines[0]
-                f.seek(0)
-                f.writelines(lines[1:])
-                f.truncate()
-        return line.encode('ascii')
+        line = bytearray()
+        while not line.endswith(b'\n'):
+            data = self.read(1)
+            if not data:
+                break
+            line += data
+        return bytes(line)
 
     def flush(self):
         pass
 
     def close(self):
-        pass
+        for fd in (self._wfd, self._rfd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+# Simulated transports, selected with SerialManager(transport=...)
+SIM_TRANSPORTS = {
+    'file': FileBackedFakeSerial,  # works between any two processes
+    'shm': SharedMemorySerial,     # same host, lowest latency
+    'loop': LoopbackSerial,        # both ends in the same process
+}
+
+
+# Wire formats: 'csv' (text lines, what older firmware speaks), 'binary'
+# (ask the peer to switch to COBS/CRC framing, stay on CSV if it never
+# answers) and 'auto' (CSV until the peer asks for binary)
+WIRE_FORMATS = ('csv', 'binary', 'auto')
+FMT_REQUEST = f"#FMT binary {protocol.SCHEMA_VERSION}"  # carries the SensorData schema version
+FMT_RETRY_PERIOD = 1.0  # [s]
+FMT_RETRIES = 3
+TX_IDLE_TIMEOUT = 0.5  # [s] TX thread wake-up when nothing is queued
+RX_MAX_FRAME = 4096  # [bytes] longer runs without a delimiter are noise
+
+# What send() does when a channel already holds send_queue_size messages:
+# 'drop_oldest' makes room by dropping the oldest one (fine for periodic
+# telemetry), 'block' waits for the TX thread (nothing may be lost)
+SEND_POLICIES = ('drop_oldest', 'block')
+SEND_QUEUE_SIZE = 1024  # [messages] per channel
+
+# TX scheduler weights (see tx_scheduler.py): commands overtake telemetry,
+# logs go last. Channels not listed get weight 1.
+CHANNEL_WEIGHTS = {
+    protocol.CH_COMMAND: 8,
+    protocol.CH_TELEMETRY: 2,
+    protocol.CH_LOG: 1,
+}
+TX_BATCH_TIME = 0.02  # [s] of line time per write on real ports, so new commands wait at most that long
+ACK_KEY = "#ack"  # acks are coalesced: only the newest (cumulative) one needs to go out
+
+# Startup handshake on real ports, replacing the fixed 2 s wait for the
+# Arduino reset (see _handshake()):
+#   host   -> "#HELLO"                    every HELLO_PERIOD until...
+#   device -> "#READY <baud> <baud> ..."  (also sent once when it starts)
+#   host   -> "#BAUD <baud>"              highest rate both sides support
+#   device -> "#BAUD <baud>"              then switches
+#   host switches and says HELLO until READY arrives at the new rate; if it
+#   does not, both ends go back to the opening rate (the device on its own
+#   after 2 * BAUD_CHECK_TIMEOUT without a HELLO).
+# Firmware without the handshake never answers: the host goes on after
+# READY_TIMEOUT at the opening rate, as before.
+HANDSHAKE_ROLES = ('host', 'device', None)
+LINK_BAUDS = (1000000, 500000, 250000, 230400, 115200, 57600, 38400, 19200, 9600)
+HELLO = b"\x00#HELLO\n"  # the 0x00 ends whatever binary frame a device was still expecting
+HELLO_PERIOD = 0.1  # [s]
+READY_TIMEOUT = 2.0  # [s]
+BAUD_CHECK_TIMEOUT = 1.0  # [s]
+
+
+# Clock sync requests (binary wire format, see clock_sync.py): every
+# CLOCK_SYNC_PERIOD, ten times faster until CLOCK_SYNC_FAST exchanges are in
+CLOCK_SYNC_PERIOD = 1.0  # [s]
+CLOCK_SYNC_FAST = 8
+
+
+# True if 'line' is a SensorData CSV row
+def _is_csv_row(line):
+    if b',' not in line or not line.isascii():
+        return False
+    try:
+        protocol.string_to_sensor_data(line.decode('ascii'))
+        return True
+    except ValueError:
+        return False
+
+
+# Rates of LINK_BAUDS up to 'max_baud' (for the --max-baud script option)
+def link_bauds(max_baud=None):
+    return tuple(b for b in LINK_BAUDS if max_baud is None or b <= max_baud)
 
 
 # Class to handle Tx/Rx data over real or simulated serial
 class SerialManager:
 
-    def __init__(self, port="/dev/ttyACM0", baud=38400, simulate=True, name=None, debug=False):
+    def __init__(self, port="/dev/ttyACM0", baud=38400, simulate=True, name=None, debug=False,
+                 wire_format='csv', transport='file', delta_keyframes=0,
+                 send_queue_size=SEND_QUEUE_SIZE, send_policy='drop_oldest', channel_weights=None,
+                 reliable_channels=(), reliable_window=32, handshake='host', bauds=LINK_BAUDS,
+                 clock_sync=False, device_time=False, ser=None):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"wire_format must be one of {WIRE_FORMATS}")
+        if send_policy not in SEND_POLICIES:
+            raise ValueError(f"send_policy must be one of {SEND_POLICIES}")
+        if transport not in SIM_TRANSPORTS:
+            raise ValueError(f"transport must be one of {tuple(SIM_TRANSPORTS)}")
+        if handshake not in HANDSHAKE_ROLES:
+            raise ValueError(f"handshake must be one of {HANDSHAKE_ROLES}")
         self.running = threading.Event()
-        self.send_queue = []
+        # per-channel send queues (send_queue_size per channel, None = unbounded)
+        self.tx = TxScheduler(CHANNEL_WEIGHTS if channel_weights is None else channel_weights, send_queue_size)
+        self.send_policy = send_policy
+        # (timestamp, message) pairs, appended by the RX thread and popped by
+        # recv()/recv_batch() without a lock: a deque appends and pops
+        # atomically, and when full an append pushes the oldest pair out
         self.recv_queue = deque([], 1024)
+        # channel -> messages from send() on the way to the TX thread, which
+        # encodes and queues them in order (see send())
+        self._tx_inbox = {}
+        self.receivers = {}  # channel -> callback, see set_receiver()
+        # reliable channels (binary wire format only): text sent on them is
+        # acked and retransmitted, see reliable.py. Any channel is received
+        # reliably when the peer sends it that way.
+        self._rel_tx = {ch: ReliableSender(reliable_window) for ch in reliable_channels}
+        self._rel_rx = {}
+        self._rel_acks = {}  # channel -> ack payload to send after this read
+        self._tx_byte_time = 0.0  # [s] line time per byte, 0 = do not pace
+        self._tx_busy_until = 0.0  # [monotonic s] when the line is done with what was written
+        self.handshake = handshake
+        self.bauds = tuple(bauds)  # rates this end can switch to, see _handshake()
+        self._baud_switch = None  # device: rate to switch to once the host's request is answered
+        self._baud_fallback = None  # device: (opening rate, deadline) until the new rate is confirmed
+        self.last_msg = None  # most recent message, see latest()
+        # Timestamps of received messages, in time.monotonic() seconds: when
+        # the sample was taken (device timestamp mapped through the clock
+        # sync) or else when its frame started arriving
+        self.msg_time = None  # of the message being delivered to a callback
+        self.rx_times = []  # of the messages handed to on_receive_batch()
+        self._rx_frame_time = 0.0  # arrival of the frame being decoded
+        self._device_time = None  # device clock [s] stamped on the next frame
+        self.clock = ClockSync()  # device clock -> host clock, fed by clock_sync exchanges
+        self.clock_sync = clock_sync  # send requests (the peer always answers)
+        self._clock_next = 0.0
+        self._clock_replies = deque([], 4)  # (request, arrival) to answer
+        self.device_time = device_time  # stamp sent SensorData with our clock
+        self.recorder = None  # see start_recording()
+        self._rec_lock = threading.Lock()  # held while the recorder is written, swapped or closed
+        self.link_stats = LinkStats()  # see stats()
+        # TX side only: scheduler, encoders and reliable senders. Nothing is
+        # read or written with it held.
         self.lock = threading.Lock()
+        self.tx_ready = threading.Event()  # set on send(), wakes the TX thread
+        self.tx_space = threading.Condition(self.lock)  # notified when the TX thread takes messages
         self.simulate = simulate
+        self.wire_format = wire_format
+        self.tx_binary = False  # frames sent as binary?
+        self.rx_binary = False  # frames received as binary?
+        self._fmt_tries = 0
+        self._fmt_next_try = 0.0
+        # delta encoding of SensorData in binary mode (keyframe every N frames, 0 = off)
+        self._delta_tx = protocol.SensorDeltaEncoder(delta_keyframes) if delta_keyframes > 0 else None
+        self._delta_rx = protocol.SensorDeltaDecoder()
+        # interned system_log strings in binary mode, see on_log()
+        self._log_tx = protocol.LogInterner()
+        self.logs = {}  # ID -> text, as defined by the peer
+        self.last_log = None
+        self._log_field = None
 
         if debug:
             logger.setLevel(logging.DEBUG)
         else:
             logger.setLevel(logging.INFO)
 
-        if simulate or serial is None:
+        if ser is not None:
+            self.ser = ser  # already open, e.g. ReplaySerial (see replay())
+            self.simulate = True
+        elif simulate or serial is None:
             if not name:
                 raise ValueError("Need name='A' or 'B' when simulate=True")
-            logger.info(f"Using simulated serial as {name}")
-            self.ser = FileBackedFakeSerial(name)
+            logger.info(f"Using simulated serial ({transport}) as {name}")
+            self.ser = SIM_TRANSPORTS[transport](name)
         else:
             try:
                 logger.info(f"Opening real serial port {port} @ {baud}")
@@ -88,53 +326,423 @@ class SerialManager:
                     timeout=1
                 )
                 logger.info("Serial port opened successfully.")
-                time.sleep(2)  # wait for Arduino reset
+                self._set_baud(baud)
 
             except Exception as e:
                 logger.error(f"Could not open {port}: {e}")
                 logger.warning("Falling back to simulation mode.")
-                self.ser = FileBackedFakeSerial(name or 'A')
+                self.ser = SIM_TRANSPORTS[transport](name or 'A')
                 self.simulate = True
 
         self.tx_thread = threading.Thread(target=self.tx_loop, daemon=True)
         self.rx_thread = threading.Thread(target=self.rx_loop, daemon=True)
 
     # Transmission Thread (function)
+    # Sleeps until send() wakes it, queues what send() left in the inbox,
+    # then writes what the scheduler hands out:
+    # everything queued on simulated ports. On real ports it writes
+    # TX_BATCH_TIME worth of line time at a time and waits for the line to
+    # be almost done with it first, so the backlog stays in the per-channel
+    # queues (where a command can overtake telemetry), not in the OS buffer.
     def tx_loop(self):
         while self.running.is_set():
+            self._negotiate()
+            if self._baud_switch or self._baud_fallback:
+                self._device_baud()
+            if self._tx_byte_time:
+                delay = self._tx_busy_until - time.monotonic() - TX_BATCH_TIME
+                if delay > 0:
+                    time.sleep(delay)
+            if not self.tx.pending and not self._inbox_pending():
+                with self.lock:
+                    timeout = self._tx_idle_timeout()
+                self.tx_ready.wait(timeout)
+            self.tx_ready.clear()  # before taking the inbox: a later send() wakes the next wait
             with self.lock:
-                if self.send_queue:
-                    msg = self.send_queue.pop(0)
-                    try:
-                        self.ser.write((msg + "\n").encode('ascii'))
-                        logger.debug(f"TX: {msg}")
-                    except Exception as e:
-                        logger.error(f"TX error: {e}")
-            time.sleep(0.05)
+                self._take_inbox()
+                if self._rel_tx:
+                    self._retransmit()
+                n, data = self.tx.pop_batch()
+                if n:
+                    self.tx_space.notify_all()
+                if self.tx_binary and (self._clock_replies or self.clock_sync):
+                    frames = self._clock_frames()
+                    n += len(frames)
+                    data = b''.join(frames) + data
+            if not data:
+                continue
+            try:
+                self.ser.write(data)
+                if self._tx_byte_time:
+                    self._tx_busy_until = max(self._tx_busy_until, time.monotonic()) + len(data) * self._tx_byte_time
+                self.link_stats.frames_out += n
+                self.link_stats.bytes_out += len(data)
+                logger.debug("TX: %s", data)
+            except Exception as e:
+                self.link_stats.tx_errors += 1
+                logger.error(f"TX error: {e}")
         logger.debug("TX thread stopped")
 
     # Reception Thread (function)
+    # Reads whatever has arrived in one call (blocking on the port timeout
+    # when idle) and splits complete frames out of a reusable buffer
     def rx_loop(self):
+        buf = bytearray()
         while self.running.is_set():
             try:
-                line = self.ser.readline().decode('ascii', errors='ignore').strip()
-                if line:
-                    self.on_receive(line)
-                    logger.debug(f"RX: {line}")
+                data = self.ser.read(self.ser.in_waiting or 1)
+                if not data:
+                    continue
+                now = time.monotonic()
+                self.link_stats.bytes_in += len(data)
+                buf += data
+                if self.recorder is not None:
+                    self._record(now, data)
+                msgs = self._split_frames(buf, now)
+                if msgs:
+                    self._callback(self.on_receive_batch, msgs)
             except Exception as e:
-                logger.error(f"RX error: {e}")
-            time.sleep(0.005)
+                if self.running.is_set():  # port closed by stop() otherwise
+                    self.link_stats.rx_errors += 1
+                    logger.error(f"RX error: {e}")
         logger.debug("RX thread stopped")
 
-    
+    # Run a callback from the RX thread: an exception is logged and counted,
+    # and costs only that message (or batch)
+    def _callback(self, fn, arg):
+        try:
+            fn(arg)
+        except Exception as e:
+            self.link_stats.callback_errors += 1
+            logger.error(f"Callback {getattr(fn, '__name__', fn)} failed: {e!r}")
+
+    # Remove complete frames from 'buf' and return the decoded messages of
+    # the channels without a receiver (see set_receiver()); their timestamps
+    # go to rx_times. 'now' is when the last byte of 'buf' arrived.
+    def _split_frames(self, buf, now=None):
+        now = time.monotonic() if now is None else now
+        msgs = []
+        times = []
+        frames = 0
+        while True:
+            # looked up per frame: a '#FMT' line switches the delimiter
+            delimiter = protocol.FRAME_DELIMITER if self.rx_binary else b'\n'
+            end = buf.find(delimiter)
+            if end < 0:
+                start = self._csv_line_start(buf) if self.rx_binary else -1
+                if start < 0:
+                    break
+                logger.warning("Peer is talking CSV (restarted?), back to CSV")
+                self.link_stats.parse_errors += start > 0  # the frame it cut short
+                del buf[:start]
+                self._reset_wire_format()
+                continue
+            # bytes read after this frame were still on the line when it arrived
+            self._rx_frame_time = now - (len(buf) - end - 1) * self._tx_byte_time
+            frame = bytes(buf[:end])
+            del buf[:end + 1]  # before any callback runs: whatever happens, the frame is not seen twice
+            channel, msg = self._handle_frame(frame)
+            size = end + 1
+            frames += 1
+            if msg:
+                t = self._sample_time(size)
+                receiver = self.receivers.get(channel)
+                if msg.__class__ is list:  # a reliable frame can release several messages
+                    if receiver is None:
+                        msgs.extend(msg)
+                        times.extend([t] * len(msg))
+                    else:
+                        self.msg_time = t
+                        for m in msg:
+                            self._callback(receiver, m)
+                elif receiver is None:
+                    msgs.append(msg)
+                    times.append(t)
+                else:
+                    self.msg_time = t
+                    self._callback(receiver, msg)
+        self.rx_times = times
+        if self._rel_acks:
+            self._send_acks()
+        self.link_stats.on_frames(frames)
+        if len(buf) > RX_MAX_FRAME:
+            logger.debug("RX dropped %d bytes without delimiter", len(buf))
+            self.link_stats.rx_overflow_bytes += len(buf)
+            buf.clear()
+        return msgs
+
+    # Binary RX with no frame end left in 'buf': a peer that restarted (or
+    # missed our #FMT answer) talks CSV, which never sends a 0x00. Index of
+    # the first complete line that reads as READY, FMT or a SensorData row,
+    # -1 if there is none.
+    def _csv_line_start(self, buf):
+        start = 0
+        while True:
+            end = buf.find(b'\n', start)
+            if end < 0:
+                return -1
+            line = bytes(buf[start:end])
+            for prefix in (b"#READY", b"#FMT "):
+                i = line.find(prefix)
+                if i >= 0:
+                    return start + i
+            if _is_csv_row(line):
+                return start
+            start = end + 1
+
+    # Decode one frame (delimiter stripped) into (channel, message), with a
+    # None message for control/corrupt frames. CSV lines carry no channel
+    # and all arrive on CH_TELEMETRY.
+    def _handle_frame(self, data):
+        channel = protocol.CH_TELEMETRY
+        if self.rx_binary:
+            if not data:
+                return channel, None
+            try:
+                channel, kind, payload = protocol.decode_channel_frame(data)
+                if kind == protocol.FRAME_LOG_DEF:
+                    self._on_log_def(payload)
+                    return channel, None
+                if kind == protocol.FRAME_DEVICE_TIME:
+                    self._device_time = self.clock.device_time(read_time(payload))
+                    return channel, None
+                if kind == protocol.FRAME_CLOCK_SYNC:
+                    self._on_clock_sync(payload)
+                    return channel, None
+                if kind == protocol.FRAME_REL_DATA or kind == protocol.FRAME_REL_ACK:
+                    return channel, self._on_reliable(channel, kind, payload)
+                if kind == protocol.FRAME_SENSOR_DATA and channel == protocol.CH_TELEMETRY:
+                    self._delta_rx.keyframe(payload)
+                elif kind == protocol.FRAME_SENSOR_DELTA:
+                    payload = self._delta_rx.apply(payload)  # full SensorData payload
+                elif kind != protocol.FRAME_SENSOR_DATA and kind != protocol.FRAME_TEXT:
+                    raise ValueError(f"Unknown frame kind {kind}")
+                log = protocol.sensor_log_field(payload) if kind != protocol.FRAME_TEXT else None
+            except ValueError as e:
+                if data.startswith(HELLO[1:-1]):  # a new host, still speaking CSV
+                    self._on_handshake(HELLO[1:-1].decode('ascii'))
+                    return channel, None
+                logger.debug(f"RX dropped frame: {e}")
+                self.link_stats.parse_errors += 1
+                self._device_time = None
+                return channel, None
+            if log is not None:
+                self._update_log(log)
+            msg = payload.decode('utf-8', errors='ignore') if kind == protocol.FRAME_TEXT else payload
+        else:
+            msg = data.decode('ascii', errors='ignore').strip().lstrip("\x00")  # see HELLO
+            if msg.startswith("#"):
+                if msg.startswith("#FMT binary"):
+                    self._on_fmt_request(msg)
+                    return channel, None
+                if self._on_handshake(msg):
+                    return channel, None
+            if msg.endswith('"') and ',"' in msg:  # SensorData line, log is the last column
+                self._update_log(msg[msg.rfind(',"') + 2:-1])
+        logger.debug("RX: %s", msg)
+        return channel, msg
+
+    # Wire data for one message in the current TX format (call with lock
+    # held). The channel only goes on the wire with binary framing.
+    def _encode(self, msg, channel=protocol.CH_TELEMETRY):
+        if isinstance(msg, protocol.SensorData):
+            if self.tx_binary:
+                log, definition = self._log_tx.intern(msg.system_log)
+                if self._delta_tx is not None and channel == protocol.CH_TELEMETRY:
+                    kind, payload = self._delta_tx.encode(msg, log)
+                else:
+                    kind, payload = protocol.FRAME_SENSOR_DATA, protocol.sensor_data_to_bytes(msg, log)
+                frame = protocol.encode_frame(kind, payload, channel)
+                if self.device_time:
+                    frame = protocol.encode_frame(protocol.FRAME_DEVICE_TIME, TIME.pack(to_us(time.monotonic())), channel) + frame
+                if definition is not None:
+                    frame = protocol.encode_frame(protocol.FRAME_LOG_DEF, definition, channel) + frame
+                return frame
+            msg = protocol.sensor_data_to_string(msg)
+        if self.tx_binary:
+            return protocol.encode_frame(protocol.FRAME_TEXT, msg.encode('utf-8'), channel)
+        return (msg + "\n").encode('ascii')
+
+    # Peer asked for (or acknowledged) binary framing
+    def _on_fmt_request(self, msg):
+        if self.wire_format == 'csv':
+            logger.debug("Ignoring binary format request (wire_format='csv')")
+            return
+        if msg != FMT_REQUEST:
+            logger.error(f"SensorData schema mismatch: peer sent '{msg}', expected '{FMT_REQUEST}'. Staying on CSV")
+            self._fmt_tries = FMT_RETRIES + 1  # stop asking
+            return
+        with self.lock:
+            if self.wire_format == 'auto':
+                self._enqueue((FMT_REQUEST + "\n").encode('ascii'))
+                # clock sync frames go ahead of each batch: the first request
+                # would reach a peer still on CSV before our answer
+                self._clock_next = max(self._clock_next, time.monotonic() + FMT_RETRY_PERIOD)
+            self.tx_binary = True
+        self.rx_binary = True
+        logger.info("Switched to binary wire format")
+
+    # Ask the peer to switch to binary, give up after a few tries
+    def _negotiate(self):
+        if self.wire_format != 'binary' or self.rx_binary or self._fmt_tries > FMT_RETRIES:
+            return
+        now = time.monotonic()
+        if now < self._fmt_next_try:
+            return
+        self._fmt_tries += 1
+        if self._fmt_tries > FMT_RETRIES:
+            logger.warning("Peer did not accept binary wire format, staying on CSV")
+            return
+        with self.lock:
+            self._enqueue((FMT_REQUEST + "\n").encode('ascii'))
+        self._fmt_next_try = now + FMT_RETRY_PERIOD
+
+    # -- startup handshake -------------------------------------------------
+
+    # Line rate of a real port, and what depends on it: TX pacing and the
+    # scheduler batch (TX_BATCH_TIME of line time)
+    def _set_baud(self, baud):
+        if self.ser.baudrate != baud:
+            self.ser.baudrate = baud
+        self.tx.batch_bytes = max(64, int(baud / 10 * TX_BATCH_TIME))
+        self._tx_byte_time = 10 / baud  # 8N1
+        self._tx_busy_until = 0.0
+
+    # Host side, run by start() on real ports before the threads: wait for
+    # the device's READY (saying HELLO meanwhile), then move the link to the
+    # highest common rate
+    def _handshake(self):
+        timeout, self.ser.timeout = self.ser.timeout, HELLO_PERIOD
+        try:
+            peer_bauds = self._wait_ready(READY_TIMEOUT)
+            if peer_bauds is None:
+                logger.warning(f"No READY from the device within {READY_TIMEOUT} s, going on at {self.ser.baudrate}")
+                return
+            opening = self.ser.baudrate
+            rates = [b for b in self.bauds if b in peer_bauds and b > opening]
+            if not rates:
+                logger.info(f"Device ready @ {opening}")
+                return
+            rate = max(rates)
+            self.ser.write(f"#BAUD {rate}\n".encode('ascii'))
+            if not self._wait_line(f"#BAUD {rate}", BAUD_CHECK_TIMEOUT):
+                logger.warning(f"Device did not accept {rate} baud, staying at {opening}")
+                return
+            self._set_baud(rate)
+            if self._wait_ready(BAUD_CHECK_TIMEOUT) is not None:
+                logger.info(f"Link switched to {rate} baud")
+                return
+            logger.warning(f"No answer at {rate} baud, back to {opening}")
+            self._set_baud(opening)
+            if self._wait_ready(READY_TIMEOUT + 2 * BAUD_CHECK_TIMEOUT) is None:
+                logger.warning("Device lost after the baud rate change")
+        finally:
+            self.ser.timeout = timeout
+            self.ser.reset_input_buffer()  # handshake leftovers and telemetry at the old rate
+
+    # Say HELLO until a READY line arrives, returns the device's rates (None on timeout)
+    def _wait_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.ser.write(HELLO)
+            line = self._wait_line("#READY", HELLO_PERIOD)
+            if line is not None:
+                return [int(b) for b in line.split()[1:] if b.isdigit()]
+        return None
+
+    # Read lines for up to 'timeout' seconds, returns the first one starting
+    # with 'prefix' (anything else, e.g. telemetry, is skipped)
+    def _wait_line(self, prefix, timeout):
+        deadline = time.monotonic() + timeout
+        buf = bytearray()
+        while time.monotonic() < deadline:
+            buf += self.ser.read(self.ser.in_waiting or 1)
+            *lines, rest = buf.split(b'\n')
+            for line in lines:
+                text = line.decode('ascii', errors='ignore').strip().lstrip("\x00")
+                if text.startswith(prefix):
+                    return text
+            buf = bytearray(rest[-RX_MAX_FRAME:])
+        return None
+
+    # Device side of the handshake (RX thread), True if 'msg' was part of it
+    def _on_handshake(self, msg):
+        if msg == "#HELLO":
+            if self.handshake != 'device':
+                return True
+            self._baud_fallback = None  # the host reached us at this rate
+            if self.rx_binary or self.tx_binary:  # the previous host left us in binary mode
+                logger.info("New host, back to CSV")
+                self._reset_wire_format()
+            with self.lock:
+                self._enqueue(self._ready_line(), channel=protocol.CH_COMMAND)
+            return True
+        if msg.startswith("#BAUD "):
+            rate = msg[6:]
+            if self.handshake == 'device' and rate.isdigit() and int(rate) in self._real_bauds():
+                self._baud_switch = int(rate)
+                self.tx_ready.set()
+            return True
+        return msg.startswith("#READY")
+
+    # Rates the device offers: none on simulated transports
+    def _real_bauds(self):
+        return self.bauds if hasattr(self.ser, 'baudrate') else ()
+
+    def _ready_line(self):
+        return ("#READY " + " ".join(str(b) for b in self._real_bauds())).strip().encode('ascii') + b"\n"
+
+    def _reset_wire_format(self):
+        with self.lock:
+            self.tx_binary = False
+            self.rx_binary = False
+            self._fmt_tries = 0
+            self._fmt_next_try = 0.0
+            self._delta_tx = protocol.SensorDeltaEncoder(self._delta_tx.keyframe_interval) if self._delta_tx else None
+            self._delta_rx = protocol.SensorDeltaDecoder()
+            self._log_tx = protocol.LogInterner()
+
+    # Device side, TX thread: answer a #BAUD request at the old rate, then
+    # switch; fall back to the opening rate if no HELLO follows
+    def _device_baud(self):
+        now = time.monotonic()
+        if self._baud_switch:
+            with self.lock:
+                rate, self._baud_switch = self._baud_switch, None
+            opening = self._baud_fallback[0] if self._baud_fallback else self.ser.baudrate
+            try:
+                self.ser.write(f"#BAUD {rate}\n".encode('ascii'))
+                self.ser.flush()  # wait until it is on the wire
+                self._set_baud(rate)
+            except Exception as e:
+                logger.error(f"Could not switch to {rate} baud: {e}")
+                return
+            self._baud_fallback = (opening, now + 2 * BAUD_CHECK_TIMEOUT)
+            logger.info(f"Switched to {rate} baud")
+        elif now > self._baud_fallback[1]:
+            opening, self._baud_fallback = self._baud_fallback[0], None
+            self._set_baud(opening)
+            logger.warning(f"No HELLO at the new rate, back to {opening} baud")
+
     def start(self):
+        if self.handshake == 'host' and not self.simulate:
+            self._handshake()
         self.running.set()
         self.tx_thread.start()
         self.rx_thread.start()
+        if self.handshake == 'device':
+            with self.lock:
+                self._enqueue(self._ready_line(), channel=protocol.CH_COMMAND)  # like the Arduino at boot
         logger.info("SerialManager started")
 
     def stop(self):
         self.running.clear()
+        self.stop_recording()
+        self.tx_ready.set()
+        with self.lock:
+            self.tx_space.notify_all()
+        if hasattr(self.ser, 'cancel_read'):
+            self.ser.cancel_read()  # wake the RX thread blocked in read()
         time.sleep(0.2)
         try:
             self.ser.close()
@@ -143,17 +751,318 @@ class SerialManager:
         logger.info("SerialManager stopped")
 
     
-    def send(self, msg):
+    # Queue a message for the TX thread. While a message sent with a given
+    # 'key' (e.g. "setpoint") is still queued, a newer one with the same key
+    # replaces it in place, so the link never carries stale values. Keys are
+    # for self-contained messages such as commands: a replaced delta frame
+    # makes the peer wait for the next keyframe. Each channel has its own
+    # queue (see CHANNEL_WEIGHTS); when it is full, send_policy applies
+    # ('block' waits up to 'timeout' seconds). Returns False if the message
+    # was dropped.
+    # With 'drop_oldest' (where send() cannot fail) the message only goes
+    # into the channel's inbox, without taking the lock, and the TX thread
+    # does the rest, in the order they were sent. An inbox holds as many
+    # messages as the channel queue, a full one drops its oldest (counted
+    # without a lock, so a drop may be missed when senders race). Messages
+    # only move on into a channel queue that has room, so they are dropped
+    # before they are encoded: delta frames never go missing in between.
+    # SensorData is copied, callers may reuse theirs.
+    def send(self, msg, key=None, timeout=None, channel=protocol.CH_TELEMETRY):
+        if self.send_policy == 'drop_oldest' and channel not in self._rel_tx:
+            if isinstance(msg, protocol.SensorData):
+                msg = protocol.copy_sensor_data(msg)
+            inbox = self._tx_inbox.get(channel)
+            if inbox is None:
+                inbox = self._tx_inbox.setdefault(channel, deque([], self.tx.queue_size))
+            if len(inbox) == inbox.maxlen:
+                self.link_stats.send_dropped += 1
+            inbox.append((msg, key, channel))
+            if not self.tx_ready.is_set():
+                self.tx_ready.set()
+            return True
         with self.lock:
-            self.send_queue.append(msg)
+            sender = self._rel_tx.get(channel)
+            if sender is not None and self.tx_binary and isinstance(msg, str):
+                return self._send_reliable(sender, channel, msg, key)
+            return self._queue(msg, key, channel, timeout)
 
-    def on_receive(self, line):
+    # Encode a message into its channel queue (call with lock held)
+    def _queue(self, msg, key, channel, timeout=None):
+        if self.tx.queued(channel, key):
+            self.tx.replace(channel, key, self._encode(msg, channel))
+            self.link_stats.send_coalesced += 1
+            return True
+        if not self._make_room(channel, timeout):
+            self.link_stats.send_dropped += 1
+            logger.debug("TX queue full, message dropped")
+            return False
+        self._enqueue(self._encode(msg, channel), key, channel)
+        return True
+
+    # Queue what send() left in the inboxes (TX thread, lock held)
+    def _take_inbox(self):
+        for channel, inbox in list(self._tx_inbox.items()):
+            for _ in range(len(inbox)):
+                if self.tx.full(channel):
+                    break
+                self._queue(*inbox.popleft())
+
+    def _inbox_pending(self):
+        return sum(len(inbox) for inbox in list(self._tx_inbox.values()))
+
+    # Apply send_policy when the channel queue is full (call with lock held)
+    def _make_room(self, channel, timeout):
+        if not self.tx.full(channel):
+            return True
+        if self.send_policy == 'drop_oldest':
+            self.tx.drop_oldest(channel)
+            self.link_stats.send_dropped += 1
+            if self._delta_tx is not None and channel == protocol.CH_TELEMETRY:
+                # the deltas still queued miss a base: start over with a keyframe
+                self._delta_tx = protocol.SensorDeltaEncoder(self._delta_tx.keyframe_interval)
+            return True
+        self.tx_space.wait_for(lambda: not self.tx.full(channel) or not self.running.is_set(), timeout)
+        return not self.tx.full(channel)
+
+    # Queue wire data and wake the TX thread (call with lock held)
+    def _enqueue(self, data, key=None, channel=protocol.CH_TELEMETRY):
+        self.tx.push(channel, data, key)
+        self.link_stats.send_queued(self.tx.pending)
+        self.tx_ready.set()
+
+    # -- reliable channels ----------------------------------------------------
+
+    # Queue text on a reliable channel (call with lock held). The sender's
+    # backlog is bounded like a channel queue, but never drops: a full one
+    # refuses the message (False).
+    def _send_reliable(self, sender, channel, text, key):
+        if self.tx.queue_size is not None and len(sender) >= self.tx.queue_size and key not in sender.backlog.slots:
+            self.link_stats.send_dropped += 1
+            logger.debug("Reliable channel %d full, message dropped", channel)
+            return False
+        sender.push(text, key)
+        self._pump_reliable(channel, sender)
+        return True
+
+    # Move what fits in the window into the channel queue (call with lock held)
+    def _pump_reliable(self, channel, sender):
+        for payload in sender.fill(time.monotonic()):
+            self._enqueue(protocol.encode_frame(protocol.FRAME_REL_DATA, payload, channel), channel=channel)
+
+    # Retransmit timed out messages (TX thread, lock held)
+    def _retransmit(self):
+        now = time.monotonic()
+        for channel, sender in self._rel_tx.items():
+            for payload in sender.due(now):
+                self.link_stats.retransmits += 1
+                self._enqueue(protocol.encode_frame(protocol.FRAME_REL_DATA, payload, channel), channel=channel)
+
+    # How long the TX thread may sleep: until the next retransmission check
+    # or clock sync request
+    def _tx_idle_timeout(self):
+        deadlines = [s.deadline() for s in self._rel_tx.values() if s.deadline() is not None]
+        if self.clock_sync and self.tx_binary:
+            deadlines.append(self._clock_next)
+        if not deadlines:
+            return TX_IDLE_TIMEOUT
+        return min(TX_IDLE_TIMEOUT, max(0.0, min(deadlines) - time.monotonic()))
+
+    # RX side of a reliable frame: an ack frees room in our window, data is
+    # acked (after the whole read) and released in order
+    def _on_reliable(self, channel, kind, payload):
+        if kind == protocol.FRAME_REL_ACK:
+            sender = self._rel_tx.get(channel)
+            if sender is not None:
+                with self.lock:
+                    sender.on_ack(payload, time.monotonic())
+                    self._pump_reliable(channel, sender)
+                self.tx_ready.set()  # the retransmission timer may have moved
+            return None
+        receiver = self._rel_rx.get(channel)
+        if receiver is None:
+            receiver = self._rel_rx[channel] = ReliableReceiver()
+        ack, texts = receiver.on_data(payload)
+        self._rel_acks[channel] = ack
+        for text in texts:
+            logger.debug("RX: %s", text)
+        return texts
+
+    def _send_acks(self):
         with self.lock:
-            self.recv_queue.append(line)
+            for channel, ack in self._rel_acks.items():
+                data = protocol.encode_frame(protocol.FRAME_REL_ACK, ack, channel)
+                if self.tx.queued(channel, ACK_KEY):
+                    self.tx.replace(channel, ACK_KEY, data)
+                else:
+                    self._enqueue(data, ACK_KEY, channel)
+        self._rel_acks.clear()
+
+    # -- clock sync -----------------------------------------------------------
+
+    # Host time of the message in the frame just decoded (RX thread): its
+    # device timestamp mapped to host time when it had one and the clocks
+    # are synced, otherwise its arrival minus its own line time
+    def _sample_time(self, size):
+        arrival = self._rx_frame_time
+        if self._device_time is not None:
+            t = self.clock.to_host(self._device_time)
+            self._device_time = None
+            if t is not None:
+                self.link_stats.latency_ms.add((arrival - t) * 1e3)
+                return t
+        return arrival - size * self._tx_byte_time
 
+    # FRAME_CLOCK_SYNC: answer a request (from the TX thread, see
+    # _clock_frames()) or feed a reply to the estimator
+    def _on_clock_sync(self, payload):
+        if len(payload) == TIME.size:
+            self._clock_replies.append((bytes(payload), self._rx_frame_time))
+            self.tx_ready.set()
+        else:
+            self.clock.on_reply(payload, self._rx_frame_time)
+
+    # Clock sync frames to write ahead of the next batch (TX thread, lock
+    # held): replies to the peer's requests and, every CLOCK_SYNC_PERIOD, our
+    # own request. They are stamped here, when they go out, not when queued.
+    def _clock_frames(self):
+        now = max(time.monotonic(), self._tx_busy_until)
+        frames = []
+        while self._clock_replies:  # appended by the RX thread meanwhile
+            request, t2 = self._clock_replies.popleft()
+            frames.append(protocol.encode_frame(protocol.FRAME_CLOCK_SYNC, clock_reply(request, t2, now)))
+        if self.clock_sync and now >= self._clock_next:
+            frames.append(protocol.encode_frame(protocol.FRAME_CLOCK_SYNC, self.clock.request(now)))
+            fast = len(self.clock.samples) < CLOCK_SYNC_FAST
+            self._clock_next = now + (CLOCK_SYNC_PERIOD / 10 if fast else CLOCK_SYNC_PERIOD)
+        return frames
+
+    # Send SensorData as CSV or binary, depending on the negotiated format
+    def send_sensor_data(self, sd, channel=protocol.CH_TELEMETRY):
+        return self.send(sd, channel=channel)
+
+    # Record everything read from the port to 'path' (see recorder.py), to
+    # replay the session later with replay()
+    def start_recording(self, path):
+        self.stop_recording()
+        recorder = SessionRecorder(path, binary=self.rx_binary)
+        with self._rec_lock:
+            self.recorder = recorder
+        logger.info(f"Recording to {path}")
+
+    # Once the recorder is taken under the lock no write can be in progress,
+    # so it is closed right away
+    def stop_recording(self):
+        with self._rec_lock:
+            recorder, self.recorder = self.recorder, None
+        if recorder is not None:
+            recorder.close()
+            logger.info(f"Recorded {recorder.records} reads ({recorder.bytes} bytes) to {recorder.path}")
+
+    # Append a read to the recording (RX side). A recorder that fails (disk
+    # full, ...) is dropped: the link goes on without it.
+    def _record(self, now, data):
+        with self._rec_lock:
+            if self.recorder is None:
+                return
+            try:
+                self.recorder.write(now, data)
+            except Exception as e:
+                recorder, self.recorder = self.recorder, None
+                logger.error(f"Recording to {recorder.path} stopped: {e}")
+                try:
+                    recorder.close()
+                except OSError:
+                    pass
+
+    # SerialManager that reads a recording instead of a port, through the
+    # same RX thread and callbacks. 'speed' 1 plays it in real time, N
+    # N times faster, 0 as fast as possible; 'loop' starts over at the end
+    # (sm.ser.done is set when it is over otherwise). Nothing is sent.
+    @classmethod
+    def replay(cls, path, speed=1.0, loop=False, **kwargs):
+        ser = ReplaySerial(path, speed, loop)
+        kwargs.setdefault('wire_format', 'auto')  # follow a format switch in the recording
+        sm = cls(ser=ser, **kwargs)
+        sm.rx_binary = bool(ser.flags & FLAG_BINARY)
+        return sm
+
+    # Deliver the messages of one channel to 'callback' (called from the RX
+    # thread, one message at a time) instead of on_receive_batch(). Binary
+    # framing only: CSV lines all arrive on CH_TELEMETRY.
+    def set_receiver(self, channel, callback):
+        if callback is None:
+            self.receivers.pop(channel, None)
+        else:
+            self.receivers[channel] = callback
+
+    # Called with every batch of frames read together, in arrival order
+    # (msg_time holds the timestamp of the message on_receive() gets)
+    def on_receive_batch(self, msgs):
+        self.last_msg = msgs[-1]
+        for msg, t in zip(msgs, self.rx_times):
+            self.msg_time = t
+            self._callback(self.on_receive, msg)
+
+    def _on_log_def(self, payload):
+        old = self.logs.get(payload[0]) if payload else None
+        protocol.define_log(self.logs, payload)
+        if self.logs[payload[0]] != old and self._log_field == bytes([protocol.LOG_INTERNED, payload[0]]):
+            self._log_field = None  # ID reused for another text
+
+    # Calls on_log() when the received system_log changes. 'field' is the log
+    # field of a binary payload (compared as bytes, no decoding per frame) or
+    # the log column of a CSV line.
+    def _update_log(self, field):
+        if field == self._log_field:
+            return
+        text = field if isinstance(field, str) else protocol.resolve_log_field(field, self.logs)
+        if text is None:
+            return  # ID not defined yet (missed definition), retried on the next frame
+        self._log_field = field
+        if text != self.last_log:  # e.g. same text after a switch to binary
+            self.last_log = text
+            if text:
+                self._callback(self.on_log, text)
+
+    # New system_log message from the peer (called from the RX thread)
+    def on_log(self, text):
+        logger.debug("LOG: %s", text)
+
+    def on_receive(self, line):
+        if len(self.recv_queue) == self.recv_queue.maxlen:
+            self.link_stats.recv_dropped += 1  # the oldest one goes
+        self.recv_queue.append((self.msg_time, line))
+        self.link_stats.recv_queued(len(self.recv_queue))
+
+    # Newest message only (older pending ones stay queued)
     def recv(self):
+        try:
+            return self.recv_queue.pop()[1]
+        except IndexError:
+            return None
+
+    # All pending messages (at most 'max_items'), oldest first; with
+    # times=True as (timestamp, message) pairs, see msg_time
+    def recv_batch(self, max_items=None, times=False):
+        n = len(self.recv_queue) if max_items is None else min(max_items, len(self.recv_queue))
+        pairs = []
+        try:
+            for _ in range(n):
+                pairs.append(self.recv_queue.popleft())
+        except IndexError:  # recv() took the last ones meanwhile
+            pass
+        return pairs if times else [msg for _, msg in pairs]
+
+    # Snapshot of the link counters (see link_stats.LinkStats) plus the
+    # current queue depths, e.g. to see when the Pi falls behind:
+    #   frames/bytes in and out, parse errors, drops, queue high-water marks
+    #   and the inter-arrival histogram of received frames
+    def stats(self) -> dict:
         with self.lock:
-            logger.debug(len(self.recv_queue))
-            if len(self.recv_queue) != 0:
-                return self.recv_queue.pop()
-            return None
\ No newline at end of file
+            return self.link_stats.snapshot(send_queue=self.tx.pending + self._inbox_pending(), recv_queue=len(self.recv_queue),
+                                            **self.clock.snapshot())
+
+    # Most recent message received, without consuming anything (for widgets
+    # that only show the current value)
+    def latest(self):
+        return self.last_msg
\ No newline at end of file
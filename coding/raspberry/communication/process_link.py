@@ -0,0 +1,222 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import itertools
+import threading
+import multiprocessing
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication import protocol
+from communication.mux_tx_rx import SerialManager, link_bauds, logger
+from communication.shm_serial import ShmRing
+from communication.broker import BrokerClient, RecordPublisher, _split_records, STATS_PERIOD
+
+
+# SerialManager with its I/O in a child process
+#
+#   sm = ProcessSerialManager(simulate=False, port="/dev/ttyACM0", ...)   same arguments
+#
+# In the dashboards the RX/TX threads share the GIL with the rendering, so
+# reads (and their timestamps) wait whenever a frame is drawn. Here a child
+# process, pinned to a core of its own (which the parent's threads leave to
+# it while started), runs a normal SerialManager and passes what it receives
+# through a shared memory ring (the records of broker.py, encoded once per
+# read); messages sent here go the other way through a second ring. The
+# parent only polls the ring every POLL_PERIOD, and the timestamps are taken
+# in the child, so a slow frame in the parent delays delivery but not the
+# link. Callbacks, recv_batch(), send(), stats() and start_recording() work
+# as with SerialManager. If the child dies, a new one is started.
+#
+# The child is started with 'spawn' (no fork of a process running Qt or
+# pygame threads), so the main script needs the usual
+# 'if __name__ == "__main__":' guard.
+
+RING_SIZE = 1 << 22      # [bytes] per direction
+POLL_PERIOD = 0.002      # [s] wait between checks of an empty ring
+WRITE_TIMEOUT = 1.0      # [s] a full ring means the other side is stuck
+_ids = itertools.count()
+
+
+# Last core this process may run on (None on a single core, or where
+# affinity cannot be set)
+def default_cpu():
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    return cpus[-1] if len(cpus) > 1 else None
+
+
+# Affinity of every thread of this process (sched_setaffinity(0) only moves
+# the calling one; threads started later inherit it)
+def _set_affinity(cpus):
+    try:
+        tids = [int(tid) for tid in os.listdir('/proc/self/task')]
+    except OSError:
+        tids = [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            pass  # thread gone meanwhile
+
+
+# Parent end of the two rings, with the socket calls BrokerClient uses
+class _ChildLink:
+
+    def __init__(self, kwargs, cpu):
+        tag = f"osmd_io_{os.getpid()}_{next(_ids)}"
+        self.rx = ShmRing(tag + "_down", RING_SIZE)
+        self.tx = ShmRing(tag + "_up", RING_SIZE)
+        ctx = multiprocessing.get_context('spawn')
+        self.stop = ctx.Event()
+        self.process = ctx.Process(target=_child_main, args=(kwargs, tag, cpu, self.stop),
+                                   name="serial-io", daemon=True)
+        self.process.start()
+        self.timeout = 1.0  # [s] like the socket timeout
+
+    # Bytes from the child; raises socket.timeout when there are none for
+    # 'timeout', b'' once the child is gone
+    def recv(self, size):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            data = self.rx.get(size)
+            if data:
+                return data
+            if self.stop.is_set() or not self.process.is_alive():
+                return b''
+            if time.monotonic() >= deadline:
+                raise socket.timeout()
+            time.sleep(POLL_PERIOD)
+
+    # Whole records only: a half written one would garble the stream
+    def sendall(self, data):
+        deadline = time.monotonic() + WRITE_TIMEOUT
+        while self.tx.capacity - self.tx.pending() < len(data):
+            if not self.process.is_alive() or time.monotonic() >= deadline:
+                raise OSError("Serial I/O process is not reading")
+            time.sleep(POLL_PERIOD)
+        self.tx.put(data)
+
+    def shutdown(self, how):
+        self.stop.set()
+
+    def close(self):
+        self.stop.set()
+        self.process.join(2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        for ring in (self.rx, self.tx):
+            ring.close()
+            ring.unlink()
+
+
+class ProcessSerialManager(BrokerClient):
+
+    def __init__(self, cpu='auto', **kwargs):
+        self.cpu = default_cpu() if cpu == 'auto' else cpu
+        self._kwargs = kwargs
+        self.peer = "serial I/O process" + (f" (cpu {self.cpu})" if self.cpu is not None else "")
+        self._parent_cpus = None  # our affinity before start(), restored by stop()
+        super().__init__(path=None, debug=kwargs.get('debug', False))
+
+    # The child's core is taken out of ours (when we have others), so
+    # rendering does not preempt the I/O there
+    def start(self):
+        if self.cpu is not None and hasattr(os, 'sched_setaffinity'):
+            cpus = os.sched_getaffinity(0)
+            if cpus - {self.cpu}:
+                self._parent_cpus = cpus
+                _set_affinity(cpus - {self.cpu})
+        super().start()
+
+    def stop(self):
+        super().stop()
+        if self._parent_cpus is not None:
+            _set_affinity(self._parent_cpus)
+            self._parent_cpus = None
+
+    def _connect(self):
+        return _ChildLink(self._kwargs, self.cpu)
+
+    def _reconnect(self):
+        code = self.ser.process.exitcode
+        logger.error(f"Serial I/O process exited ({code}), starting a new one")
+        with self._send_lock:
+            self.ser.close()
+            self.ser = self._connect()
+
+
+# Child side: one writer for the down ring (the RX thread and the stats
+# both publish), whole chunks or nothing
+class _Publisher:
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.lock = threading.Lock()
+        self.dropped = 0  # [bytes] parent too slow, ring full
+
+    def __call__(self, chunk):
+        with self.lock:
+            if self.ring.capacity - self.ring.pending() < len(chunk):
+                self.dropped += len(chunk)
+                return
+            self.ring.put(chunk)
+
+
+def _child_main(kwargs, tag, cpu, stop):
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+    down = ShmRing(tag + "_down")
+    up = ShmRing(tag + "_up")
+    publish = _Publisher(down)
+    sm = SerialManager(**kwargs)
+    publisher = RecordPublisher(sm, publish)
+    sm.start()
+    parent = multiprocessing.parent_process()
+    buf = bytearray()
+    next_stats = time.monotonic()
+    try:
+        while not stop.is_set() and parent.is_alive():
+            data = up.get(65536)
+            if data:
+                buf += data
+                for kind, channel, _, payload in _split_records(buf):
+                    publisher.on_record(kind, channel, payload)
+            else:
+                time.sleep(POLL_PERIOD)
+            if time.monotonic() >= next_stats:
+                next_stats += STATS_PERIOD
+                publish(publisher.stats_record(ring_dropped=publish.dropped))
+    finally:
+        sm.stop()
+        down.close()
+        up.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="talker_mockup.py with the serial I/O in a child process")
+    parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
+    parser.add_argument("--port", "-p", default="/dev/ttyACM0", help="Serial port to use when not simulating")
+    parser.add_argument("--baud", "-b", type=int, default=38400, help="Opening baud rate (the startup handshake may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate the startup handshake may switch to (default: any the device offers)")
+    parser.add_argument("--name", "-n", choices=['A', 'B'], required=True, help="Name of this node (A or B) for simulation mode")
+    parser.add_argument("--cpu", type=int, default=None, help="Core to pin the I/O process to (default: the last one)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sm = ProcessSerialManager(cpu=args.cpu if args.cpu is not None else 'auto', simulate=args.simulate,
+                              port=args.port, baud=args.baud, name=args.name, bauds=link_bauds(args.max_baud))
+    sm.on_receive = lambda msg: print(f"[{args.name} RECEIVED] {msg}")
+    sm.start()
+    try:
+        counter = 0
+        while True:
+            sm.send(f"Hello from {args.name} {counter}", channel=protocol.CH_TELEMETRY)
+            counter += 1
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sm.stop()
@@ -1,41 +1,425 @@
-from ctypes import Structure, c_uint16, c_bool, c_float
+import struct
+from ctypes import Structure, sizeof
+from binascii import crc_hqx
+
+from communication import schema
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Layout comes from sensor_data.json (see schema.py / gen_protocol.py)
+SCHEMA = schema.load_schema()
+SCHEMA_VERSION = SCHEMA["version"]
 
 # Sensor Data structure
+# (_pack_ = 1 so the in-memory layout matches the AVR struct byte for byte)
 class SensorData(Structure):
-    _fields_ = [
-        ("motor_encoders", c_uint16 * 4),
-        ("home_switches", c_bool * 4),
-        ("potentiometers", c_uint16 * 2),
-        ("ref_diode", c_uint16),
-        ("temp_sensor", c_float),
-        ("imu", c_float * 6)
-    ]
+    _pack_ = 1
+    _fields_ = schema.ctypes_fields(SCHEMA)
 
     def __init__(self):
         super().__init__()
         self.system_log = ""
 
+_STRUCT = schema.struct_format(SCHEMA)
+assert _STRUCT.size == sizeof(SensorData)
+_CSV_TEMPLATE = schema.csv_template(SCHEMA)
+_CSV_PARSERS = schema.csv_parsers(SCHEMA)
+_CSV_COLUMNS = schema.csv_columns(SCHEMA)
+_CSV_NUMERIC = len(_CSV_PARSERS)
+
 # Serialize SensorData to string
 def sensor_data_to_string(sensor: SensorData) -> str:
-    values = []
-    values.extend(sensor.motor_encoders[:])
-    values.extend(int(b) for b in sensor.home_switches[:])
-    values.extend(sensor.potentiometers[:])
-    values.append(sensor.ref_diode)
-    values.append(f"{sensor.temp_sensor:.3f}")
-    values.extend(f"{v:.3f}" for v in sensor.imu[:])
-    values.append(f'"{sensor.system_log}"')
-    return ",".join(str(v) for v in values)
-
-# Deserialize string to SensorData
+    return _CSV_TEMPLATE.format(*_STRUCT.unpack(bytes(sensor)), sensor.system_log)
+
+# Deserialize string to SensorData (the trailing system_log is optional,
+# the Arduino firmware does not send it)
 def string_to_sensor_data(msg: str) -> SensorData:
-    parts = msg.split(",")
-    sd = SensorData()
-    sd.motor_encoders[:] = [int(parts[i]) for i in range(4)]
-    sd.home_switches[:] = [bool(int(parts[i])) for i in range(4,8)]
-    sd.potentiometers[:] = [int(parts[i]) for i in range(8,10)]
-    sd.ref_diode = int(parts[10])
-    sd.temp_sensor = float(parts[11])
-    sd.imu[:] = [float(parts[i]) for i in range(12,18)]
-    sd.system_log = parts[18].strip('"')
+    parts = msg.split(",", _CSV_NUMERIC)
+    if len(parts) < _CSV_NUMERIC:
+        raise ValueError(f"Expected {_CSV_NUMERIC} values, got {len(parts)}")
+    try:
+        packed = _STRUCT.pack(*[parse(p) for parse, p in zip(_CSV_PARSERS, parts)])
+    except (struct.error, OverflowError) as e:  # e.g. 70000 in a uint16 field
+        raise ValueError(f"Value out of range: {e}") from e
+    sd = SensorData.from_buffer_copy(packed)
+    sd.system_log = parts[_CSV_NUMERIC].strip().strip('"') if len(parts) > _CSV_NUMERIC else ""
     return sd
+
+
+# ---------------------------------------------------------------------------
+# Binary wire format
+#
+#   frame   = COBS(channel << 4 | kind | payload | crc16) + 0x00
+#   kind    = FRAME_SENSOR_DATA, FRAME_TEXT, FRAME_SENSOR_DELTA, FRAME_LOG_DEF,
+#             FRAME_REL_DATA or FRAME_REL_ACK (see reliable.py),
+#             FRAME_DEVICE_TIME or FRAME_CLOCK_SYNC (see clock_sync.py)
+#   channel = 0..15, CH_TELEMETRY unless sent on another channel
+#   crc16   = CRC-16/CCITT-FALSE over kind + payload, little endian
+#
+# COBS removes every 0x00 from the encoded frame, so 0x00 only ever appears
+# as the delimiter: after line noise the receiver drops bytes up to the next
+# 0x00 and is back in sync (the bad frame fails the CRC check).
+# ---------------------------------------------------------------------------
+
+FRAME_DELIMITER = b"\x00"
+FRAME_SENSOR_DATA = 0x01
+FRAME_TEXT = 0x02
+FRAME_SENSOR_DELTA = 0x03
+FRAME_LOG_DEF = 0x04
+FRAME_REL_DATA = 0x05
+FRAME_REL_ACK = 0x06
+FRAME_DEVICE_TIME = 0x07  # u32 device microseconds, stamps the frame that follows it
+FRAME_CLOCK_SYNC = 0x08   # request (u32 t1) or reply (t1, t2, t3)
+
+# Channels multiplexed on one link (the high nibble of the kind byte)
+CH_TELEMETRY = 0  # SensorData and anything sent without a channel
+CH_COMMAND = 1    # motor commands and setpoints
+CH_LOG = 2        # free text logs
+MAX_CHANNEL = 15
+
+SENSOR_DATA_SIZE = sizeof(SensorData)
+MAX_LOG_LEN = 254
+LOG_INTERNED = 0xFF  # log field tag: a 1 byte ID follows instead of the text
+
+
+def crc16(data: bytes) -> int:
+    return crc_hqx(data, 0xFFFF)
+
+
+def cobs_encode(data: bytes) -> bytes:
+    out = bytearray()
+    for block in bytes(data).split(b"\x00"):
+        while len(block) >= 0xFE:
+            out.append(0xFF)
+            out += block[:0xFE]
+            block = block[0xFE:]
+        out.append(len(block) + 1)
+        out += block
+    return bytes(out)
+
+
+def cobs_decode(data: bytes) -> bytes:
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        code = data[i]
+        end = i + code
+        if code == 0 or end > n:
+            raise ValueError("Invalid COBS data")
+        out += data[i + 1:end]
+        i = end
+        if code < 0xFF and i < n:
+            out.append(0)
+    return bytes(out)
+
+
+# Wrap a payload into a delimited binary frame
+def encode_frame(kind: int, payload: bytes, channel: int = CH_TELEMETRY) -> bytes:
+    if not 0 <= channel <= MAX_CHANNEL:
+        raise ValueError(f"channel must be 0..{MAX_CHANNEL}")
+    body = bytes([channel << 4 | kind]) + payload
+    return cobs_encode(body + crc16(body).to_bytes(2, "little")) + FRAME_DELIMITER
+
+# Unwrap a binary frame (with or without delimiter) into (channel, kind,
+# payload), raises ValueError if corrupt
+def decode_channel_frame(frame: bytes):
+    body = cobs_decode(bytes(frame).rstrip(FRAME_DELIMITER))
+    if len(body) < 3:
+        raise ValueError("Frame too short")
+    if crc16(body[:-2]) != int.from_bytes(body[-2:], "little"):
+        raise ValueError("CRC mismatch")
+    return body[0] >> 4, body[0] & 0x0F, body[1:-2]
+
+# Same, for callers that do not care about the channel: (kind, payload)
+def decode_frame(frame: bytes):
+    return decode_channel_frame(frame)[1:]
+
+
+# system_log field of a binary payload: length-prefixed text, or
+# LOG_INTERNED followed by an ID defined earlier by a FRAME_LOG_DEF frame
+def log_field(text: str) -> bytes:
+    log = text.encode("utf-8")[:MAX_LOG_LEN]
+    return bytes([len(log)]) + log
+
+# Raw log field starting at 'pos' (tag/length byte included)
+def read_log_field(payload: bytes, pos: int) -> bytes:
+    n = 1 if payload[pos] == LOG_INTERNED else payload[pos]
+    return bytes(payload[pos:pos + 1 + n])
+
+# Log field of a SensorData payload (ValueError if the payload is too short
+# to hold the struct and the whole field)
+def sensor_log_field(payload: bytes) -> bytes:
+    if len(payload) < SENSOR_DATA_SIZE + 1:
+        raise ValueError(f"SensorData payload too short ({len(payload)} bytes)")
+    field = read_log_field(payload, SENSOR_DATA_SIZE)
+    if len(field) < (2 if field[0] == LOG_INTERNED else 1 + field[0]):
+        raise ValueError("SensorData log field cut short")
+    return field
+
+# Text of a log field, using 'logs' (ID -> text) for interned ones
+# (None if the ID has not been defined yet)
+def resolve_log_field(field: bytes, logs=None):
+    if field[0] == LOG_INTERNED:
+        return (logs or {}).get(field[1])
+    return field[1:].decode("utf-8", errors="replace")
+
+
+# Serialize SensorData to bytes (raw struct + system_log field, see above)
+def sensor_data_to_bytes(sensor: SensorData, log=None) -> bytes:
+    return bytes(sensor) + (log if log is not None else log_field(getattr(sensor, "system_log", "")))
+
+# Independent copy of a SensorData (the log is a Python attribute, not in the structure)
+def copy_sensor_data(sensor: SensorData) -> SensorData:
+    sd = SensorData.from_buffer_copy(sensor)
+    sd.system_log = getattr(sensor, "system_log", "")
+    return sd
+
+# Deserialize bytes to SensorData ('logs' resolves interned system_log IDs)
+def bytes_to_sensor_data(payload: bytes, logs=None) -> SensorData:
+    if len(payload) < SENSOR_DATA_SIZE + 1:
+        raise ValueError(f"SensorData payload too short ({len(payload)} bytes)")
+    sd = SensorData.from_buffer_copy(payload)
+    sd.system_log = resolve_log_field(sensor_log_field(payload), logs) or ""
+    return sd
+
+# Decode a received message whatever the wire format (str = CSV, bytes = binary)
+def decode_sensor_data(msg, logs=None) -> SensorData:
+    if isinstance(msg, str):
+        return string_to_sensor_data(msg)
+    return bytes_to_sensor_data(msg, logs)
+
+
+# ---------------------------------------------------------------------------
+# Interned system_log strings (binary wire format only)
+#
+#   FRAME_LOG_DEF payload = id (u8) | utf-8 text
+#
+# The sender gives each distinct log message a small ID and sends its text
+# once in a FRAME_LOG_DEF frame; SensorData frames then only carry
+# LOG_INTERNED + ID. Definitions are repeated every 'refresh' uses so a
+# receiver that missed one (CRC error, late start) catches up.
+# ---------------------------------------------------------------------------
+
+MAX_LOG_IDS = 255
+
+
+# Sender side: text -> ID table
+class LogInterner:
+
+    def __init__(self, refresh=100):
+        self.refresh = refresh
+        self._ids = {}    # text -> id
+        self._uses = {}   # id -> frames since its text was last sent
+
+    # Returns (log field, FRAME_LOG_DEF payload or None)
+    def intern(self, text: str):
+        if not text:
+            return log_field(""), None
+        log_id = self._ids.get(text)
+        if log_id is None:
+            if len(self._ids) >= MAX_LOG_IDS:
+                self._ids.clear()  # table full: start over, IDs get redefined
+            log_id = len(self._ids)
+            self._ids[text] = log_id
+            self._uses[log_id] = self.refresh
+        definition = None
+        if self._uses[log_id] >= self.refresh:
+            self._uses[log_id] = 0
+            definition = bytes([log_id]) + text.encode("utf-8")[:MAX_LOG_LEN]
+        self._uses[log_id] += 1
+        return bytes([LOG_INTERNED, log_id]), definition
+
+
+# Receiver side: store a FRAME_LOG_DEF payload into 'logs' (ID -> text)
+def define_log(logs: dict, payload: bytes):
+    if not payload:
+        raise ValueError("Empty log definition")
+    logs[payload[0]] = bytes(payload[1:]).decode("utf-8", errors="replace")
+
+
+# ---------------------------------------------------------------------------
+# Delta encoding (binary wire format only)
+#
+#   keyframe = FRAME_SENSOR_DATA, the full payload above
+#   delta    = FRAME_SENSOR_DELTA: seq (u8) | change mask | changed scalars | [log]
+#
+# The mask has one bit per scalar (array elements count separately) plus one
+# for system_log; only the flagged values follow, packed like in the struct.
+# 'seq' counts frames since the last keyframe, so the receiver notices a
+# lost frame and waits for the next keyframe instead of showing stale values.
+# ---------------------------------------------------------------------------
+
+_SCALARS = [struct.Struct("<" + code) for code in schema.scalar_codes(SCHEMA)]
+_LOG_BIT = len(_SCALARS)
+_MASK_BYTES = (_LOG_BIT + 1 + 7) // 8
+
+
+# Sender side: keeps the last values sent
+class SensorDeltaEncoder:
+
+    def __init__(self, keyframe_interval=25):
+        self.keyframe_interval = min(keyframe_interval, 256)  # seq is one byte
+        self._values = None
+        self._log = None
+        self._seq = 0
+
+    # Returns (frame kind, payload) for the next frame ('log' as in
+    # sensor_data_to_bytes)
+    def encode(self, sensor: SensorData, log=None):
+        values = _STRUCT.unpack(bytes(sensor))
+        if log is None:
+            log = log_field(sensor.system_log)
+        if self._values is None or self._seq + 1 >= self.keyframe_interval:
+            self._values, self._log, self._seq = values, log, 0
+            return FRAME_SENSOR_DATA, sensor_data_to_bytes(sensor, log)
+
+        self._seq += 1
+        mask = 0
+        changed = []
+        for i, (new, old) in enumerate(zip(values, self._values)):
+            if new != old:
+                mask |= 1 << i
+                changed.append(_SCALARS[i].pack(new))
+        if log != self._log:
+            mask |= 1 << _LOG_BIT
+            changed.append(log)
+        self._values, self._log = values, log
+        return FRAME_SENSOR_DELTA, bytes([self._seq]) + mask.to_bytes(_MASK_BYTES, "little") + b"".join(changed)
+
+
+# Receiver side: rebuilds full SensorData payloads from keyframes + deltas
+class SensorDeltaDecoder:
+
+    def __init__(self):
+        self._values = None
+        self._log = log_field("")
+        self._seq = 0
+
+    # Remember a keyframe (FRAME_SENSOR_DATA payload)
+    def keyframe(self, payload: bytes):
+        log = sensor_log_field(payload)
+        self._values = list(_STRUCT.unpack_from(payload))
+        self._log = log
+        self._seq = 0
+
+    # Apply a FRAME_SENSOR_DELTA payload, returns the full payload
+    # (ValueError if it does not follow the frames seen so far)
+    def apply(self, payload: bytes) -> bytes:
+        if self._values is None:
+            raise ValueError("Delta before first keyframe")
+        if not payload:
+            raise ValueError("Empty delta")
+        if payload[0] != self._seq + 1:
+            self._values = None  # lost a frame, wait for the next keyframe
+            raise ValueError(f"Delta out of sequence ({payload[0]} after {self._seq})")
+        try:
+            mask = int.from_bytes(payload[1:1 + _MASK_BYTES], "little")
+            pos = 1 + _MASK_BYTES
+            for i, fmt in enumerate(_SCALARS):
+                if mask >> i & 1:
+                    self._values[i] = fmt.unpack_from(payload, pos)[0]
+                    pos += fmt.size
+            if mask >> _LOG_BIT & 1:
+                self._log = read_log_field(payload, pos)
+        except (IndexError, struct.error):
+            self._values = None
+            raise ValueError("Delta cut short")
+        self._seq = payload[0]
+        return _STRUCT.pack(*self._values) + self._log
+
+
+# ---------------------------------------------------------------------------
+# Batch decoding into NumPy (optional dependency)
+# ---------------------------------------------------------------------------
+
+# Structured dtype with the same fields, shapes and packed layout as SensorData
+# (system_log is not part of the struct and is not included)
+SENSOR_DTYPE = schema.numpy_dtype(SCHEMA) if np is not None else None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for batch decoding")
+
+
+# Numeric columns, parsed like string_to_sensor_data() does (int() columns
+# reject "1.5", float() columns take "nan"), or None if a line does not parse
+def _parse_rows(lines):
+    dtype = [(f"c{i}", '<i8' if parse is int else '<f8') for i, parse in enumerate(_CSV_PARSERS)]
+    try:
+        rows = np.loadtxt(lines, dtype=dtype, delimiter=",", comments=None,
+                          usecols=range(_CSV_NUMERIC), ndmin=1)
+    except (ValueError, OverflowError):
+        return None
+    if len(rows) != len(lines):
+        return None
+    return np.stack([rows[f"c{i}"].astype(np.float64) for i in range(_CSV_NUMERIC)], axis=1)
+
+
+# Decode many CSV lines at once. Returns (data, valid): a SENSOR_DTYPE array
+# with one row per line, and a bool mask that is False for malformed lines
+# (their row is left zeroed) instead of raising. A line is valid here
+# exactly when string_to_sensor_data() accepts it.
+def strings_to_sensor_array(msgs):
+    _require_numpy()
+    n = len(msgs)
+    data = np.zeros(n, SENSOR_DTYPE)
+    valid = np.ones(n, bool)
+    if n == 0:
+        return data, valid
+    values = _parse_rows(msgs)
+    if values is None:
+        # slow path, only for batches that contain bad lines
+        for i, m in enumerate(msgs):
+            try:
+                data[i:i + 1] = np.frombuffer(bytes(string_to_sensor_data(m)), SENSOR_DTYPE)
+            except ValueError:
+                valid[i] = False
+        return data, valid
+
+    # range checks of the struct packing, then copy the columns into their fields
+    col = 0
+    for name, width in _CSV_COLUMNS:
+        block = values[:, col:col + width]
+        base = SENSOR_DTYPE[name].base
+        if base.kind == "u":
+            valid &= np.all((block >= 0) & (block <= np.iinfo(base).max), axis=1)
+        elif base.kind == "f":
+            with np.errstate(over='ignore'):
+                valid &= np.all(np.isfinite(block.astype(base)) | ~np.isfinite(block), axis=1)
+        col += width
+    values = values[valid]
+    col = 0
+    for name, width in _CSV_COLUMNS:
+        block = values[:, col:col + width]
+        data[name][valid] = block if width > 1 else block[:, 0]
+        col += width
+    return data, valid
+
+
+# Decode many binary SensorData payloads at once (same return as above)
+def bytes_to_sensor_array(payloads):
+    _require_numpy()
+    valid = np.array([len(p) > SENSOR_DATA_SIZE for p in payloads], dtype=bool)
+    blank = bytes(SENSOR_DATA_SIZE)
+    raw = b"".join(bytes(p[:SENSOR_DATA_SIZE]) if ok else blank for p, ok in zip(payloads, valid))
+    return np.frombuffer(raw, SENSOR_DTYPE).copy(), valid
+
+
+# Decode a batch of received messages, CSV (str) and binary (bytes) mixed
+def decode_sensor_array(msgs):
+    _require_numpy()
+    text = [i for i, m in enumerate(msgs) if isinstance(m, str)]
+    if len(text) == len(msgs):
+        return strings_to_sensor_array(msgs)
+    if not text:
+        return bytes_to_sensor_array(msgs)
+    binary = [i for i, m in enumerate(msgs) if not isinstance(m, str)]
+    data = np.zeros(len(msgs), SENSOR_DTYPE)
+    valid = np.zeros(len(msgs), bool)
+    data[text], valid[text] = strings_to_sensor_array([msgs[i] for i in text])
+    data[binary], valid[binary] = bytes_to_sensor_array([msgs[i] for i in binary])
+    return data, valid
@@ -0,0 +1,98 @@
+import os
+import tty
+import time
+import select
+import argparse
+import threading
+
+
+# Virtual null-modem built from two pseudo-terminals (Linux/macOS)
+#
+# Each end is a real tty (e.g. /dev/pts/5), so SerialManager(simulate=False,
+# port=modem.port_a) goes through serial.Serial exactly as with an Arduino:
+# timeouts, partial reads and termios settings all behave like the real link.
+# A relay thread per direction copies bytes between the two masters and can
+# pace them to the configured baud rate (8N1: 10 bits per byte).
+class VirtualNullModem:
+
+    CHUNK_PERIOD = 0.01  # [s] pacing granularity when throttled
+
+    def __init__(self, baud=None, loopback=False):
+        self.baud = baud
+        self.loopback = loopback
+        self.running = threading.Event()
+
+        self._master_a, self._slave_a = os.openpty()
+        tty.setraw(self._slave_a)
+        self.port_a = os.ttyname(self._slave_a)
+        if loopback:
+            # whatever is written to port_a is read back from port_a
+            self._master_b, self._slave_b, self.port_b = self._master_a, None, self.port_a
+        else:
+            self._master_b, self._slave_b = os.openpty()
+            tty.setraw(self._slave_b)
+            self.port_b = os.ttyname(self._slave_b)
+
+        self._threads = [threading.Thread(target=self._relay, args=(self._master_a, self._master_b), daemon=True)]
+        if not loopback:
+            self._threads.append(threading.Thread(target=self._relay, args=(self._master_b, self._master_a), daemon=True))
+
+    def _relay(self, src, dst):
+        chunk = max(1, int(self.baud / 10 * self.CHUNK_PERIOD)) if self.baud else 4096
+        next_slot = time.monotonic()
+        while self.running.is_set():
+            ready, _, _ = select.select([src], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(src, 4096)
+            except OSError:  # other end closed
+                break
+            for i in range(0, len(data), chunk):
+                if self.baud:
+                    next_slot = max(next_slot, time.monotonic())
+                    time.sleep(max(0.0, next_slot - time.monotonic()))
+                    next_slot += len(data[i:i + chunk]) * 10 / self.baud
+                os.write(dst, data[i:i + chunk])
+
+    def start(self):
+        self.running.set()
+        for t in self._threads:
+            t.start()
+        return self
+
+    def stop(self):
+        self.running.clear()
+        for t in self._threads:
+            t.join(timeout=1.0)
+        for fd in {self._master_a, self._slave_a, self._master_b, self._slave_b} - {None}:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Virtual null-modem (pty pair) for local serial tests")
+    parser.add_argument("--baud", "-b", type=int, default=None, help="Throttle to this baud rate (default: unthrottled)")
+    parser.add_argument("--loopback", "-l", action="store_true", help="Single port that echoes back what is written")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    modem = VirtualNullModem(baud=args.baud, loopback=args.loopback).start()
+    print(f"A: {modem.port_a}")
+    print(f"B: {modem.port_b}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Ctrl+C pressed — stopping null-modem")
+        modem.stop()
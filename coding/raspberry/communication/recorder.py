@@ -0,0 +1,172 @@
+import mmap
+import time
+import struct
+import argparse
+import threading
+
+
+# Session recordings: the raw bytes SerialManager read from the port, with
+# the time of each read, so a bench session can be replayed without the
+# hardware (see SerialManager.start_recording() and SerialManager.replay())
+#
+#   header = MAGIC | flags (u8) | wall clock at start (f64, time.time())
+#   record = t (f64, seconds since the start) | length (u32) | bytes
+#
+# flags bit 0: the link was already on the binary wire format. Everything
+# else (format switch, log definitions, keyframes) is in the bytes, and
+# replaying them through the same parser reproduces the session.
+
+MAGIC = b"OSMDREC\x01"
+HEADER = struct.Struct("<8sBd")
+RECORD = struct.Struct("<dI")
+FLAG_BINARY = 0x01
+
+
+# Append-only writer, fed by the RX thread (one record per read)
+class SessionRecorder:
+
+    def __init__(self, path, binary=False):
+        self.path = path
+        self.start = time.monotonic()
+        self.records = 0
+        self.bytes = 0
+        self._f = open(path, 'wb')
+        self._f.write(HEADER.pack(MAGIC, FLAG_BINARY if binary else 0, time.time()))
+
+    # 'now' is the time.monotonic() of the read
+    def write(self, now, data):
+        self._f.write(RECORD.pack(now - self.start, len(data)))
+        self._f.write(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def close(self):
+        self._f.close()
+
+
+# (flags, wall clock at start) of a recording
+def read_header(buf):
+    if len(buf) < HEADER.size:
+        raise ValueError("Not a session recording (too short)")
+    magic, flags, wall_start = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("Not a session recording (bad magic)")
+    return flags, wall_start
+
+
+# Records of a recording as (t, memoryview) pairs, without copying
+def iter_records(buf):
+    pos = HEADER.size
+    while pos + RECORD.size <= len(buf):
+        t, n = RECORD.unpack_from(buf, pos)
+        pos += RECORD.size
+        if pos + n > len(buf):
+            break  # cut short while recording
+        yield t, buf[pos:pos + n]
+        pos += n
+
+
+# Read-only serial port that plays a recording back, mmap'ed, at the pace it
+# was recorded divided by 'speed' (0 = as fast as the reader takes it).
+# Writes are dropped. 'done' is set once everything has been read.
+class ReplaySerial:
+
+    def __init__(self, path, speed=1.0, loop=False):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.timeout = 1.0  # [s] like serial.Serial(timeout=...)
+        self.done = threading.Event()
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self.flags, self.wall_start = read_header(self._view)
+        self._rewind()
+
+    def _rewind(self):
+        self._records = iter_records(self._view)
+        self._chunk = None  # (t, remaining bytes) of the current record
+        self._t0 = None     # monotonic time the recording's t=0 plays at
+
+    # Current record once it is due, None if the next one is still ahead
+    def _due(self):
+        if self._chunk is None:
+            rec = next(self._records, None)
+            if rec is None:
+                if not self.loop:
+                    self.done.set()
+                    return None
+                self._rewind()
+                rec = next(self._records, None)
+                if rec is None:
+                    return None
+            self._chunk = rec
+        t, data = self._chunk
+        if self._t0 is None:
+            self._t0 = time.monotonic() - (t / self.speed if self.speed else 0)
+        if self.speed and time.monotonic() < self._t0 + t / self.speed:
+            return None
+        return self._chunk
+
+    @property
+    def in_waiting(self) -> int:
+        chunk = self._due()
+        return len(chunk[1]) if chunk else 0
+
+    # Read up to 'size' bytes of the current record, waiting up to 'timeout'
+    # for it to be due
+    def read(self, size=1) -> bytes:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            chunk = self._due()
+            if chunk is not None:
+                break
+            if self.done.is_set() or time.monotonic() >= deadline:
+                return b''
+            wait = self._t0 + self._chunk[0] / self.speed - time.monotonic() if self._chunk else 0.01
+            time.sleep(min(max(wait, 0.0), deadline - time.monotonic(), 0.05))
+        t, data = chunk
+        out = bytes(data[:size])
+        self._chunk = (t, data[size:]) if size < len(data) else None
+        return out
+
+    def write(self, data: bytes):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._records = iter(())
+        self._chunk = None
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+
+def info(path):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        view = memoryview(m)
+        flags, wall_start = read_header(view)
+        records = size = 0
+        last = 0.0
+        for t, data in iter_records(view):
+            records += 1
+            size += len(data)
+            last = t
+            del data
+        del view
+    start = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(wall_start))
+    print(f"{path}: started {start}, {last:.1f} s, {records} reads, {size} bytes"
+          f" ({size / last if last else 0:.0f} B/s), {'binary' if flags & FLAG_BINARY else 'csv'} at start")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Session recordings of SerialManager")
+    parser.add_argument("files", nargs="+", help="Recordings to summarize")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    for path in parse_args().files:
+        info(path)
@@ -0,0 +1,256 @@
+import os
+import sys
+import random
+import struct
+import argparse
+from collections import deque
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication.tx_scheduler import TxQueue
+
+
+# Reliable delivery of text messages on one channel (binary wire format)
+#
+#   FRAME_REL_DATA payload = session (u8) | seq (u16) | utf-8 text
+#   FRAME_REL_ACK  payload = session (u8) | ack (u16): every seq before 'ack' arrived
+#
+# Sliding window: up to 'window' messages are in flight without waiting for
+# their ack, so commands keep flowing at line rate instead of one round trip
+# per message. The receiver buffers out-of-order messages and acks
+# cumulatively; the sender retransmits the oldest unacked message when the
+# retransmission timer expires (timeout from the measured round trip time,
+# doubled on every retry until an ack makes progress), after DUP_ACKS
+# duplicate acks (the receiver is waiting for it), and right after an ack
+# that only covers part of what was outstanding during a recovery. The
+# session byte is picked at random on start, so a restarted sender (seq
+# back to 0) is not mistaken for old duplicates. A restarted receiver takes
+# over the sender's session at seq 0, so it acks a seq the sender has
+# already seen acked: the sender then moves to a new session and sends
+# what was not acked again, renumbered from 0.
+#
+# Both classes are plain state machines, SerialManager does the I/O.
+
+_HEADER = struct.Struct("<BH")
+SEQ_MOD = 1 << 16
+
+
+# a - b for sequence numbers, in -32768..32767
+def seq_diff(a, b):
+    return (a - b + SEQ_MOD // 2) % SEQ_MOD - SEQ_MOD // 2
+
+
+def _header(payload):
+    if len(payload) < _HEADER.size:
+        raise ValueError("Reliable frame too short")
+    return _HEADER.unpack_from(payload)
+
+
+class ReliableSender:
+
+    RTO_INIT = 0.25  # [s]
+    RTO_MIN = 0.05   # [s]
+    RTO_MAX = 2.0    # [s]
+    DUP_ACKS = 3
+
+    def __init__(self, window=32):
+        self.window = window
+        self.session = random.randrange(256)
+        self.backlog = TxQueue(1)  # messages waiting for room in the window
+        self.next_seq = 0
+        self.unacked = {}          # seq -> [payload, send time, retransmitted?]
+        self.retransmits = 0
+        self.rto = self.RTO_INIT   # from the RTT estimate
+        self._backoff = 1          # doubled on every timeout, reset by progress
+        self._srtt = None
+        self._rttvar = 0.0
+        self._timer = None         # [monotonic s] when the oldest unacked message times out
+        self._last_ack = None
+        self._dups = 0
+        self._recover = None       # next_seq when the last retransmission happened
+
+    def __len__(self):
+        return len(self.backlog) + len(self.unacked)
+
+    # Queue a message; a queued (not yet sent) one with the same key is replaced
+    def push(self, text, key=None):
+        if key is not None and key in self.backlog.slots:
+            self.backlog.slots[key].data = text
+        else:
+            self.backlog.push(text, key)
+
+    # FRAME_REL_DATA payloads that fit in the window now
+    def fill(self, now):
+        payloads = []
+        while self.backlog.queue and len(self.unacked) < self.window:
+            seq = self.next_seq
+            self.next_seq = (seq + 1) % SEQ_MOD
+            payload = _HEADER.pack(self.session, seq) + self.backlog.popleft().encode("utf-8")
+            self.unacked[seq] = [payload, now, False]
+            payloads.append(payload)
+        if payloads and self._timer is None:
+            self._timer = now + self.rto * self._backoff
+        return payloads
+
+    # Process a FRAME_REL_ACK payload, returns the number of messages acked
+    def on_ack(self, payload, now):
+        session, ack = _header(payload)
+        if session != self.session:
+            return 0
+        if seq_diff(ack, self._oldest() if self.unacked else self.next_seq) < 0:
+            self._restart()
+            return 0
+        acked = [seq for seq in self.unacked if seq_diff(ack, seq) > 0]
+        for seq in acked:
+            _, sent, retransmitted = self.unacked.pop(seq)
+            # Karn: no RTT sample from retransmissions, nor from messages
+            # that waited at the receiver for a retransmitted one
+            if not retransmitted and self._recover is None:
+                self._rtt_sample(now - sent)
+        if acked:
+            self._backoff = 1
+            self._dups = 0
+            self._timer = now + self.rto if self.unacked else None
+            if self._recover is not None:
+                if self.unacked and seq_diff(self._recover, ack) > 0:
+                    self._timer = now  # partial ack: the next hole is due too
+                else:
+                    self._recover = None
+        elif ack == self._last_ack and self.unacked:
+            self._dups += 1
+            if self._dups == self.DUP_ACKS:
+                self._timer = now  # fast retransmit
+        self._last_ack = ack
+        return len(acked)
+
+    def _rtt_sample(self, rtt):
+        if self._srtt is None:
+            self._srtt, self._rttvar = rtt, rtt / 2
+        else:
+            self._rttvar = 0.75 * self._rttvar + 0.25 * abs(self._srtt - rtt)
+            self._srtt = 0.875 * self._srtt + 0.125 * rtt
+        self.rto = min(self.RTO_MAX, max(self.RTO_MIN, self._srtt + 4 * self._rttvar))
+
+    # Payloads to retransmit now (the oldest unacked one, if its timer expired)
+    def due(self, now):
+        if self._timer is None or now < self._timer:
+            return []
+        if not self.unacked:
+            self._timer = None
+            return []
+        if now - self.unacked[self._oldest()][1] >= self.rto * self._backoff:
+            self._backoff = min(self._backoff * 2, 64)  # a real timeout, not a fast retransmit
+        oldest = self._oldest()
+        entry = self.unacked[oldest]
+        entry[1], entry[2] = now, True
+        self.retransmits += 1
+        self._recover = self.next_seq
+        self._timer = now + min(self.RTO_MAX, self.rto * self._backoff)
+        return [entry[0]]
+
+    # The receiver lost its state: new session, and the unacked messages go
+    # back to the front of the backlog (fill() sends them again)
+    def _restart(self):
+        oldest_first = sorted(self.unacked, key=lambda seq: seq_diff(seq, self.next_seq))
+        texts = [bytes(self.unacked[seq][0][_HEADER.size:]).decode("utf-8") for seq in oldest_first]
+        self.backlog.queue.extendleft(reversed(texts))
+        self.unacked.clear()
+        self.session = (self.session + random.randrange(1, 256)) % 256
+        self.next_seq = 0
+        self._backoff = 1
+        self._timer = None
+        self._last_ack = None
+        self._dups = 0
+        self._recover = None
+
+    def _oldest(self):
+        return min(self.unacked, key=lambda seq: seq_diff(seq, self.next_seq))
+
+    # [monotonic s] of the next retransmission check, None if nothing is in flight
+    def deadline(self):
+        return self._timer
+
+
+class ReliableReceiver:
+
+    def __init__(self, window=64):
+        self.window = window
+        self.session = None
+        self.expected = 0
+        self.buffer = {}  # seq -> text, received ahead of 'expected'
+        self.duplicates = 0
+
+    # Process a FRAME_REL_DATA payload, returns (FRAME_REL_ACK payload,
+    # texts now deliverable in order)
+    def on_data(self, payload):
+        session, seq = _header(payload)
+        if session != self.session:  # peer (re)started
+            self.session, self.expected = session, 0
+            self.buffer.clear()
+        ahead = seq_diff(seq, self.expected)
+        if ahead < 0 or seq in self.buffer:
+            self.duplicates += 1
+        elif ahead < self.window:
+            self.buffer[seq] = bytes(payload[_HEADER.size:]).decode("utf-8", errors="replace")
+        texts = []
+        while self.expected in self.buffer:
+            texts.append(self.buffer.pop(self.expected))
+            self.expected = (self.expected + 1) % SEQ_MOD
+        return _HEADER.pack(self.session, self.expected), texts
+
+
+# ---------------------------------------------------------------------------
+# Command line: both state machines over a simulated lossy link, with the
+# receiver restarted now and then; exits with 1 unless every message got
+# through in order
+# ---------------------------------------------------------------------------
+
+SIM_STEP = 0.001   # [s]
+SIM_DELAY = 0.005  # [s] one way
+SIM_LIMIT = 600.0  # [s] of simulated time before giving up
+
+
+def simulate(args):
+    rng = random.Random(args.seed)
+    sender, receiver = ReliableSender(), ReliableReceiver()
+    to_rx, to_tx = deque(), deque()  # (arrival, payload)
+    delivered = []
+    now, sent, restarts = 0.0, 0, 0
+    while len(set(delivered)) < args.messages and now < SIM_LIMIT:
+        if sent < args.messages and len(sender) < 2 * sender.window:
+            sender.push(str(sent))
+            sent += 1
+        for payload in sender.fill(now) + sender.due(now):
+            if rng.random() >= args.loss:
+                to_rx.append((now + SIM_DELAY, payload))
+        while to_rx and to_rx[0][0] <= now:
+            ack, texts = receiver.on_data(to_rx.popleft()[1])
+            delivered += [int(t) for t in texts]
+            if rng.random() >= args.loss:
+                to_tx.append((now + SIM_DELAY, ack))
+        while to_tx and to_tx[0][0] <= now:
+            sender.on_ack(to_tx.popleft()[1], now)
+        if rng.random() < args.restarts * SIM_STEP:
+            receiver = ReliableReceiver()
+            restarts += 1
+        now += SIM_STEP
+    # a restarted receiver may deliver again what its predecessor did not ack
+    first = list(dict.fromkeys(delivered))
+    ok = first == list(range(args.messages))
+    print(f"{len(first)}/{args.messages} messages in {now:.1f} s (loss {args.loss:.0%}, "
+          f"{restarts} receiver restarts, {sender.retransmits} retransmits, "
+          f"{len(delivered) - len(first)} delivered twice): {'OK' if ok else 'FAILED'}")
+    if not ok:
+        sys.exit(1)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Reliable channel simulation")
+    parser.add_argument("--messages", "-n", type=int, default=5000, help="Messages to send")
+    parser.add_argument("--loss", type=float, default=0.1, help="Share of frames lost each way")
+    parser.add_argument("--restarts", type=float, default=0.5, help="Receiver restarts per second")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    simulate(parse_args())
@@ -0,0 +1,153 @@
+import os
+import json
+import struct
+import dataclasses
+from ctypes import c_uint16, c_bool, c_float
+
+
+# Single source of truth for the SensorData layout (sensor_data.json).
+# Everything that depends on the field list is derived from it here: the
+# ctypes fields, the NumPy dtype, the CSV/binary codecs in protocol.py, the
+# pyqtgraph dataclass and, through gen_protocol.py, the Arduino C header.
+SCHEMA_FILE = os.path.join(os.path.dirname(__file__), 'sensor_data.json')
+
+# type name -> (ctypes, struct code, NumPy type, C type, CSV parser)
+TYPES = {
+    "uint16":  (c_uint16, "H", "<u2", "uint16_t", int),
+    "bool":    (c_bool,   "?", "?",   "bool",     int),
+    "float32": (c_float,  "f", "<f4", "float",    float),
+}
+
+
+def load_schema(path=SCHEMA_FILE) -> dict:
+    with open(path, encoding='utf-8') as f:
+        schema = json.load(f)
+    for field in schema["fields"]:
+        if field["type"] not in TYPES:
+            raise ValueError(f"Unknown type {field['type']!r} for field {field['name']!r}")
+        field.setdefault("count", 1)
+    return schema
+
+
+def ctypes_fields(schema):
+    fields = []
+    for f in schema["fields"]:
+        ctype = TYPES[f["type"]][0]
+        fields.append((f["name"], ctype * f["count"] if f["count"] > 1 else ctype))
+    return fields
+
+
+def numpy_dtype(schema):
+    import numpy as np
+    fields = []
+    for f in schema["fields"]:
+        np_type = TYPES[f["type"]][2]
+        fields.append((f["name"], np_type, (f["count"],)) if f["count"] > 1 else (f["name"], np_type))
+    return np.dtype(fields)
+
+
+# Packed little endian struct matching the ctypes/C layout
+def struct_format(schema) -> struct.Struct:
+    return struct.Struct("<" + "".join(f"{f['count']}{TYPES[f['type']][1]}" for f in schema["fields"]))
+
+
+# struct code of every scalar (array elements expanded), in wire order
+def scalar_codes(schema):
+    codes = []
+    for f in schema["fields"]:
+        codes.extend([TYPES[f["type"]][1]] * f["count"])
+    return codes
+
+
+# (name, count) per field, in wire order
+def csv_columns(schema):
+    return [(f["name"], f["count"]) for f in schema["fields"]]
+
+
+# str.format() template for one CSV line (all numeric columns, then the log)
+def csv_template(schema) -> str:
+    parts = []
+    for f in schema["fields"]:
+        if f["type"] == "float32":
+            spec = f"{{:.{f.get('decimals', 3)}f}}"
+        elif f["type"] == "bool":
+            spec = "{:d}"
+        else:
+            spec = "{}"
+        parts.extend([spec] * f["count"])
+    return ",".join(parts) + ',"{}"'
+
+
+# Parser (int/float) for each CSV column
+def csv_parsers(schema):
+    parsers = []
+    for f in schema["fields"]:
+        parsers.extend([TYPES[f["type"]][4]] * f["count"])
+    return parsers
+
+
+# Plain Python dataclass with list fields (used by the pyqtgraph dashboard)
+def make_dataclass(schema, cls_name, doc=None):
+    fields = []
+    for f in schema["fields"]:
+        zero = False if f["type"] == "bool" else (0.0 if f["type"] == "float32" else 0)
+        if f["count"] > 1:
+            fields.append((f["name"], list, dataclasses.field(default_factory=lambda z=zero, n=f["count"]: [z] * n)))
+        else:
+            fields.append((f["name"], type(zero), dataclasses.field(default=zero)))
+    cls = dataclasses.make_dataclass(cls_name, fields)
+    cls.__doc__ = doc
+    return cls
+
+
+def c_header(schema) -> str:
+    name = schema["name"]
+    guard = "SENSOR_DATA_H"
+    macro = "SENSOR_DATA"
+    lines = [
+        "// Generated by coding/raspberry/communication/gen_protocol.py",
+        "// from sensor_data.json -- do not edit by hand.",
+        f"#ifndef {guard}",
+        f"#define {guard}",
+        "",
+        "#include <stdint.h>",
+        "#include <stdbool.h>",
+        "",
+        f"#define {macro}_VERSION {schema['version']}",
+        f"#define {macro}_SIZE {struct_format(schema).size}",
+        "",
+        "typedef struct __attribute__((packed)) {",
+    ]
+    for f in schema["fields"]:
+        c_type = TYPES[f["type"]][3]
+        suffix = f"[{f['count']}]" if f["count"] > 1 else ""
+        lines.append(f"  {c_type} {f['name']}{suffix};")
+    lines += [
+        f"}} {name};",
+        "",
+        "#ifdef __cplusplus",
+        f"static_assert(sizeof({name}) == {macro}_SIZE, \"{name} layout mismatch\");",
+        "",
+        "// One CSV line in the format protocol.string_to_sensor_data() expects",
+        f"template <typename Out> void {macro.lower()}_print_csv(const volatile {name} &sd, Out &out) {{",
+    ]
+    first = True
+    for f in schema["fields"]:
+        for i in range(f["count"]):
+            ref = f"sd.{f['name']}" + (f"[{i}]" if f["count"] > 1 else "")
+            if not first:
+                lines.append("  out.print(',');")
+            first = False
+            if f["type"] == "float32":
+                lines.append(f"  out.print({ref}, {f.get('decimals', 3)});")
+            else:
+                lines.append(f"  out.print((unsigned int){ref});")
+    lines += [
+        "  out.println();",
+        "}",
+        "#endif",
+        "",
+        f"#endif  // {guard}",
+        "",
+    ]
+    return "\n".join(lines)
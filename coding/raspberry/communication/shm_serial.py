@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+import select
+import struct
+import tempfile
+from multiprocessing import shared_memory, resource_tracker
+
+
+# Single-producer/single-consumer byte ring in a shared memory segment
+#
+#   [0:8]    write position (only ever written by the producer)
+#   [8:16]   start of the producer's session (see start_session())
+#   [16:24]  session number, bumped by the producer after 'start'
+#   [24:32]  random ID of the segment, set by whoever created it
+#   [64:72]  read position  (only ever written by the consumer)
+#   [72:80]  1 while the consumer sleeps in wait()
+#   [128:]   data, 'capacity' bytes (a power of two)
+#
+# Positions only grow, so 'write - read' is the number of pending bytes and
+# 'pos & (capacity - 1)' the index into the data area. No lock is needed:
+# each position has a single writer, and the producer copies the data before
+# publishing the new write position.
+#
+# A consumer with nothing to read can sleep in wait(): it sets its flag and
+# blocks on a FIFO next to the segment, which put() writes a byte to when it
+# sees the flag, so a sleeping consumer wakes up within microseconds instead
+# of a poll period. A wake-up lost in the race between the flag and the
+# positions only costs WAKE_CHECK.
+WAKE_CHECK = 0.01  # [s] longest sleep in wait() without looking at the ring
+POLL_PERIOD = 0.0005  # [s] wait() without FIFOs (Windows)
+
+
+class ShmRing:
+
+    HEADER = 128
+    _POS = struct.Struct("Q")
+    _WPOS, _START, _EPOCH, _ID = 0, 8, 16, 24
+    _RPOS, _WAITING = 64, 72
+
+    def __init__(self, name, capacity=1 << 20):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.name = name
+        try:
+            self.shm = _open_shm(name, create=True, size=self.HEADER + capacity)
+            self._POS.pack_into(self.shm.buf, self._ID, int.from_bytes(os.urandom(8), 'little'))
+        except FileExistsError:
+            # attach to the ring the peer created, whatever its size
+            self.shm = _open_shm(name, create=False)
+            capacity = 1 << ((self.shm.size - self.HEADER).bit_length() - 1)
+        self.capacity = capacity
+        self.mask = self.capacity - 1
+        self.buf = self.shm.buf
+        self.data = self.buf[self.HEADER:self.HEADER + self.capacity]
+        self.id = self._get(self._ID)
+        self._epoch = self._get(self._EPOCH)
+        self._wake_path = os.path.join(tempfile.gettempdir(), name + ".wake")
+        self._wake_r = None  # consumer end of the FIFO
+        self._wake_w = None  # producer end
+
+    def _get(self, offset):
+        return self._POS.unpack_from(self.buf, offset)[0]
+
+    def _set(self, offset, value):
+        self._POS.pack_into(self.buf, offset, value)
+
+    def pending(self) -> int:
+        return self._get(self._WPOS) - self._get(self._RPOS)
+
+    # Producer, when it opens the ring: whatever an earlier producer left
+    # (e.g. half a frame of a killed process) is skipped by the consumer
+    def start_session(self):
+        self._set(self._START, self._get(self._WPOS))
+        self._set(self._EPOCH, self._get(self._EPOCH) + 1)
+
+    # Consumer, when it opens the ring: drop what was written before
+    def skip_pending(self):
+        self._epoch = self._get(self._EPOCH)
+        self._set(self._RPOS, self._get(self._WPOS))
+
+    # Producer: copy as much of 'data' as fits, return the number of bytes written
+    def put(self, data) -> int:
+        wpos = self._get(self._WPOS)
+        n = min(len(data), self.capacity - (wpos - self._get(self._RPOS)))
+        if n <= 0:
+            return 0
+        start = wpos & self.mask
+        first = min(n, self.capacity - start)
+        self.data[start:start + first] = data[:first]
+        if n > first:
+            self.data[:n - first] = data[first:n]
+        self._set(self._WPOS, wpos + n)
+        if self._get(self._WAITING):
+            self._wake()
+        return n
+
+    # Consumer: take up to 'size' pending bytes
+    def get(self, size) -> bytes:
+        rpos = self._get(self._RPOS)
+        epoch = self._get(self._EPOCH)
+        if epoch != self._epoch:  # a new producer: skip what its predecessor left
+            self._epoch = epoch
+            rpos = max(rpos, self._get(self._START))
+            self._set(self._RPOS, rpos)
+        n = min(size, self._get(self._WPOS) - rpos)
+        if n <= 0:
+            return b''
+        start = rpos & self.mask
+        first = min(n, self.capacity - start)
+        out = bytes(self.data[start:start + first])
+        if n > first:
+            out += bytes(self.data[:n - first])
+        self._set(self._RPOS, rpos + n)
+        return out
+
+    # Consumer: sleep until something is pending, False after 'timeout' seconds
+    def wait(self, timeout) -> bool:
+        deadline = time.monotonic() + timeout
+        while not self.pending():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False
+            if self._wake_r is None and hasattr(os, 'mkfifo'):
+                try:
+                    os.mkfifo(self._wake_path)
+                except FileExistsError:
+                    pass
+                # read-write: the FIFO always has a writer, so it never reads as closed
+                self._wake_r = os.open(self._wake_path, os.O_RDWR | os.O_NONBLOCK)
+            if self._wake_r is None:
+                time.sleep(min(left, POLL_PERIOD))
+                continue
+            self._set(self._WAITING, 1)
+            if not self.pending():
+                select.select([self._wake_r], [], [], min(left, WAKE_CHECK))
+                try:
+                    os.read(self._wake_r, 4096)
+                except BlockingIOError:
+                    pass
+            self._set(self._WAITING, 0)
+        return True
+
+    def _wake(self):
+        if self._wake_w is None:
+            try:
+                self._wake_w = os.open(self._wake_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                return  # consumer not waiting on a FIFO (yet)
+        try:
+            os.write(self._wake_w, b'\0')
+        except OSError:
+            pass  # full: a wake-up is pending already
+
+    # True once 'name' is another segment than ours (the peer unlinked the
+    # ring and created a new one)
+    def replaced(self) -> bool:
+        try:
+            shm = _open_shm(self.name, create=False)
+        except FileNotFoundError:
+            return False
+        try:
+            return self._POS.unpack_from(shm.buf, self._ID)[0] != self.id
+        finally:
+            shm.close()
+
+    def close(self):
+        for fd in (self._wake_r, self._wake_w):
+            if fd is not None:
+                os.close(fd)
+        self._wake_r = self._wake_w = None
+        if self.buf is None:
+            return
+        self.data.release()
+        self.buf = None
+        self.shm.close()
+
+    def unlink(self):
+        if _LEGACY_TRACKER:
+            # SharedMemory.unlink() unregisters the segment, which its creator
+            # did already (see _open_shm())
+            resource_tracker.register(self.shm._name, "shared_memory")
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            if _LEGACY_TRACKER:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        try:
+            os.unlink(self._wake_path)
+        except FileNotFoundError:
+            pass
+
+
+# Before Python 3.13 SharedMemory() registers every segment it opens with the
+# resource tracker (and unlink() unregisters it), with no way to opt out
+_LEGACY_TRACKER = os.name == 'posix' and sys.version_info < (3, 13)
+
+
+# Open the segment without letting the resource tracker unlink it when the
+# process that created it exits: the ring outlives either side until
+# close()/unlink(). Before Python 3.13 the creator unregisters it again.
+def _open_shm(name, create, size=0):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    if create and _LEGACY_TRACKER:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+# Simulated serial port using one shared memory ring per direction
+# (same-host only, no syscalls per message while data is flowing)
+#
+# Behaves like a UART: a write that does not fit in the ring (nobody
+# reading) is dropped whole, and what was sent before the port was opened
+# is not received. close() removes both rings; a peer still running moves
+# to the new ones once this side opens them again.
+class SharedMemorySerial:
+
+    def __init__(self, name, capacity=1 << 20):
+        self.name = name.upper()
+        if self.name == 'A':
+            self._names = ('osmd_a_to_b', 'osmd_b_to_a')
+        elif self.name == 'B':
+            self._names = ('osmd_b_to_a', 'osmd_a_to_b')
+        else:
+            raise ValueError("Name must be 'A' or 'B'")
+        self.capacity = capacity
+        self.timeout = 1.0  # [s] like serial.Serial(timeout=...)
+        self.dropped = 0    # [bytes] written while the ring was full
+        self._old = []      # rings replaced by the peer, closed in close()
+        self._open()
+        self.tx.start_session()
+        self.rx.skip_pending()
+
+    def _open(self):
+        self.tx = ShmRing(self._names[0], self.capacity)
+        self.rx = ShmRing(self._names[1], self.capacity)
+
+    def write(self, data: bytes):
+        if self.tx.capacity - self.tx.pending() < len(data):
+            self.dropped += len(data)
+        else:
+            self.tx.put(data)
+        return len(data)
+
+    @property
+    def in_waiting(self) -> int:
+        return self.rx.pending()
+
+    # Read up to 'size' bytes, waiting up to 'timeout' for the first one
+    def read(self, size=1) -> bytes:
+        data = self.rx.get(size)
+        if not data and self.rx.wait(self.timeout):
+            data = self.rx.get(size)
+        if not data and (self.rx.replaced() or self.tx.replaced()):
+            self._old += [self.tx, self.rx]  # the TX thread may still be writing to the old one
+            self._open()
+            self.tx.start_session()
+        return data
+
+    def flush(self):
+        pass
+
+    def close(self):
+        for ring in [self.tx, self.rx] + self._old:
+            ring.close()
+        self.unlink()
+
+    # Remove both rings from /dev/shm (unless the peer already made new ones)
+    def unlink(self):
+        for ring in (self.tx, self.rx):
+            if not ring.replaced():
+                ring.unlink()
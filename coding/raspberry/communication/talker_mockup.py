@@ -3,14 +3,16 @@ import os
 import time
 import argparse
 
-from mux_tx_rx import SerialManager
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication.mux_tx_rx import SerialManager, link_bauds
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Motor Mockup (B) Serial Script")
     parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
     parser.add_argument("--port", "-p",default="/dev/ttyACM0", help="Serial port to use when not simulating (e.g. /dev/ttyACM0)")
-    parser.add_argument("--baud", "-b",type=int, default=38400, help="Baud rate for the serial connection")
+    parser.add_argument("--baud", "-b",type=int, default=38400, help="Opening baud rate (the startup handshake may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate the startup handshake may switch to (default: any the device offers)")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
     parser.add_argument("--name", "-n", choices=['A', 'B'], required=True, help="Name of this node (A or B) for simulation mode")
     return parser.parse_args()
@@ -18,7 +20,8 @@ def parse_args():
 def main():
     args = parse_args()
 
-    sm = SerialManager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name)
+    sm = SerialManager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name,
+                       bauds=link_bauds(args.max_baud))
 
     def on_receive(msg):
         print(f"[{args.name} RECEIVED] {msg}")
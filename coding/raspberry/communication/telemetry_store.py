@@ -0,0 +1,299 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from communication import protocol
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Columnar store for long SensorData recordings (soak tests)
+#
+#   <dir>/meta.json       columns (dtype and shape), chunk size, schema version
+#   <dir>/time.col        f64 wall clock time of each row
+#   <dir>/<field>.col     one raw little endian column per SensorData field
+#   <dir>/index.bin       one INDEX_DTYPE entry per chunk: first/last time,
+#                         first row, number of rows
+#   <dir>/logs.txt        "<time>\t<text>" every time system_log changed
+#
+# Rows are collected in memory and written CHUNK_ROWS at a time, one append
+# per column, so the SD card sees few large sequential writes. Reading maps
+# the column files with np.memmap: a time range query looks up the chunks
+# in the (small) sparse index, then binary searches the time column inside
+# them, and only the pages of the requested rows and fields are read.
+# Times are kept nondecreasing, so the index stays sorted.
+
+CHUNK_ROWS = 4096
+STORE_VERSION = 1
+INDEX_DTYPE = [('t_first', '<f8'), ('t_last', '<f8'), ('row', '<i8'), ('rows', '<i8')]
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for the telemetry store")
+
+
+def _column_dtypes():
+    _require_numpy()
+    columns = {"time": (np.dtype('<f8'), ())}
+    for name in protocol.SENSOR_DTYPE.names:
+        dt, _ = protocol.SENSOR_DTYPE.fields[name]
+        columns[name] = (dt.base, dt.shape)
+    return columns
+
+
+# Writer: create or append to the store in 'path'
+class TelemetryStore:
+
+    def __init__(self, path, chunk_rows=CHUNK_ROWS):
+        self.columns = _column_dtypes()
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            meta = _load_meta(path)
+            if meta["columns"] != _meta_columns(self.columns):
+                raise ValueError(f"{path} was written with other SensorData fields")
+            self.chunk_rows = meta["chunk_rows"]
+        else:
+            self.chunk_rows = chunk_rows
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": STORE_VERSION, "schema_version": protocol.SCHEMA_VERSION,
+                           "chunk_rows": chunk_rows, "columns": _meta_columns(self.columns)}, f, indent=2)
+        index = _load_index(path)
+        self.rows = int(index['row'][-1] + index['rows'][-1]) if len(index) else 0
+        self._last_t = float(index['t_last'][-1]) if len(index) else -np.inf
+        self._truncate(len(index))
+        # monotonic -> wall clock, for the times SerialManager gives
+        self.wall_offset = time.time() - time.monotonic()
+        self._chunk = np.zeros(self.chunk_rows, protocol.SENSOR_DTYPE)
+        self._times = np.zeros(self.chunk_rows)
+        self._fill = 0
+        self.dropped = 0  # messages that were not valid SensorData
+
+    # Drop whatever a crash left past the last indexed chunk
+    def _truncate(self, chunks):
+        sizes = {"index.bin": chunks * np.dtype(INDEX_DTYPE).itemsize}
+        for name, (dt, shape) in self.columns.items():
+            sizes[name + ".col"] = self.rows * dt.itemsize * int(np.prod(shape, dtype=int))
+        for name, size in sizes.items():
+            with open(os.path.join(self.path, name), 'ab') as f:
+                if f.tell() != size:
+                    f.truncate(size)
+
+    # Add rows of SENSOR_DTYPE with their time.monotonic() timestamps
+    def append(self, rows, times):
+        times = np.asarray(times, dtype=np.float64) + self.wall_offset
+        start = 0
+        while start < len(rows):
+            n = min(len(rows) - start, self.chunk_rows - self._fill)
+            self._chunk[self._fill:self._fill + n] = rows[start:start + n]
+            self._times[self._fill:self._fill + n] = times[start:start + n]
+            self._fill += n
+            start += n
+            if self._fill == self.chunk_rows:
+                self.flush()
+
+    # Add received messages (CSV or binary) and their timestamps, e.g. from
+    # on_receive_batch(msgs) with sm.rx_times
+    def append_msgs(self, msgs, times):
+        rows, valid = protocol.decode_sensor_array(msgs)
+        if not valid.all():
+            self.dropped += int((~valid).sum())
+            rows, times = rows[valid], np.asarray(times)[valid]
+        self.append(rows, times)
+
+    def add_log(self, t, text):
+        with open(os.path.join(self.path, "logs.txt"), 'a', encoding='utf-8') as f:
+            f.write(f"{t + self.wall_offset:.6f}\t{text}\n")
+
+    # Write the rows collected so far as a chunk (a short one if not full)
+    def flush(self):
+        n = self._fill
+        if not n:
+            return
+        times = np.maximum.accumulate(np.maximum(self._times[:n], self._last_t))
+        with open(os.path.join(self.path, "time.col"), 'ab') as f:
+            f.write(times.tobytes())
+        for name in protocol.SENSOR_DTYPE.names:
+            with open(os.path.join(self.path, name + ".col"), 'ab') as f:
+                f.write(np.ascontiguousarray(self._chunk[name][:n]).tobytes())
+        entry = np.array([(times[0], times[-1], self.rows, n)], INDEX_DTYPE)
+        with open(os.path.join(self.path, "index.bin"), 'ab') as f:
+            f.write(entry.tobytes())  # last: the chunk only counts once it is complete
+        self.rows += n
+        self._last_t = times[-1]
+        self._fill = 0
+
+    def close(self):
+        self.flush()
+
+    # Store everything 'sm' receives, then pass it on to its current
+    # on_receive_batch() and on_log() (attach after setting those)
+    def attach(self, sm):
+        on_receive_batch, on_log = sm.on_receive_batch, sm.on_log
+
+        def store_batch(msgs):
+            self.append_msgs(msgs, sm.rx_times)
+            on_receive_batch(msgs)
+
+        def store_log(text):
+            self.add_log(time.monotonic(), text)
+            on_log(text)
+
+        sm.on_receive_batch = store_batch
+        sm.on_log = store_log
+
+
+def _meta_columns(columns):
+    return {name: {"dtype": dt.str, "shape": list(shape)} for name, (dt, shape) in columns.items()}
+
+
+def _load_meta(path):
+    with open(os.path.join(path, "meta.json"), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _load_index(path):
+    index = os.path.join(path, "index.bin")
+    if not os.path.exists(index):
+        return np.zeros(0, INDEX_DTYPE)
+    with open(index, 'rb') as f:
+        data = f.read()
+    size = np.dtype(INDEX_DTYPE).itemsize
+    return np.frombuffer(data[:len(data) // size * size], INDEX_DTYPE)  # without a half written entry
+
+
+# Reader: memory-mapped columns of a store (chunks written meanwhile show
+# up after refresh())
+class TelemetryReader:
+
+    def __init__(self, path):
+        _require_numpy()
+        self.path = path
+        meta = _load_meta(path)
+        self.columns = {name: (np.dtype(c["dtype"]), tuple(c["shape"])) for name, c in meta["columns"].items()}
+        self.chunk_rows = meta["chunk_rows"]
+        self.refresh()
+
+    def refresh(self):
+        self.index = _load_index(self.path)
+        self.rows = int(self.index['row'][-1] + self.index['rows'][-1]) if len(self.index) else 0
+        self._maps = {}
+
+    # Whole column as a read-only memmap, shape (rows,) + field shape
+    def column(self, name):
+        if name not in self._maps:
+            dt, shape = self.columns[name]
+            if self.rows == 0:
+                self._maps[name] = np.zeros((0,) + shape, dt)
+            else:
+                self._maps[name] = np.memmap(os.path.join(self.path, name + ".col"), dt, 'r',
+                                             shape=(self.rows,) + shape)
+        return self._maps[name]
+
+    # Rows with t0 <= time < t1 (wall clock seconds), as a slice
+    def time_range(self, t0, t1):
+        # chunks that can hold the range, from the sparse index
+        first = int(np.searchsorted(self.index['t_last'], t0, 'left'))
+        last = int(np.searchsorted(self.index['t_first'], t1, 'left'))
+        if first >= last:
+            return slice(0, 0)
+        lo = int(self.index['row'][first])
+        hi = int(self.index['row'][last - 1] + self.index['rows'][last - 1])
+        times = self.column("time")[lo:hi]
+        return slice(lo + int(np.searchsorted(times, t0, 'left')), lo + int(np.searchsorted(times, t1, 'left')))
+
+    # {field: array} of the rows in [t0, t1), 'fields' None = all (time included)
+    def query(self, t0, t1, fields=None):
+        rows = self.time_range(t0, t1)
+        names = list(self.columns) if fields is None else ["time"] + [f for f in fields if f != "time"]
+        return {name: np.asarray(self.column(name)[rows]) for name in names}
+
+    # [(time, text)] of the system_log changes in [t0, t1)
+    def logs(self, t0=-np.inf, t1=np.inf):
+        path = os.path.join(self.path, "logs.txt")
+        if not os.path.exists(path):
+            return []
+        out = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                t, _, text = line.rstrip("\n").partition("\t")
+                if t0 <= float(t) < t1:
+                    out.append((float(t), text))
+        return out
+
+
+# ---------------------------------------------------------------------------
+# Command line: record from a port, show what a store holds
+# ---------------------------------------------------------------------------
+
+def record(args):
+    from communication.mux_tx_rx import SerialManager
+    from communication.broker import BrokerClient
+    store = TelemetryStore(args.store)
+    if args.broker:
+        sm = BrokerClient(args.broker)
+    else:
+        sm = SerialManager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name,
+                           wire_format=args.wire, transport=args.transport, clock_sync=True)
+    store.attach(sm)
+    sm.start()
+    try:
+        while True:
+            time.sleep(10)
+            st = sm.stats()
+            print(f"{store.rows} rows stored, {st['frames_in']} frames, "
+                  f"{st['parse_errors']} parse errors, {store.dropped} dropped")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sm.stop()
+        store.close()
+
+
+def info(args):
+    reader = TelemetryReader(args.store)
+    if not reader.rows:
+        print(f"{args.store}: empty")
+        return
+    t0, t1 = reader.index['t_first'][0], reader.index['t_last'][-1]
+    start = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t0))
+    print(f"{args.store}: {reader.rows} rows in {len(reader.index)} chunks, from {start}, {t1 - t0:.1f} s")
+    for name in reader.columns:
+        if name == "time":
+            continue
+        col = reader.column(name)
+        print(f"  {name:>16}: min {np.min(col, axis=0)}  max {np.max(col, axis=0)}")
+
+
+def parse_args():
+    from communication.broker import BROKER_PATH
+    parser = argparse.ArgumentParser(description="Columnar SensorData store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Store everything received until Ctrl+C")
+    rec.add_argument("store", help="Store directory (appended to if it exists)")
+    rec.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
+    rec.add_argument("--port", "-p", default="/dev/ttyACM0", help="Serial port to use when not simulating")
+    rec.add_argument("--baud", "-b", type=int, default=19200, help="Opening baud rate")
+    rec.add_argument("--name", "-n", choices=['A', 'B'], default='B', help="Name of this node for simulation mode")
+    rec.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport")
+    rec.add_argument("--wire", "-w", choices=['csv', 'binary', 'auto'], default='binary', help="Wire format")
+    rec.add_argument("--broker", nargs="?", const=BROKER_PATH, default=None, help="Share the link of a running broker (python -m communication.broker) instead of opening the port")
+    inf = sub.add_parser("info", help="Rows, time span and min/max of every field")
+    inf.add_argument("store", help="Store directory")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "record":
+        record(args)
+    else:
+        info(args)
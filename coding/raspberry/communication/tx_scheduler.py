@@ -0,0 +1,112 @@
+from collections import deque
+
+
+# Queued message that a newer one sent with the same key replaces in place
+class _Slot:
+    __slots__ = ('key', 'data')
+
+    def __init__(self, key, data):
+        self.key = key
+        self.data = data
+
+
+# Send queue of one channel
+class TxQueue:
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.queue = deque()  # wire data (bytes, or a _Slot for keyed messages)
+        self.slots = {}       # key -> queued _Slot
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, data, key=None):
+        if key is not None:
+            data = self.slots[key] = _Slot(key, data)
+        self.queue.append(data)
+
+    def popleft(self) -> bytes:
+        m = self.queue.popleft()
+        if m.__class__ is _Slot:
+            del self.slots[m.key]
+            return m.data
+        return m
+
+    # Everything queued, in order
+    def take_all(self) -> bytes:
+        if self.slots:
+            data = b''.join(m if m.__class__ is bytes else m.data for m in self.queue)
+            self.slots.clear()
+        else:
+            data = b''.join(self.queue)
+        self.queue.clear()
+        return data
+
+
+# Per-channel send queues with a weighted round robin scheduler
+#
+# Channels are visited from the highest weight down, and each visit takes
+# up to 'weight' messages, until 'batch_bytes' are collected. Whatever is
+# left waits for the next write: on a slow link a command queued meanwhile
+# overtakes older telemetry instead of waiting behind all of it. With
+# batch_bytes=None every queue is emptied in one go, highest weight first.
+#
+# Not thread safe: SerialManager calls it with its lock held.
+class TxScheduler:
+
+    def __init__(self, weights=None, queue_size=None, batch_bytes=None):
+        self.weights = dict(weights or {})
+        self.queue_size = queue_size  # per channel, None = unbounded
+        self.batch_bytes = batch_bytes
+        self.pending = 0  # messages queued over all channels
+        self._queues = {}
+        self._order = []  # TxQueues, highest weight first
+
+    def channel(self, ch) -> TxQueue:
+        q = self._queues.get(ch)
+        if q is None:
+            q = self._queues[ch] = TxQueue(self.weights.get(ch, 1))
+            self._order = [self._queues[c] for c in sorted(self._queues, key=lambda c: (-self._queues[c].weight, c))]
+        return q
+
+    def full(self, ch) -> bool:
+        return self.queue_size is not None and len(self.channel(ch)) >= self.queue_size
+
+    def queued(self, ch, key) -> bool:
+        return key is not None and key in self.channel(ch).slots
+
+    def push(self, ch, data, key=None):
+        self.channel(ch).push(data, key)
+        self.pending += 1
+
+    # Replace the data of the queued message with this key
+    def replace(self, ch, key, data):
+        self.channel(ch).slots[key].data = data
+
+    def drop_oldest(self, ch):
+        self.channel(ch).popleft()
+        self.pending -= 1
+
+    # Next chunk to write: (number of messages, bytes)
+    def pop_batch(self):
+        if not self.pending:
+            return 0, b''
+        if self.batch_bytes is None:
+            n, self.pending = self.pending, 0
+            return n, b''.join(q.take_all() for q in self._order if q.queue)
+
+        parts = []
+        size = 0
+        while self.pending and size < self.batch_bytes:
+            for q in self._order:
+                for _ in range(min(q.weight, len(q))):
+                    data = q.popleft()
+                    parts.append(data)
+                    size += len(data)
+                    self.pending -= 1
+                    if size >= self.batch_bytes:
+                        break
+                if size >= self.batch_bytes:
+                    break
+        return len(parts), b''.join(parts)
@@ -14,7 +14,7 @@ from camera.fake_camera import Picamera2
 
 
 class Panel:
-    def __init__(self, auto=False):
+    def __init__(self, auto=False, history=False):
         # Initialize Pygame
         pygame.init()
         self.screen = pygame.display.set_mode((1500, 750))
@@ -49,12 +49,12 @@ class Panel:
 
         #Plotters
         self.plotters = [
-        plotter.Plotter(50, 400, 200, 100, 1, -1, (255,0,0), self.font, auto=self.auto),
-        plotter.Plotter(50, 500, 200, 100, 1, -1, (0,255,0), self.font, auto=self.auto),
-        plotter.Plotter(50, 600, 200, 100, 1, -1, (0,0,255), self.font, auto=self.auto),
-        plotter.Plotter(300, 400, 200, 100, 1, -1, (255,255,0), self.font, auto=self.auto),
-        plotter.Plotter(300, 500, 200, 100, 1, -1, (0,255,255), self.font, auto=self.auto),
-        plotter.Plotter(300, 600, 200, 100, 1, -1, (255,0,255), self.font, auto=self.auto),
+        plotter.Plotter(50, 400, 200, 100, 1, -1, (255,0,0), self.font, auto=self.auto, history=history),
+        plotter.Plotter(50, 500, 200, 100, 1, -1, (0,255,0), self.font, auto=self.auto, history=history),
+        plotter.Plotter(50, 600, 200, 100, 1, -1, (0,0,255), self.font, auto=self.auto, history=history),
+        plotter.Plotter(300, 400, 200, 100, 1, -1, (255,255,0), self.font, auto=self.auto, history=history),
+        plotter.Plotter(300, 500, 200, 100, 1, -1, (0,255,255), self.font, auto=self.auto, history=history),
+        plotter.Plotter(300, 600, 200, 100, 1, -1, (255,0,255), self.font, auto=self.auto, history=history),
         ]
 
         #Bars
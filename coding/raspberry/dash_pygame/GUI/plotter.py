@@ -5,11 +5,15 @@ import random
 import threading
 from collections import deque
 from dash_pygame.GUI import widget
+from communication.decimate import MinMaxPyramid
 
 
 # Plotter Class
+# history=True: plot every value since the start, squeezed into the width
+# (min/max per pixel column, see communication/decimate.py), instead of the
+# last 'width' values
 class Plotter(widget.Widget):
-    def __init__(self, x, y, width, height, min_val, max_val, color, font, auto=False):
+    def __init__(self, x, y, width, height, min_val, max_val, color, font, auto=False, history=False):
         super().__init__(x, y, width, height, min_val, max_val)
         self.color = color
         self.font = font
@@ -17,6 +21,8 @@ class Plotter(widget.Widget):
         self.bg = widget.color_background
         self.data_buffer = deque(maxlen=width)
         self.auto = auto
+        self.history = MinMaxPyramid() if history else None
+        self._pending = []  # values not yet in 'history', added when drawing
         self.lock = threading.Lock()
         if self.auto:
             threading.Thread(target=self._generate_data, daemon=True).start()
@@ -24,12 +30,18 @@ class Plotter(widget.Widget):
     def update_cur_val(self, val):
         self.cur_val = val
         self.data_buffer.append(self.cur_val)
+        if self.history is not None:
+            with self.lock:
+                self._pending.append(val)
 
     def draw(self, surface):
         if not self.visible:
             return
         #Draw background 
         pygame.draw.rect(surface, self.bg, (self.x, self.y, self.width, self.height))
+        if self.history is not None:
+            self._draw_history(surface)
+            return
         with self.lock:#Get a copy of data buffer
             ydata = list(self.data_buffer)
         if len(ydata) > 1: #Draw data lines if data exists
@@ -42,6 +54,20 @@ class Plotter(widget.Widget):
                 pygame.draw.line(surface, self.color, (prev_x, prev_y), (x, y))
                 prev_x, prev_y = x, y
 
+    def _draw_history(self, surface):
+        with self.lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self.history.append(pending)
+        n = len(self.history)
+        if n < 2:
+            return
+        idx, ydata = self.history.view(max_points=2 * self.width)
+        scale_y = self.height // 2 - 10
+        xs = self.x + idx[:, 0] * (self.width - 1) // (n - 1)
+        ys = self.y + self.height // 2 - (ydata[:, 0] * scale_y).astype(int)
+        pygame.draw.lines(surface, self.color, False, list(zip(xs.tolist(), ys.tolist())))
+
     def _generate_data(self):
         t = 0
         phase = random.uniform(0, math.pi)
@@ -52,6 +78,8 @@ class Plotter(widget.Widget):
             with self.lock:
                 self.cur_val = self.max_val*amp*math.sin(freq*t+phase) + self.max_val*noise
                 self.data_buffer.append(self.cur_val)
+                if self.history is not None:
+                    self._pending.append(self.cur_val)
             t += 0.05
             time.sleep(0.01)
 
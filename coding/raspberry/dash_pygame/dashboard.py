@@ -2,28 +2,47 @@ import argparse
 
 
 from dash_pygame.GUI.panel import Panel
-from communication.mux_tx_rx import SerialManager
-from communication.protocol import string_to_sensor_data
+from communication.mux_tx_rx import SerialManager, link_bauds
+from communication.broker import BrokerClient, BROKER_PATH
+from communication.process_link import ProcessSerialManager
+from communication.protocol import decode_sensor_data
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Dashboard")
     parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
     parser.add_argument("--port", "-p", default="/dev/ttyACM0", help="Serial port to use when not simulating")
-    parser.add_argument("--baud", "-b", type=int, default=19200, help="Baud rate for the serial connection")
+    parser.add_argument("--baud", "-b", type=int, default=19200, help="Opening baud rate (the startup handshake may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate the startup handshake may switch to (default: any the device offers)")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
     parser.add_argument("--autodata", "-a", action="store_true", help="Automatic Data Generation?")
+    parser.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport (shm = shared memory, same host only)")
+    parser.add_argument("--wire", "-w", choices=['csv', 'binary', 'auto'], default='binary', help="Wire format (binary falls back to CSV for older firmware)")
+    parser.add_argument("--record", help="Record the session to this file (replay it with --replay)")
+    parser.add_argument("--replay", help="Show a recorded session instead of reading a port")
+    parser.add_argument("--history", action="store_true", help="IMU plots show everything since the start (min/max decimated) instead of the last samples")
+    parser.add_argument("--broker", nargs="?", const=BROKER_PATH, default=None, help="Share the link of a running broker (python -m communication.broker) instead of opening the port")
+    parser.add_argument("--process", action="store_true", help="Run the serial I/O in a child process on its own core, so rendering does not delay it")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed (1 = real time, 0 = as fast as possible)")
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
-    panel = Panel(args.autodata)
+    panel = Panel(args.autodata, history=args.history)
 
-    sm = SerialManager(simulate=args.simulate, name='B', port=args.port,baud=args.baud, debug=args.debug)
+    if args.replay:
+        sm = SerialManager.replay(args.replay, speed=args.speed, debug=args.debug)
+    elif args.broker:
+        sm = BrokerClient(args.broker, debug=args.debug)
+    else:
+        manager = ProcessSerialManager if args.process else SerialManager
+        sm = manager(simulate=args.simulate, name='B', port=args.port,baud=args.baud, debug=args.debug,
+                     wire_format=args.wire, transport=args.transport, bauds=link_bauds(args.max_baud),
+                     clock_sync=True)
 
 
     def on_receive(msg):
-        sd = string_to_sensor_data(msg)
+        sd = decode_sensor_data(msg)
 
 
         # Update knobs
@@ -46,15 +65,19 @@ if __name__ == "__main__":
         # Update sliders
         for i, slider in enumerate(panel.sliders):
             slider.update_cur_val(sd.motor_encoders[i+2]*360/512)  # slider maps to motor_encoders[2,3]
-        
-        #Update logbox ONLY when log message changes
-        if sd.system_log and sd.system_log != panel._last_log_message:
-            panel.logbox.add_line(sd.system_log)
-            panel._last_log_message = sd.system_log
+
+
+    #Update logbox ONLY when log message changes (SerialManager tracks it)
+    def on_log(text):
+        panel.logbox.add_line(text)
+        panel._last_log_message = text
 
 
     sm.on_receive = on_receive
+    sm.on_log = on_log
     sm.start()
+    if args.record:
+        sm.start_recording(args.record)
 
     running = True
     while running:
@@ -5,7 +5,7 @@ import random
 import argparse
 import os
 
-from communication.mux_tx_rx import SerialManager
+from communication.mux_tx_rx import SerialManager, link_bauds
 from communication.protocol import SensorData, sensor_data_to_string
 
 # Function to update motor encoders data
@@ -95,8 +95,12 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Motor Mockup (B) Serial Script")
     parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
     parser.add_argument("--port", "-p", default="/dev/ttyACM0", help="Serial port to use when not simulating (e.g. /dev/ttyACM0)")
-    parser.add_argument("--baud", "-b", type=int, default=19200, help="Baud rate for the serial connection")
+    parser.add_argument("--baud", "-b", type=int, default=19200, help="Opening baud rate (the dashboard may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate to offer the host in the startup handshake")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
+    parser.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport (shm = shared memory, same host only)")
+    parser.add_argument("--delta", type=int, default=25, help="In binary mode, send only changed fields with a full keyframe every N frames (0 = off)")
+    parser.add_argument("--wire", "-w", choices=['csv', 'binary', 'auto'], default='auto', help="Wire format (auto = switch to binary if the dashboard asks for it)")
     return parser.parse_args()
 
 
@@ -107,7 +111,9 @@ if __name__ == "__main__":
 
     # Serial manager
     sm = SerialManager(simulate=args.simulate, name='A',port=args.port,
-                       baud=args.baud, debug=args.debug)
+                       baud=args.baud, debug=args.debug, wire_format=args.wire,
+                       transport=args.transport, delta_keyframes=args.delta,
+                       handshake='device', bauds=link_bauds(args.max_baud), device_time=True)
     sm.start()
 
     # SensorData instance
@@ -142,9 +148,11 @@ if __name__ == "__main__":
     try:
         while True:
             with lock:
-                msg = sensor_data_to_string(sd)
-            print(msg)
-            sm.send(msg)
+                if args.debug:
+                    msg = sensor_data_to_string(sd)
+                sm.send_sensor_data(sd)
+            if args.debug:
+                print(msg)  # a line per frame slows long runs down, only when debugging
             time.sleep(update_period / 1000)
     except KeyboardInterrupt:
         sm.stop()
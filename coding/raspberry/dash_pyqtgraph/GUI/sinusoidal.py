@@ -6,10 +6,12 @@ from .demo import run_widget_demo
 
 
 class Sinusoidal(Widget):
-    """class to draw imu graphs (3 graphs in one plot)"""
-    def __init__(self, title, data, pos, size, x_range, y_range):
+    """class to draw imu graphs (3 graphs in one plot), or with 'history'
+    (a MinMaxPyramid) every sample since the start, zoomable with the mouse"""
+    def __init__(self, title, data, pos, size, x_range, y_range, history=None):
         super().__init__(title=title, data=data, pos=pos, size=size,
                          x_range=x_range, y_range=y_range)
+        self.history = history
 
 
     def draw(self, scene):
@@ -27,6 +29,10 @@ class Sinusoidal(Widget):
         for i in range(0,3):
             self.last_item.append(self.p.plot(list(self.data[i + self.item_no])[i:self.window], pen=pg.mkPen(self.colors[i], width=2), name = self.names[i]))
         self.p.setRange(xRange=[0, self.window], yRange=self.y_range)
+        if self.history is not None:
+            # zoom/pan in time only, double click (or the 'A' button) to see everything again
+            self.p.setMouseEnabled(x=True, y=False)
+            self.p.enableAutoRange(x=True)
 
         self.p.setPos(self.pos[0], self.pos[1])
         self.p.getViewBox().setFixedWidth(self.size[0])
@@ -36,6 +42,9 @@ class Sinusoidal(Widget):
 
 
     def update(self, has_data, new_data):
+        if self.history is not None:
+            self.update_history()
+            return
         if has_data:
             self.data = new_data
             for item in self.last_item:
@@ -45,6 +54,21 @@ class Sinusoidal(Widget):
                 self.last_item[i] = self.p.plot(list(self.data[i + self.item_no])[i:self.window], pen=pg.mkPen(self.colors[i], width=2), name = self.names[i])
 
 
+    def update_history(self):
+        """redraw from the history: all of it, or the zoomed-in time range"""
+        if len(self.history) < 2:
+            return
+        t_start = self.history.times[0]
+        max_points = 2 * self.size[0]
+        if self.p.getViewBox().autoRangeEnabled()[0]:
+            x, y = self.history.view(max_points=max_points)
+        else:
+            x0, x1 = self.p.viewRange()[0]
+            x, y = self.history.view_time(t_start + x0, t_start + x1, max_points=max_points)
+        for i in range(0,3):
+            self.last_item[i].setData(x[:, i + self.item_no] - t_start, y[:, i + self.item_no])
+
+
 def main():
     """Entry for standalone demo"""
     anchor_x = 50
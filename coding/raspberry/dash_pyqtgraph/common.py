@@ -1,11 +1,17 @@
-from dataclasses import dataclass, field
-
-@dataclass
-class SensorDataPy:
-    """data class for Python (Raspberry) side"""
-    motor_encoders: list[int] = field(default_factory=lambda: [0] * 4)
-    home_switches: list[bool] = field(default_factory=lambda: [False] * 4)
-    potentiometers: list[int] = field(default_factory=lambda: [0] * 2)
-    ref_diode: int = 0
-    temp_sensor: float = 0.0
-    imu: list[float] = field(default_factory=lambda: [0.0] * 6)
\ No newline at end of file
+from communication import schema
+
+_SCHEMA = schema.load_schema()
+_COLUMNS = schema.csv_columns(_SCHEMA)
+
+# data class for Python (Raspberry) side, fields generated from sensor_data.json
+SensorDataPy = schema.make_dataclass(_SCHEMA, "SensorDataPy",
+                                     doc="data class for Python (Raspberry) side")
+
+
+def update_from(sd_py, sensor):
+    """copy every field of a decoded SensorData into sd_py, lists in place"""
+    for name, count in _COLUMNS:
+        if count > 1:
+            getattr(sd_py, name)[:] = getattr(sensor, name)[:]
+        else:
+            setattr(sd_py, name, getattr(sensor, name))
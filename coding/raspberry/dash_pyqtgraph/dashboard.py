@@ -12,7 +12,11 @@ from collections import deque
 import pyqtgraph as pg
 from PyQt6 import QtCore
 
-from communication.mux_tx_rx import SerialManager
+from communication.mux_tx_rx import SerialManager, link_bauds
+from communication.broker import BrokerClient, BROKER_PATH
+from communication.process_link import ProcessSerialManager
+from communication.protocol import decode_sensor_data
+from communication.decimate import MinMaxPyramid
 # from dash_pyqtgraph import GUI
 from dash_pyqtgraph.GUI.knob import Knob
 from dash_pyqtgraph.GUI.slider import Slider
@@ -22,7 +26,7 @@ from dash_pyqtgraph.GUI.color_bar import ColorBar
 from dash_pyqtgraph.GUI.detector_window import DetectorWindow
 from dash_pyqtgraph.GUI.log_window import LogWindow
 from dash_pyqtgraph.GUI.widget import WHITE, BLACK, Q_SIZE, UPDATE_PERIOD, MAX_LOG_LEN
-from dash_pyqtgraph.common import SensorDataPy
+from dash_pyqtgraph.common import SensorDataPy, update_from
 
 # setups for logging to console
 console_logger = logging.getLogger("Dashboard")
@@ -42,6 +46,8 @@ imu_queue_list = [deque([], Q_SIZE),
                   deque([], Q_SIZE),
                   deque([], Q_SIZE),
                   deque([], Q_SIZE),]
+# every IMU sample since the start, min/max decimated for the plots (--history)
+imu_history = MinMaxPyramid(channels=6, timed=True)
 log_buffer = deque(maxlen = MAX_LOG_LEN)
 counter = 0
 
@@ -52,26 +58,9 @@ def extract_data(sd, recv_msg):
     if recv_msg is not None:
         has_data = True
 
-        offset = 0
-        msg = recv_msg.split(",")
-        for i in range(0,4):
-            sd.motor_encoders[i] = int(msg[i])
-
-        offset = 4
-        for i in range(4,8):
-            sd.home_switches[i - offset] = True if msg[i] == "1" else False
-
-        offset = 8
-        for i in range(8,10):
-            sd.potentiometers[i - offset] = int(msg[i])
-
-        sd.ref_diode = int(msg[10])
-        sd.temp_sensor = float(msg[11])
-
-        offset = 12
-        for i in range(12,18):
-            sd.imu[i - offset] = float(msg[i])
-            imu_queue_list[i - offset].append(float(msg[i]))
+        update_from(sd, decode_sensor_data(recv_msg))
+        for i, value in enumerate(sd.imu):
+            imu_queue_list[i].append(value)
 
         counter += 1
         log = f"{counter} Received sensor data: {sd}"
@@ -89,27 +78,45 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Motor Mockup (B) Serial Script")
     parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
     parser.add_argument("--port", "-p",default="/dev/ttyACM0", help="Serial port to use when not simulating (e.g. /dev/ttyACM0)")
-    parser.add_argument("--baud", "-b",type=int, default=38400, help="Baud rate for the serial connection")
+    parser.add_argument("--baud", "-b",type=int, default=38400, help="Opening baud rate (the startup handshake may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate the startup handshake may switch to (default: any the device offers)")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
     parser.add_argument("--name", "-n", choices=['A', 'B'], required=True, help="Name of this node (A or B) for simulation mode")
+    parser.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport (shm = shared memory, same host only)")
+    parser.add_argument("--broker", nargs="?", const=BROKER_PATH, default=None, help="Share the link of a running broker (python -m communication.broker) instead of opening the port")
+    parser.add_argument("--process", action="store_true", help="Run the serial I/O in a child process on its own core, so rendering does not delay it")
+    parser.add_argument("--history", action="store_true", help="IMU plots show everything since the start (zoom with the mouse) instead of the last samples")
     return parser.parse_args()
 
 
 def recv_msgs(args):
     """function to receive messages from the server"""
-    sm = SerialManager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name)
+    if args.broker:
+        sm = BrokerClient(args.broker)
+    else:
+        manager = ProcessSerialManager if args.process else SerialManager
+        sm = manager(simulate=args.simulate, port=args.port, baud=args.baud, name=args.name,
+                     transport=args.transport, bauds=link_bauds(args.max_baud))
     sm.start()
     try:
         while True:
-            received_msg = sm.recv()
-            extract_data(sd, received_msg)
+            # every sample since the last tick, so the IMU plots don't alias
+            received = sm.recv_batch(times=True)
+            imu_rows = []
+            for _, received_msg in received:
+                extract_data(sd, received_msg)
+                imu_rows.append(list(sd.imu))
+            if args.history and received:
+                imu_history.append(imu_rows, [t for t, _ in received])
+            if not received:
+                extract_data(sd, None)
             time.sleep(UPDATE_PERIOD / 1000)
     except KeyboardInterrupt:
         print(f"Ctrl+C pressed — stopping {args.name}")
         sm.stop()
 
 
-def draw_dashboard(scene, view, app):
+def draw_dashboard(scene, view, app, history=None):
     """function to draw the whole dashboard"""
     # allow ctrl + C to work while app.exec() is running
     signal.signal(signal.SIGINT, signal.SIG_DFL)
@@ -164,10 +171,10 @@ def draw_dashboard(scene, view, app):
     margin = 40
     accelerator_plot = Sinusoidal("Accelerator", imu_queue_list,
                                   [anchor_x, anchor_y], [size_x, size_y],
-                                  [], [-1, 1])
+                                  [], [-1, 1], history=history)
     gyroscope_plot = Sinusoidal("Gyroscope", imu_queue_list,
                                 [anchor_x + size_x + margin, anchor_y], [size_x, size_y],
-                                [], [-1, 1])
+                                [], [-1, 1], history=history)
     accelerator_plot.draw(scene)
     gyroscope_plot.draw(scene)
     update_functions.append(accelerator_plot.update)
@@ -247,7 +254,7 @@ def main():
             t.start()
 
         # draw in main thread
-        draw_dashboard(scene, view, app)
+        draw_dashboard(scene, view, app, imu_history if args.history else None)
 
     except KeyboardInterrupt:
         view.close()
@@ -1,5 +1,7 @@
 from demo_fair.GUI import ui
-from communication.mux_tx_rx import SerialManager
+from communication.mux_tx_rx import SerialManager, link_bauds
+from communication.broker import BrokerClient, BROKER_PATH
+from communication import protocol
 import threading
 import time
 import argparse
@@ -11,8 +13,11 @@ def parse_args():
     parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
     parser.add_argument("--port", "-p",default="/dev/ttyACM0", help="Serial port to use when not simulating (e.g. /dev/ttyACM0)")
     parser.add_argument("--routine", "-r",default="all", help="Routine: all | light | detector")
-    parser.add_argument("--baud", "-b",type=int, default=19200, help="Baud rate for the serial connection")
+    parser.add_argument("--baud", "-b",type=int, default=19200, help="Opening baud rate (the startup handshake may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate the startup handshake may switch to (default: any the device offers)")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
+    parser.add_argument("--wire", "-w", choices=['csv', 'binary', 'auto'], default='binary', help="Wire format (binary falls back to CSV for older firmware)")
+    parser.add_argument("--broker", nargs="?", const=BROKER_PATH, default=None, help="Share the link of a running broker (python -m communication.broker) instead of opening the port")
     return parser.parse_args()
 
 
@@ -22,8 +27,13 @@ if __name__ == "__main__":
     # Create the control panel
     ctrl_panel = ui.Panel(width=args.width, height=args.height, fps=60, routine=args.routine)
 
-    # Create SerialManager (name='A')
-    sm = SerialManager(simulate=args.simulate, name='A', port=args.port, baud=args.baud, debug=args.debug)
+    # Create SerialManager (name='A'); setpoints go over the reliable command channel
+    # (the broker's link has it reliable too)
+    if args.broker:
+        sm = BrokerClient(args.broker, debug=args.debug)
+    else:
+        sm = SerialManager(simulate=args.simulate, name='A', port=args.port, baud=args.baud, debug=args.debug,
+                           wire_format=args.wire, reliable_channels=(protocol.CH_COMMAND,), bauds=link_bauds(args.max_baud))
 
     # Callback for received messages from B
     def on_receive(msg):
@@ -61,8 +71,9 @@ if __name__ == "__main__":
                 msg = f"{val1:.1f},{val2:.1f},{val3:.1f},{val4:.1f}"
 
                 # Only send if different from last one
-                if msg != last_msg:
-                    sm.send(msg)
+                # (a newer setpoint replaces one still waiting in the TX queue;
+                # once sent, it is retransmitted until the mockup acks it)
+                if msg != last_msg and sm.send(msg, key="setpoint", channel=protocol.CH_COMMAND):
                     last_msg = msg
 
             except Exception as e:
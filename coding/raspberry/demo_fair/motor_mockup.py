@@ -1,7 +1,8 @@
 import threading
 import time
 import argparse
-from communication.mux_tx_rx import SerialManager
+from communication.mux_tx_rx import SerialManager, link_bauds
+from communication import protocol
 
 
 # Update desired values based on data received
@@ -35,8 +36,10 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Motor Mockup (B) Serial Script")
     parser.add_argument("--simulate", "-s", action="store_true", help="Run in simulation (file-based) mode instead of real serial")
     parser.add_argument("--port", "-p",default="/dev/ttyACM0", help="Serial port to use when not simulating (e.g. /dev/ttyACM0)")
-    parser.add_argument("--baud", "-b",type=int, default=19200, help="Baud rate for the serial connection")
+    parser.add_argument("--baud", "-b",type=int, default=19200, help="Opening baud rate (the control panel may switch to a faster one)")
+    parser.add_argument("--max-baud", type=int, default=None, help="Highest baud rate to offer the host in the startup handshake")
     parser.add_argument("--debug", "-d", action="store_true", help="Debug mode?")
+    parser.add_argument("--wire", "-w", choices=['csv', 'binary', 'auto'], default='auto', help="Wire format (auto = switch to binary if the control panel asks for it)")
     return parser.parse_args()
 
 
@@ -46,12 +49,15 @@ def main():
     args = parse_args()
 
     # Initialize variables
-    sm = SerialManager(simulate=args.simulate, name='B', port=args.port, baud=args.baud, debug=args.debug)
+    sm = SerialManager(simulate=args.simulate, name='B', port=args.port, baud=args.baud, debug=args.debug,
+                       wire_format=args.wire, handshake='device', bauds=link_bauds(args.max_baud))
     cur_val = [0.0, 0.0, 0.0, 0.0] # Current Values (Motor Angular Positions)
     des_val = [0.0, 0.0, 0.0, 0.0] # Desired Values (Motor Angular Positions)
     lock = threading.Lock()
 
-    # Assign on_receive callback
+    # Assign callbacks: setpoints arrive on the (reliable) command channel,
+    # or as plain CSV lines if the link stayed on CSV
+    sm.set_receiver(protocol.CH_COMMAND, lambda msg: on_receive(msg, des_val, lock))
     sm.on_receive = lambda msg: on_receive(msg, des_val, lock)
     sm.start()
 
@@ -64,7 +70,7 @@ def main():
         while True:
             with lock:
                 msg = ','.join(f"{v:.1f}" for v in cur_val)
-            sm.send(msg)
+            sm.send(msg, key="position")  # only the latest position is worth sending
             time.sleep(update_period/1000) 
     except KeyboardInterrupt:
         sm.stop()
@@ -17,6 +17,7 @@ def parse_args():
                         help="Simulation node name (A = sender, B = receiver)")
     parser.add_argument("--debug", "-d", action="store_true", help="Enable debug logs")
     parser.add_argument("--period", "-p", type=int, default=50, help="Send period in ms")
+    parser.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport (shm = shared memory, same host only)")
     return parser.parse_args()
 
 # Thread: continuously update IMU data
@@ -73,7 +74,7 @@ def mock_imu_sender(sm: SerialManager, user_debug=False, period_ms=50):
 
 if __name__ == "__main__":
     args = parse_args()
-    sm = SerialManager(simulate=True, name=args.name, debug=args.debug)
+    sm = SerialManager(simulate=True, name=args.name, debug=args.debug, transport=args.transport)
     user_debug = args.debug
 
     sm.start()
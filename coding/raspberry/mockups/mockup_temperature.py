@@ -20,6 +20,7 @@ def parse_args():
     parser = argparse.ArgumentParser(description="Temperature bar mockup")
     parser.add_argument("--name", "-n", choices=['A', 'B'], required=True, help="Simulation node name(A = sender, B = reciever)")
     parser.add_argument("--debug", "-d", action="store_true", help="Enable debug logs")
+    parser.add_argument("--transport", "-t", choices=['file', 'shm'], default='file', help="Simulated transport (shm = shared memory, same host only)")
     return parser.parse_args()
 
 
@@ -55,7 +56,7 @@ if __name__ == "__main__":
     args = parse_args()
 
     #create a SerialManager in simulated mode using fake serial files   
-    sm = SerialManager(simulate=True, name=args.name, debug=False)
+    sm = SerialManager(simulate=True, name=args.name, debug=False, transport=args.transport)
     #sm = SerialManager(port="/dev/ttyACM0", baud=19200 simulate=False, name=args.name, debug=False) # set simulate to False to use real serial port 
     user_debug = args.debug
 